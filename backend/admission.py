@@ -0,0 +1,177 @@
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+from fastapi import HTTPException
+from backend.config import settings
+import asyncio
+import math
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class QueueFull(Exception):
+    """No slot and no room to wait; the caller should answer 429 with Retry-After"""
+
+    def __init__(self, backend: str, retry_after: int):
+        super().__init__(f"LLM backend {backend} is busy, retry in {retry_after}s")
+        self.backend = backend
+        self.retry_after = retry_after
+
+class QueueTimeout(Exception):
+    pass
+
+def backend_limits(model: str) -> Tuple[int, int]:
+    """(concurrency, queue size) for a model: LLM_MODEL_LIMITS overrides, else the defaults"""
+    limits = settings.LLM_MODEL_LIMITS.get(model, {})
+    return (
+        max(int(limits.get("concurrency", settings.LLM_MAX_CONCURRENCY)), 1),
+        max(int(limits.get("queue", settings.LLM_MAX_QUEUE)), 0)
+    )
+
+class Ticket:
+    """One request's place at a backend: running, waiting in line, or done.
+
+    Created by ``BackendLimiter.admit``; must be released exactly once
+    (``release`` is idempotent), whether or not the slot was ever granted.
+    """
+
+    def __init__(self, limiter: "BackendLimiter"):
+        self.limiter = limiter
+        self.granted = False
+        self.released = False
+        self.started_at: Optional[float] = None
+        self._moved = asyncio.Event()
+
+    @property
+    def position(self) -> int:
+        """1-based place in the queue; 0 once running"""
+        if self.granted:
+            return 0
+        return self.limiter.waiters.index(self) + 1
+
+    async def wait(self, timeout: Optional[float] = None) -> AsyncIterator[int]:
+        """Yield the queue position each time it changes until a slot is granted.
+
+        Yields nothing when a slot was free straight away. Raises QueueTimeout
+        (and gives up the place in line) after ``timeout`` seconds.
+        """
+        timeout = settings.LLM_QUEUE_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        reported = None
+        while not self.granted:
+            if self.position != reported:
+                reported = self.position
+                yield reported
+            self._moved.clear()
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                await asyncio.wait_for(self._moved.wait(), remaining)
+            except asyncio.TimeoutError:
+                if self.granted:
+                    break
+                self.release()
+                raise QueueTimeout(f"Waited {timeout:.0f}s for LLM backend {self.limiter.name}")
+
+    async def acquire(self, timeout: Optional[float] = None):
+        """Wait for a slot without reporting progress"""
+        async for _ in self.wait(timeout):
+            pass
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.limiter._release(self)
+
+class BackendLimiter:
+    """Concurrency cap with a bounded FIFO wait queue for one LLM backend.
+
+    Only used from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queue: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiters: Deque[Ticket] = deque()
+        self.rejected = 0
+        self._duration = settings.LLM_RETRY_AFTER  # moving average of seconds a request holds a slot
+
+    def retry_after(self) -> int:
+        """Seconds until a rejected request is likely to find room: the time to drain the queue"""
+        drain = self._duration * (len(self.waiters) + 1) / self.concurrency
+        return max(1, math.ceil(drain))
+
+    def admit(self) -> Ticket:
+        """Take a slot or a place in line straight away; raises QueueFull otherwise"""
+        ticket = Ticket(self)
+        if self.active < self.concurrency and not self.waiters:
+            self._grant(ticket)
+        elif len(self.waiters) < self.max_queue:
+            self.waiters.append(ticket)
+        else:
+            self.rejected += 1
+            raise QueueFull(self.name, self.retry_after())
+        return ticket
+
+    def _grant(self, ticket: Ticket):
+        self.active += 1
+        ticket.granted = True
+        ticket.started_at = time.monotonic()
+        ticket._moved.set()
+
+    def _release(self, ticket: Ticket):
+        if ticket.granted:
+            self.active -= 1
+            self._duration = 0.8 * self._duration + 0.2 * (time.monotonic() - ticket.started_at)
+        else:
+            self.waiters.remove(ticket)
+        while self.waiters and self.active < self.concurrency:
+            self._grant(self.waiters.popleft())
+        # Everyone still waiting moved up (or a waiter left)
+        for waiter in self.waiters:
+            waiter._moved.set()
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "queued": len(self.waiters),
+            "max_queue": self.max_queue,
+            "rejected": self.rejected
+        }
+
+class AdmissionController:
+    """One limiter per LLM backend (base URL and model)"""
+
+    def __init__(self):
+        self._limiters: Dict[Tuple[str, str], BackendLimiter] = {}
+
+    def limiter(self, model: str, base_url: Optional[str] = None) -> BackendLimiter:
+        key = (base_url or "", model)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            concurrency, max_queue = backend_limits(model)
+            limiter = BackendLimiter(f"{model}@{base_url or 'default'}", concurrency, max_queue)
+            self._limiters[key] = limiter
+            logger.info(f"LLM backend {limiter.name}: {concurrency} concurrent, {max_queue} queued")
+        return limiter
+
+    def admit(self, model: str, base_url: Optional[str] = None) -> Ticket:
+        return self.limiter(model, base_url).admit()
+
+    def stats(self) -> list:
+        return [limiter.stats() for limiter in self._limiters.values()]
+
+admission = AdmissionController()
+
+def admit_or_reject(model: str, base_url: Optional[str] = None) -> Ticket:
+    """Admit a request to its backend, or fail fast with 429 and a Retry-After estimate"""
+    try:
+        return admission.admit(model, base_url)
+    except QueueFull as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
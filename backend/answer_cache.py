@@ -0,0 +1,152 @@
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from sqlalchemy.orm import Session
+from backend.config import settings
+from backend.models import Document
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import unicodedata
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Trailing punctuation that does not change what is being asked
+_TRAILING_PUNCTUATION = "?？!！.。…~～ "
+
+def normalize_question(question: str) -> str:
+    """Fold width, case and whitespace so trivially different spellings share an entry"""
+    text = unicodedata.normalize("NFKC", question).casefold()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(_TRAILING_PUNCTUATION)
+
+def document_set_fingerprint(db: Session, notebook_id: int) -> str:
+    """Hash of the notebook's completed documents and the content they were extracted from.
+
+    Changes when a document finishes processing, is removed, or is
+    re-extracted, so answers cached against an older set are never replayed.
+    """
+    rows = db.query(Document.id, Document.content_hash, Document.extractor_version).filter(
+        Document.notebook_id == notebook_id,
+        Document.status == "completed"
+    ).order_by(Document.id).all()
+    digest = hashlib.sha256()
+    for document_id, content_hash, version in rows:
+        digest.update(f"{document_id}:{content_hash or ''}:{version or 1};".encode("utf-8"))
+    return digest.hexdigest()
+
+def cache_key(question: str, fingerprint: str, model: str, prompt_version: int) -> str:
+    payload = json.dumps([normalize_question(question), fingerprint, model, prompt_version], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class AnswerCache:
+    """Finished answers by exact question, in an LRU with a TTL and an optional disk tier.
+
+    Entries are grouped per notebook so that adding or removing a document
+    can drop the notebook's answers at once. The disk tier (ANSWER_CACHE_DIR)
+    survives restarts and is shared by every process using the directory;
+    entries read from it are promoted to memory. Blocking when the disk tier
+    is on, so async callers use the threadpool.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[float] = None, directory: Optional[str] = None):
+        self.max_entries = settings.ANSWER_CACHE_SIZE if max_entries is None else max_entries
+        self.ttl = settings.ANSWER_CACHE_TTL if ttl is None else ttl
+        self.directory = settings.ANSWER_CACHE_DIR if directory is None else directory
+        self._entries: "OrderedDict[Tuple[int, str], Tuple[str, float]]" = OrderedDict()  # -> (answer, stored at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _expired(self, stored_at: float) -> bool:
+        return bool(self.ttl) and time.time() - stored_at > self.ttl
+
+    def _path(self, notebook_id: int, key: str) -> str:
+        return os.path.join(self.directory, f"notebook_{notebook_id}", f"{key}.json")
+
+    def _read_disk(self, notebook_id: int, key: str) -> Optional[Tuple[str, float]]:
+        path = self._path(notebook_id, key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if self._expired(entry["stored_at"]):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry["answer"], entry["stored_at"]
+
+    def _write_disk(self, notebook_id: int, key: str, answer: str, stored_at: float):
+        path = self._path(notebook_id, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"answer": answer, "stored_at": stored_at}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _remember(self, notebook_id: int, key: str, answer: str, stored_at: float):
+        """Add to memory, evicting the least recently used beyond max_entries. Holds the lock."""
+        self._entries[(notebook_id, key)] = (answer, stored_at)
+        self._entries.move_to_end((notebook_id, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, notebook_id: int, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get((notebook_id, key))
+            if entry and self._expired(entry[1]):
+                del self._entries[(notebook_id, key)]
+                entry = None
+            if entry:
+                self._entries.move_to_end((notebook_id, key))
+                self.hits += 1
+                return entry[0]
+        if self.directory:
+            entry = self._read_disk(notebook_id, key)
+            if entry:
+                with self._lock:
+                    self._remember(notebook_id, key, *entry)
+                    self.hits += 1
+                return entry[0]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, notebook_id: int, key: str, answer: str):
+        stored_at = time.time()
+        with self._lock:
+            self._remember(notebook_id, key, answer, stored_at)
+        if self.directory:
+            try:
+                self._write_disk(notebook_id, key, answer, stored_at)
+            except OSError as e:
+                logger.warning(f"Could not write cached answer to {self.directory}: {e}")
+
+    def invalidate_notebook(self, notebook_id: int):
+        """Forget every answer about a notebook, e.g. when its documents change"""
+        with self._lock:
+            for entry in [entry for entry in self._entries if entry[0] == notebook_id]:
+                del self._entries[entry]
+        if self.directory:
+            shutil.rmtree(os.path.join(self.directory, f"notebook_{notebook_id}"), ignore_errors=True)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.directory:
+            for name in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+                if name.startswith("notebook_"):
+                    shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+answer_cache = AnswerCache()
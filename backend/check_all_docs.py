@@ -15,7 +15,7 @@ def check_all_documents():
         print(f"\n=== 数据库中共有 {len(all_docs)} 个文档 ===\n")
         
         for doc in all_docs:
-            content_length = len(doc.content) if doc.content else 0
+            content_length = doc.text.size if doc.text else 0
             print(f"文档 ID: {doc.id}")
             print(f"  笔记本 ID: {doc.notebook_id}")
             print(f"  文件名: {doc.filename}")
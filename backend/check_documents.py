@@ -7,6 +7,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from backend.database import SessionLocal
 from backend.models import Document, Notebook
+from backend.storage import get_document_text
 
 def check_documents():
     db = SessionLocal()
@@ -20,13 +21,14 @@ def check_documents():
             print(f"  文档数量: {len(documents)}")
             
             for doc in documents:
-                content_length = len(doc.content) if doc.content else 0
+                content = get_document_text(db, doc.id)
+                content_length = len(content) if content else 0
                 print(f"  - 文档 ID: {doc.id}")
                 print(f"    文件名: {doc.filename}")
                 print(f"    状态: {doc.status}")
                 print(f"    内容长度: {content_length} 字符")
-                if doc.content:
-                    print(f"    内容预览: {doc.content[:100]}...")
+                if content:
+                    print(f"    内容预览: {content[:100]}...")
                 else:
                     print(f"    内容: 无内容")
                 print()
@@ -0,0 +1,45 @@
+"""
+统计每个文档上传文件与提取文本的 token 数，查看 HTML 等格式归一化后节省的 token
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.database import SessionLocal
+from backend.models import Document
+from backend.ingestion import token_report
+from backend.tokens import configured_model, get_tokenizer
+
+def check_token_savings():
+    db = SessionLocal()
+    try:
+        documents = db.query(Document).filter(Document.status == "completed").order_by(Document.id).all()
+        print(f"\n=== {len(documents)} 个已完成的文档 ===\n")
+        if not documents:
+            return
+        print(f"分词器: {get_tokenizer(configured_model(db)).name}\n")
+        print(f"{'ID':>6}  {'类型':<16}{'版本':>4}{'文件 tokens':>14}{'文本 tokens':>14}{'节省':>12}{'比例':>8}  文件名")
+
+        total_file = total_text = 0
+        for document in documents:
+            report = token_report(db, document)
+            file_tokens = report["file_tokens"]
+            if file_tokens is None:
+                file_column, saved_column, ratio_column = "-", "-", "-"
+            else:
+                total_file += file_tokens
+                total_text += report["text_tokens"]
+                file_column = str(file_tokens)
+                saved_column = str(report["saved_tokens"])
+                ratio_column = f"{report['reduction']:.1%}" if report["reduction"] is not None else "-"
+            print(f"{document.id:>6}  {document.file_type:<16}{report['extractor_version']:>4}{file_column:>14}"
+                  f"{report['text_tokens']:>14}{saved_column:>12}{ratio_column:>8}  {document.filename}")
+
+        if total_file:
+            print(f"\n文本类文档合计: 文件 {total_file} tokens, 文本 {total_text} tokens, "
+                  f"节省 {total_file - total_text} ({1 - total_text / total_file:.1%})")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    check_token_savings()
@@ -0,0 +1,135 @@
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+from backend.config import settings
+import bisect
+import re
+
+# Preferred places to end a chunk, strongest first
+_BREAKS = ["\n\n", "\n", "。", "！", "？", ". ", "! ", "? ", "；", "; ", "，", ", ", " "]
+
+CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_CJK_RE = re.compile(f"[{CJK_RANGES}]")
+_WORD_RE = re.compile(f"[A-Za-z0-9_]+|[^\\sA-Za-z0-9_{CJK_RANGES}]")
+
+@dataclass
+class TextChunk:
+    index: int
+    content: str
+    start_offset: int
+    end_offset: int
+    page_number: Optional[int] = None
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: one per CJK character, ~1.3 per latin word or symbol"""
+    cjk = len(_CJK_RE.findall(text))
+    other = len(_WORD_RE.findall(text))
+    return cjk + int(other * 1.3 + 0.5)
+
+def _find_break(text: str, start: int, end: int) -> int:
+    """Best position in text[start:end] to end a chunk, searching the last 30%"""
+    floor = start + int((end - start) * 0.7)
+    for separator in _BREAKS:
+        position = text.rfind(separator, floor, end)
+        if position != -1:
+            return position + len(separator)
+    return end
+
+def split_text(
+    text: str,
+    chunk_size: Optional[int] = None,
+    overlap: Optional[int] = None,
+    page_starts: Optional[Sequence[int]] = None
+) -> List[TextChunk]:
+    """Split text into overlapping chunks that end on natural boundaries.
+
+    ``page_starts`` holds the character offset at which each page begins
+    (page 1 first); when given, every chunk records the page it starts on.
+    """
+    chunk_size = chunk_size or settings.CHUNK_SIZE
+    overlap = settings.CHUNK_OVERLAP if overlap is None else overlap
+    overlap = min(overlap, chunk_size // 2)
+
+    chunks = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + chunk_size, length)
+        if end < length:
+            end = _find_break(text, start, end)
+        content = text[start:end]
+        if content.strip():
+            page_number = bisect.bisect_right(page_starts, start) if page_starts else None
+            chunks.append(TextChunk(len(chunks), content, start, end, page_number))
+        if end >= length:
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+class StreamingSplitter:
+    """split_text for text that arrives section by section.
+
+    Chunks are returned as soon as enough text has arrived to know where
+    they end, and text before the next chunk's start is dropped, so memory
+    stays proportional to the chunk size. The chunks are exactly those
+    split_text would produce for the sections joined with ``separator``.
+    """
+
+    def __init__(self, chunk_size: Optional[int] = None, overlap: Optional[int] = None, separator: str = "\n"):
+        self.chunk_size = chunk_size or settings.CHUNK_SIZE
+        overlap = settings.CHUNK_OVERLAP if overlap is None else overlap
+        self.overlap = min(overlap, self.chunk_size // 2)
+        self.separator = separator
+        self.page_starts: List[int] = []
+        self.length = 0  # characters received so far
+        self._buffer = ""
+        self._buffer_start = 0  # offset of _buffer[0] in the whole text
+        self._start = 0  # offset where the next chunk begins
+        self._count = 0
+
+    def add_section(self, text: str) -> List[TextChunk]:
+        """Append the next section and return the chunks completed by it"""
+        if self.page_starts:
+            self._append(self.separator)
+        self.page_starts.append(self.length)
+        self._append(text)
+        return self._split(final=False)
+
+    def finish(self) -> List[TextChunk]:
+        """Return the remaining chunks once all text has arrived"""
+        return self._split(final=True)
+
+    def _append(self, text: str):
+        self._buffer += text
+        self.length += len(text)
+
+    def _split(self, final: bool) -> List[TextChunk]:
+        chunks = []
+        buffer, base = self._buffer, self._buffer_start
+        # Mid-stream a chunk is only cut once the text runs past its maximal end,
+        # which is exactly when split_text would look for a break
+        while self._start < self.length and (final or self._start + self.chunk_size < self.length):
+            start = self._start - base
+            end = min(start + self.chunk_size, len(buffer))
+            if end < len(buffer):
+                end = _find_break(buffer, start, end)
+            content = buffer[start:end]
+            if content.strip():
+                page_number = bisect.bisect_right(self.page_starts, self._start)
+                chunks.append(TextChunk(self._count, content, self._start, base + end, page_number))
+                self._count += 1
+            if base + end >= self.length:
+                self._start = self.length
+                break
+            self._start = max(base + end - self.overlap, self._start + 1)
+        self._buffer = buffer[self._start - base:]
+        self._buffer_start = self._start
+        return chunks
+
+def page_starts_for(page_texts: Sequence[str], separator: str = "\n") -> List[int]:
+    """Offsets where each page begins in ``separator.join(page_texts)``"""
+    starts = []
+    offset = 0
+    for text in page_texts:
+        starts.append(offset)
+        offset += len(text) + len(separator)
+    return starts
@@ -10,6 +10,9 @@ class Settings(BaseSettings):
     
     # File Upload
     MAX_UPLOAD_SIZE: int = 10 * 1024 * 1024  # 10MB
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024  # bytes copied per read while streaming uploads
+    MAX_BATCH_FILES: int = 500  # files per batch upload, counting archive members
+    MAX_ARCHIVE_SIZE: int = 500 * 1024 * 1024  # total uncompressed size of one zip upload
     ALLOWED_FILE_TYPES: list = [
         "application/pdf",
         "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
@@ -18,6 +21,79 @@ class Settings(BaseSettings):
         "text/html"
     ]
     
+    # Document extraction
+    EXTRACTION_WORKERS: int = 0  # size of the extraction process pool, 0 = one per CPU
+    EXTRACTION_TIMEOUT: int = 300  # seconds before a single extraction job is abandoned
+    DOCUMENT_TEXT_COMPRESSION: str = "zlib"  # none, zlib or zstd (needs the zstandard package)
+    PDF_PAGE_BATCH_SIZE: int = 25  # max pages per parallel PDF batch (also the checkpoint granularity)
+    TEXT_PAGE_CHARS: int = 4000  # size of the sections text files are paged into for previews
+    EXTRACTION_STREAM_BATCH_CHARS: int = 64 * 1024  # text per message from a streaming extractor
+    EXTRACTION_STREAM_BUFFER: int = 8  # messages in flight before a streaming extractor pauses
+    INGEST_BATCH_CHUNKS: int = 256  # chunks embedded and written per batch while a document streams in
+    
+    # Chunking
+    CHUNK_SIZE: int = 800  # target characters per chunk
+    CHUNK_OVERLAP: int = 100  # characters shared by neighbouring chunks
+    
+    # Retrieval
+    CHAT_TOP_K: int = 20  # chunks retrieved per chat question
+    CHAT_CONTEXT_TOKENS: int = 6000  # most knowledge tokens put in a chat prompt
+    CHAT_RETRIEVAL: str = "hybrid"  # bm25, dense or hybrid (reciprocal rank fusion of both)
+    EMBEDDING_BACKEND: str = "hashing"  # see vector_index.register_embedder
+    EMBEDDING_DIM: int = 256
+    VECTOR_INDEX_DIR: Optional[str] = None  # defaults to backend/vectors
+    
+    # Token budgets
+    TOKENIZER: str = "auto"  # auto (tiktoken's encoding for the configured model, if it knows it), estimate, or a tiktoken encoding name
+    LLM_CONTEXT_WINDOW: int = 64000  # tokens the model accepts, prompt and answer together; overridden by llm.context_window
+    PROMPT_TOKEN_MARGIN: int = 512  # tokens kept free for tokenizer differences
+    
+    # Configuration cache
+    CONFIG_CHECK_INTERVAL: float = 1.0  # seconds between checks for changes made by other processes
+    
+    # LLM clients
+    LLM_CLIENT_IDLE_TTL: float = 300.0  # seconds before an unused client and its connections are closed
+    LLM_CLIENT_MAX: int = 16  # pooled clients (distinct configurations) per process
+    LLM_MAX_CONNECTIONS: int = 20  # connections per client
+    LLM_KEEPALIVE_EXPIRY: float = 60.0  # seconds an idle connection is kept open
+    LLM_REQUEST_TIMEOUT: float = 120.0
+    
+    # LLM admission control, per backend (base URL + model)
+    LLM_MAX_CONCURRENCY: int = 8  # requests in flight to one backend
+    LLM_MAX_QUEUE: int = 32  # requests waiting for a slot; beyond this they are rejected with 429
+    LLM_QUEUE_TIMEOUT: float = 60.0  # seconds a request waits in line before giving up
+    LLM_RETRY_AFTER: int = 5  # initial estimate of seconds per request, for Retry-After
+    LLM_MODEL_LIMITS: dict = {}  # per-model overrides, e.g. {"gpt-4o": {"concurrency": 4, "queue": 16}}
+    
+    # LLM call deadlines, retries and hedging (the first-token deadline is LLM_TIMEOUT)
+    LLM_TOTAL_TIMEOUT: float = 300.0  # seconds a whole answer may take
+    LLM_MAX_RETRIES: int = 2  # retries of transient failures, only before the first token
+    LLM_RETRY_BASE_DELAY: float = 0.5  # seconds, doubled per retry, with full jitter
+    LLM_RETRY_MAX_DELAY: float = 8.0
+    LLM_HEDGE: bool = False  # send a second request when the first is slow to start; first to answer wins
+    LLM_HEDGE_AFTER: Optional[float] = None  # seconds before hedging; None = the observed p95 time to first token
+    LLM_HEDGE_MIN_SAMPLES: int = 20  # first-token times observed before the p95 is trusted
+    
+    # Answer cache: a question asked again of the same documents is answered without the LLM
+    ANSWER_CACHE: bool = True
+    ANSWER_CACHE_SIZE: int = 1000  # answers kept in memory, least recently used dropped first
+    ANSWER_CACHE_TTL: float = 24 * 3600.0  # seconds an answer may be replayed, 0 = until its documents change
+    ANSWER_CACHE_DIR: Optional[str] = None  # also keep answers here, across restarts and processes
+    
+    # Document processing queue
+    JOB_WORKER_CONCURRENCY: int = 4  # jobs a single server process works on at once
+    JOB_POLL_INTERVAL: float = 2.0  # seconds between queue polls when idle
+    JOB_LEASE_SECONDS: int = 60  # a claimed job is reclaimable once its lease lapses
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_BASE_DELAY: float = 5.0  # seconds, doubled on every failed attempt
+    JOB_RETRY_MAX_DELAY: float = 300.0
+    MAINTENANCE_LEASE_SECONDS: int = 600  # startup backfills run in one process; others take over after this
+    
+    # Document status events
+    EVENT_POLL_INTERVAL: float = 0.5  # seconds between event table reads while clients listen
+    EVENT_KEEPALIVE: float = 15.0  # seconds between keep-alive comments on idle streams
+    EVENT_RETENTION: int = 3600  # seconds events are kept for reconnecting clients
+    
     # CORS
     CORS_ORIGINS: list = ["http://localhost:5000", "http://localhost:3000"]
     
@@ -26,7 +102,7 @@ class Settings(BaseSettings):
     LLM_MODEL: str = "gpt-3.5-turbo"
     LLM_TEMPERATURE: float = 0.7
     LLM_MAX_TOKENS: int = 2000
-    LLM_TIMEOUT: int = 30
+    LLM_TIMEOUT: int = 30  # seconds to wait for the first token of an answer
     
     class Config:
         env_file = ".env"
@@ -12,3 +12,10 @@ class Config(Base):
     category = Column(String(50), nullable=True)  # llm, system, etc.
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, onupdate=func.now())
+
+class ConfigVersion(Base):
+    """Single-row counter bumped by every configuration write, so each process can tell when its cache is stale"""
+    __tablename__ = "config_versions"
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
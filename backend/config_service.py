@@ -0,0 +1,148 @@
+from sqlalchemy import event as sa_event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional
+from backend.config import settings
+from backend.config_model import Config, ConfigVersion
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Categories and key prefixes read by each consumer; "custom" keys are visible to all
+LLM_CATEGORIES = ("llm", "custom")
+LLM_PREFIXES = ("llm.", "llm_")
+PODCAST_CATEGORIES = ("podcast", "doubao", "custom")
+PODCAST_PREFIXES = ("podcast.", "podcast_", "doubao.", "doubao_")
+
+@dataclass(frozen=True)
+class LLMSettings:
+    api_key: Optional[str]
+    model: str
+    base_url: Optional[str]
+    temperature: float
+    max_tokens: int
+    context_window: int
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """Every configuration value as of one version, read-only"""
+    version: int
+    entries: Mapping[str, Optional[str]]  # raw key -> value
+    llm: Mapping[str, Optional[str]]  # llm./llm_ prefixes removed
+    podcast: Mapping[str, Optional[str]]  # podcast./doubao. prefixes removed
+    llm_settings: LLMSettings
+
+def _normalize(rows, categories, prefixes) -> Dict[str, Optional[str]]:
+    values = {}
+    for key, value, category in rows:
+        if category not in categories:
+            continue
+        for prefix in prefixes:
+            if key.startswith(prefix):
+                key = key[len(prefix):]
+                break
+        values[key] = value
+    return values
+
+def _number(values: Mapping, key: str, convert, default):
+    value = values.get(key)
+    if value in (None, ""):
+        return default
+    try:
+        return convert(value)
+    except ValueError:
+        logger.warning(f"Ignoring invalid configuration value {key}={value!r}")
+        return default
+
+def build_snapshot(version: int, rows) -> ConfigSnapshot:
+    """rows are (key, value, category) tuples"""
+    rows = list(rows)
+    llm = _normalize(rows, LLM_CATEGORIES, LLM_PREFIXES)
+    # The frontend stores the model as model_id
+    if "model_id" in llm and "model" not in llm:
+        llm["model"] = llm["model_id"]
+    llm_settings = LLMSettings(
+        api_key=llm.get("api_key") or None,
+        model=llm.get("model") or "gpt-3.5-turbo",
+        base_url=llm.get("base_url") or None,
+        temperature=_number(llm, "temperature", float, 0.7),
+        max_tokens=_number(llm, "max_tokens", int, 2000),
+        context_window=_number(llm, "context_window", int, settings.LLM_CONTEXT_WINDOW)
+    )
+    return ConfigSnapshot(
+        version=version,
+        entries=MappingProxyType({key: value for key, value, _ in rows}),
+        llm=MappingProxyType(llm),
+        podcast=MappingProxyType(_normalize(rows, PODCAST_CATEGORIES, PODCAST_PREFIXES)),
+        llm_settings=llm_settings
+    )
+
+def current_version(db: Session) -> int:
+    row = db.query(ConfigVersion.version).filter(ConfigVersion.id == 1).first()
+    return row[0] if row else 0
+
+def bump_config_version(db: Session):
+    """Mark the configuration as changed. Call in the transaction that changes it; the caller commits."""
+    updated = db.query(ConfigVersion).filter(ConfigVersion.id == 1).update(
+        {ConfigVersion.version: ConfigVersion.version + 1}, synchronize_session=False
+    )
+    if not updated:
+        try:
+            with db.begin_nested():
+                db.add(ConfigVersion(id=1, version=1))
+        except IntegrityError:
+            # Another process created the row concurrently
+            db.query(ConfigVersion).filter(ConfigVersion.id == 1).update(
+                {ConfigVersion.version: ConfigVersion.version + 1}, synchronize_session=False
+            )
+    db.info["config_changed"] = True
+
+class ConfigService:
+    """Configuration served from an in-memory snapshot.
+
+    Writes in this process drop the snapshot as soon as they commit. Writes
+    in other processes are noticed through the version row, which is read
+    at most once per CONFIG_CHECK_INTERVAL.
+    """
+
+    def __init__(self, check_interval: Optional[float] = None):
+        self.check_interval = settings.CONFIG_CHECK_INTERVAL if check_interval is None else check_interval
+        self._snapshot: Optional[ConfigSnapshot] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, db: Session) -> ConfigSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return snapshot
+            # Version first: the values read after it are at least that new
+            version = current_version(db)
+            if snapshot is None or snapshot.version != version:
+                rows = db.query(Config.key, Config.value, Config.category).all()
+                snapshot = build_snapshot(version, rows)
+                self._snapshot = snapshot
+                logger.info(f"Loaded configuration version {version} ({len(snapshot.entries)} keys)")
+            self._checked_at = time.monotonic()
+            return snapshot
+
+    def invalidate(self):
+        self._snapshot = None
+
+config_service = ConfigService()
+
+@sa_event.listens_for(Session, "after_commit")
+def _drop_snapshot(session):
+    if session.info.pop("config_changed", False):
+        config_service.invalidate()
+
+@sa_event.listens_for(Session, "after_rollback")
+def _forget_change(session):
+    session.info.pop("config_changed", None)
@@ -0,0 +1,126 @@
+"""
+测试共用的环境与夹具
+
+pytest 先于测试模块加载本模块，它把数据库、向量目录和上传文件目录指向一个临时目录，
+所以测试模块可以直接在顶部导入 backend 的各个模块。
+"""
+import os
+import tempfile
+
+# A throwaway database and vector directory; must be set before backend.database is imported
+from backend.config import settings
+_workdir = tempfile.mkdtemp()
+settings.DATABASE_URL = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+settings.VECTOR_INDEX_DIR = os.path.join(_workdir, "vectors")
+
+# Uploaded files too; the store's directories are module constants
+from backend import storage
+storage.BLOB_DIR = os.path.join(_workdir, "blobs")
+storage.INCOMING_DIR = os.path.join(_workdir, "incoming")
+os.makedirs(storage.BLOB_DIR)
+os.makedirs(storage.INCOMING_DIR)
+
+import threading
+import time
+import pytest
+import uvicorn
+
+# Manual scripts that read the developer's own database, not tests
+collect_ignore = ["test_get_llm_config.py"]
+
+def serve(app) -> int:
+    """Run an ASGI app on a free local port in a daemon thread; returns the port.
+
+    Once per app and process: the app's background workers are process-wide,
+    so test modules sharing a pytest run share its server.
+    """
+    if getattr(app.state, "test_port", None):
+        return app.state.test_port
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.02)
+    app.state.test_port = server.servers[0].sockets[0].getsockname()[1]
+    return app.state.test_port
+
+@pytest.fixture(name="api_base", scope="session")
+def api_base_fixture() -> str:
+    """Base URL of the API, served from this process on the throwaway database"""
+    from backend.main import app
+    return f"http://127.0.0.1:{serve(app)}{settings.API_V1_PREFIX}"
+
+@pytest.fixture(scope="session")
+def database():
+    """The throwaway database with its tables and full-text index created"""
+    from backend.database import engine
+    from backend.models import Base
+    from backend.search import create_fts_index
+    Base.metadata.create_all(bind=engine)
+    # Up front: created lazily, it could find the database locked by a test's own transaction
+    create_fts_index()
+    return engine
+
+@pytest.fixture
+def sessions(database):
+    """Opens sessions on demand, e.g. one per thread; all are closed after the test"""
+    from backend.database import SessionLocal
+    opened = []
+
+    def open_session():
+        session = SessionLocal()
+        opened.append(session)
+        return session
+
+    yield open_session
+    for session in opened:
+        session.close()
+
+@pytest.fixture
+def db(sessions):
+    return sessions()
+
+@pytest.fixture
+def new_notebook(db):
+    """Creates a notebook and returns its id"""
+    from backend.models import Notebook
+
+    def create(name: str = "test") -> int:
+        notebook = Notebook(name=name)
+        db.add(notebook)
+        db.flush()
+        notebook_id = notebook.id
+        # Reading the id after the commit would reload the row and hold a connection
+        db.commit()
+        return notebook_id
+
+    return create
+
+@pytest.fixture
+def add_document(db):
+    """Adds a document as processing leaves it and returns its id.
+
+    ``text`` becomes its extracted text and ``pieces``, (start, end) offsets
+    into the text, its chunks, counted by ``tokenizer``.
+    """
+    from backend.chunking import TextChunk
+    from backend.ingestion import add_chunks
+    from backend.models import Document
+    from backend.storage import set_document_text
+
+    def add(notebook_id: int, text: str, status: str = "completed", pieces=(), tokenizer=None) -> int:
+        document = Document(
+            notebook_id=notebook_id, filename="test.txt", file_type="text/plain",
+            file_url="", file_size=len(text.encode("utf-8")), status=status
+        )
+        db.add(document)
+        db.flush()
+        set_document_text(db, document, text)
+        if pieces:
+            add_chunks(db, document, [
+                TextChunk(index, text[start:end], start, end, 1) for index, (start, end) in enumerate(pieces)
+            ], tokenizer)
+        document_id = document.id
+        db.commit()
+        return document_id
+
+    return add
@@ -0,0 +1,203 @@
+from sqlalchemy import event as sa_event
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+from backend.config import settings
+from backend.database import SessionLocal
+from backend.models import Document, DocumentEvent
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+def publish_event(db: Session, document: Document, event: str, status: Optional[str] = None, **data):
+    """Record an event for a document's notebook. The caller commits.
+
+    Events go through the database so that listeners connected to any server
+    process see the changes made by job workers in every other process.
+    """
+    db.add(DocumentEvent(
+        notebook_id=document.notebook_id,
+        document_id=document.id,
+        event=event,
+        status=status,
+        data=json.dumps(data, ensure_ascii=False) if data else None
+    ))
+    db.info["published_events"] = True
+
+@sa_event.listens_for(Session, "after_commit")
+def _wake_broker(session):
+    # Deliver local events right away instead of at the next poll
+    if session.info.pop("published_events", False):
+        event_broker.notify()
+
+@sa_event.listens_for(Session, "after_rollback")
+def _forget_events(session):
+    session.info.pop("published_events", None)
+
+def event_payload(row: DocumentEvent) -> dict:
+    payload = {"document_id": row.document_id, "status": row.status}
+    if row.data:
+        payload.update(json.loads(row.data))
+    return payload
+
+def format_sse(event_id: Optional[int], event: str, payload: dict) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(payload, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+def latest_event_id(db: Session) -> int:
+    last = db.query(DocumentEvent.id).order_by(DocumentEvent.id.desc()).first()
+    return last[0] if last else 0
+
+def events_since(db: Session, notebook_id: int, last_id: int, limit: int = 1000) -> List[DocumentEvent]:
+    return db.query(DocumentEvent).filter(
+        DocumentEvent.notebook_id == notebook_id,
+        DocumentEvent.id > last_id
+    ).order_by(DocumentEvent.id).limit(limit).all()
+
+class Subscription:
+    def __init__(self, notebook_id: int, maxsize: int = 1000):
+        self.notebook_id = notebook_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        # Set when the client fell too far behind; it should reconnect with Last-Event-ID
+        self.overflowed = False
+
+class EventBroker:
+    """Fans document events out to the streams listening in this process.
+
+    A single poller reads new rows from the event table, one indexed query
+    per interval however many clients are connected, and only while anyone
+    is listening. Commits of events in this process wake it immediately.
+    """
+
+    def __init__(self, poll_interval: Optional[float] = None):
+        self.poll_interval = poll_interval or settings.EVENT_POLL_INTERVAL
+        self._subscriptions: Dict[int, Set[Subscription]] = {}
+        self._last_id = 0
+        self._last_prune = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._last_id = await run_in_threadpool(self._prune_and_locate)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def notify(self):
+        """Wake the poller. Safe to call from any thread."""
+        if self._loop is None or self._loop.is_closed():
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            pass  # loop shutting down
+
+    def subscribe(self, notebook_id: int) -> Subscription:
+        subscription = Subscription(notebook_id)
+        self._subscriptions.setdefault(notebook_id, set()).add(subscription)
+        self.notify()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscriptions.get(subscription.notebook_id)
+        if subscriptions:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.notebook_id]
+
+    def _prune(self, db: Session):
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=settings.EVENT_RETENTION)
+        # The newest row always stays: without AUTOINCREMENT, SQLite numbers new rows
+        # from the highest id left, and ids must keep growing
+        newest = latest_event_id(db)
+        db.query(DocumentEvent).filter(
+            DocumentEvent.created_at < cutoff,
+            DocumentEvent.id < newest
+        ).delete(synchronize_session=False)
+        db.commit()
+        self._last_prune = time.monotonic()
+
+    def _prune_and_locate(self) -> int:
+        """Prune, then return the latest event id. Blocking; run in the threadpool"""
+        db = SessionLocal()
+        try:
+            self._prune(db)
+            return latest_event_id(db)
+        finally:
+            db.close()
+
+    def _read(self, after: int, prune: bool):
+        """Up to 500 events after ``after`` as (start, [(id, notebook_id, event, payload)]).
+
+        ``start`` is 0 instead of ``after`` when ids went backwards. Blocking;
+        run in the threadpool.
+        """
+        db = SessionLocal()
+        try:
+            if prune:
+                self._prune(db)
+            if latest_event_id(db) < after:
+                # The table was emptied: everything in it is new
+                after = 0
+            rows = db.query(DocumentEvent).filter(
+                DocumentEvent.id > after
+            ).order_by(DocumentEvent.id).limit(500).all()
+            return after, [(row.id, row.notebook_id, row.event, event_payload(row)) for row in rows]
+        finally:
+            db.close()
+
+    async def _poll(self):
+        prune = time.monotonic() - self._last_prune > settings.EVENT_RETENTION / 4
+        while True:
+            self._last_id, rows = await run_in_threadpool(self._read, self._last_id, prune)
+            prune = False
+            for event_id, notebook_id, event, payload in rows:
+                self._last_id = event_id
+                for subscription in list(self._subscriptions.get(notebook_id, ())):
+                    try:
+                        subscription.queue.put_nowait((event_id, event, payload))
+                    except asyncio.QueueFull:
+                        subscription.overflowed = True
+                        self.unsubscribe(subscription)
+            if len(rows) < 500:
+                break
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                if self._subscriptions:
+                    await self._poll()
+                else:
+                    # Nobody is listening; skip the backlog so new listeners start from now
+                    self._last_id = await run_in_threadpool(self._latest_id)
+            except Exception as e:
+                logger.error(f"Error reading document events: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval if self._subscriptions else None)
+            except asyncio.TimeoutError:
+                pass
+
+    def _latest_id(self) -> int:
+        db = SessionLocal()
+        try:
+            return latest_event_id(db)
+        finally:
+            db.close()
+
+event_broker = EventBroker()
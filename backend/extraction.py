@@ -0,0 +1,466 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from backend.config import settings
+from backend.html_text import iter_html_lines
+import asyncio
+import math
+import multiprocessing
+import os
+import queue
+import zipfile
+import PyPDF2
+from xml.etree import ElementTree
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ExtractionTimeout(Exception):
+    """Raised when an extraction job exceeds its deadline"""
+
+class ExtractionInterrupted(Exception):
+    """Another job recycled the pool before this extraction started; nothing is wrong with the document"""
+
+class Segment(NamedTuple):
+    """A piece of extracted text and where it came from.
+
+    ``section`` is the 1-based page (PDF) or section number the text belongs
+    to. The text of a section is its segments joined with newlines, and the
+    document text is its sections joined with newlines.
+    """
+    text: str
+    section: int
+    kind: str = "text"  # page, paragraph, heading, line...
+
+# Extractors by MIME type. Each takes a file path and yields Segments in
+# document order, keeping only a bounded amount of the file in memory.
+# Extraction runs in spawned worker processes, so extractors must be
+# registered when their module is imported (this one, or one it imports).
+EXTRACTORS: Dict[str, Callable[[str], Iterator[Segment]]] = {}
+# Bump an extractor's version when its output changes; documents extracted
+# by an older version are re-extracted and never reused for new uploads
+EXTRACTOR_VERSIONS: Dict[str, int] = {}
+
+def register_extractor(*file_types: str, version: int = 1):
+    def decorator(fn: Callable[[str], Iterator[Segment]]):
+        for file_type in file_types:
+            EXTRACTORS[file_type] = fn
+            EXTRACTOR_VERSIONS[file_type] = version
+        return fn
+    return decorator
+
+def extractor_version(file_type: str) -> int:
+    return EXTRACTOR_VERSIONS.get(file_type, 1)
+
+def iter_segments(file_path: str, file_type: str) -> Iterator[Segment]:
+    extractor = EXTRACTORS.get(file_type)
+    if extractor is None:
+        return iter(())
+    return extractor(file_path)
+
+def paginate_lines(lines: Iterable[str], page_chars: Optional[int] = None, kind: str = "line") -> Iterator[Segment]:
+    """Segments for text without natural pages: a new section starts every ``page_chars`` or so"""
+    page_chars = page_chars or settings.TEXT_PAGE_CHARS
+    section = 1
+    length = 0
+    for line in lines:
+        if length and length + len(line) > page_chars:
+            section += 1
+            length = 0
+        yield Segment(line, section, kind)
+        length += len(line) + 1
+
+def paginate_text(text: str, page_chars: Optional[int] = None) -> List[str]:
+    """Cut text without natural pages into sections of about ``page_chars`` at line breaks.
+
+    ``"\n".join()`` of the result gives back the original text.
+    """
+    return collect_sections(paginate_lines(text.split("\n"), page_chars))
+
+def collect_sections(segments: Iterable[Segment]) -> List[str]:
+    """Assemble segments into the text of each section"""
+    sections: List[List[str]] = []
+    current = None
+    for segment in segments:
+        if segment.section != current:
+            sections.append([])
+            current = segment.section
+        sections[-1].append(segment.text)
+    return ["\n".join(texts) for texts in sections] or [""]
+
+@register_extractor("application/pdf")
+def extract_pdf_segments(file_path: str) -> Iterator[Segment]:
+    with open(file_path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        for index, page in enumerate(reader.pages):
+            yield Segment(page.extract_text() or "", index + 1, "page")
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_P, _W_T, _W_TBL, _W_TR, _W_TC = _W + "p", _W + "t", _W + "tbl", _W + "tr", _W + "tc"
+# Run content that stands for characters, as python-docx renders it
+_W_CHARS = {_W + "tab": "\t", _W + "br": "\n", _W + "cr": "\n", _W + "noBreakHyphen": "-"}
+# Paragraphs inside these belong to another story (text boxes, footnote refs...)
+_W_NESTED = {_W + "txbxContent", _W_P}
+
+def _docx_heading_styles(archive: zipfile.ZipFile) -> set:
+    """Ids of the paragraph styles that are headings (ids are localised, names are not)"""
+    try:
+        styles = ElementTree.fromstring(archive.read("word/styles.xml"))
+    except KeyError:
+        return set()
+    heading_ids = set()
+    for style in styles.iter(_W + "style"):
+        name = style.find(_W + "name")
+        name = (name.get(_W + "val") if name is not None else "").lower()
+        if name.startswith("heading") or name == "title" or style.find(f"{_W}pPr/{_W}outlineLvl") is not None:
+            heading_ids.add(style.get(_W + "styleId"))
+    return heading_ids
+
+def _paragraph_text(paragraph) -> str:
+    parts = []
+
+    def walk(element):
+        for child in element:
+            if child.tag == _W_T:
+                parts.append(child.text or "")
+            elif child.tag in _W_CHARS:
+                parts.append(_W_CHARS[child.tag])
+            elif child.tag not in _W_NESTED:
+                walk(child)
+
+    walk(paragraph)
+    return "".join(parts)
+
+def _is_heading(paragraph, heading_styles: set) -> bool:
+    properties = paragraph.find(_W + "pPr")
+    if properties is None:
+        return False
+    if properties.find(_W + "outlineLvl") is not None:
+        return True
+    style = properties.find(_W + "pStyle")
+    return style is not None and style.get(_W + "val") in heading_styles
+
+def _row_text(row) -> str:
+    # Nested tables are folded into the text of their cell
+    return " | ".join(
+        " ".join(text for text in (_paragraph_text(paragraph) for paragraph in cell.iter(_W_P)) if text)
+        for cell in row.findall(_W_TC)
+    )
+
+@register_extractor("application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+def extract_docx_segments(file_path: str) -> Iterator[Segment]:
+    """Paragraphs and table rows of a DOCX, in document order.
+
+    ``word/document.xml`` is stream-parsed straight from the archive and
+    every paragraph or row is dropped from the tree once emitted, so memory
+    does not grow with the document. A new section starts at every heading,
+    or when one grows past TEXT_PAGE_CHARS.
+    """
+    section = 1
+    length = 0
+    with zipfile.ZipFile(file_path) as archive:
+        heading_styles = _docx_heading_styles(archive)
+        with archive.open("word/document.xml") as xml:
+            stack = []
+            tables = 0
+            for event, element in ElementTree.iterparse(xml, events=("start", "end")):
+                if event == "start":
+                    stack.append(element)
+                    if element.tag == _W_TBL:
+                        tables += 1
+                    continue
+
+                stack.pop()
+                if element.tag == _W_TBL:
+                    tables -= 1
+                    if tables:
+                        continue  # nested table: part of its cell's text
+                    segment = None
+                elif element.tag == _W_P and not tables:
+                    heading = _is_heading(element, heading_styles)
+                    segment = (_paragraph_text(element), "heading" if heading else "paragraph")
+                elif element.tag == _W_TR and tables == 1:
+                    heading = False
+                    segment = (_row_text(element), "table_row")
+                else:
+                    continue
+
+                if segment is not None:
+                    text, kind = segment
+                    if length and (heading or length + len(text) > settings.TEXT_PAGE_CHARS):
+                        section += 1
+                        length = 0
+                    yield Segment(text, section, kind)
+                    length += len(text) + 1
+                # Done with this element: detach it so the parsed tree stays small
+                element.clear()
+                if stack:
+                    stack[-1].remove(element)
+
+@register_extractor("text/plain", "text/markdown")
+def extract_text_segments(file_path: str) -> Iterator[Segment]:
+    """Lines of a text file, read incrementally"""
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+        yield from paginate_lines(line.rstrip("\n") for line in _lines(f))
+
+@register_extractor("text/html", version=2)
+def extract_html_segments(file_path: str) -> Iterator[Segment]:
+    """Visible text of an HTML file with headings and lists as markdown (version 1 kept the raw markup)"""
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+        yield from paginate_lines(iter_html_lines(f))
+
+def _lines(f) -> Iterator[str]:
+    # Like iterating the file, but a trailing newline still yields a final empty line,
+    # so that "\n".join(lines) reproduces the file exactly
+    line = ""
+    for line in f:
+        yield line
+    if not line or line.endswith("\n"):
+        yield ""
+
+def extract_sections(file_path: str, file_type: str) -> List[str]:
+    """Extract a file's text as pages (PDF) or sections (everything else)"""
+    return collect_sections(iter_segments(file_path, file_type))
+
+def extract_text(file_path: str, file_type: str) -> str:
+    """Extract text from a file. Runs inside an extraction worker process."""
+    return "\n".join(extract_sections(file_path, file_type))
+
+def produce_segments(file_path: str, file_type: str, channel, stop, batch_chars: int):
+    """Run an extractor in a worker process, sending batches of segments to ``channel``.
+
+    Messages are ("segments", [...]), then ("done", None) or ("error", message).
+    The channel is bounded, so a slow consumer pauses extraction; ``stop``
+    is set when the consumer gives up.
+    """
+    def send(message) -> bool:
+        while not stop.is_set():
+            try:
+                channel.put(message, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        batch = []
+        size = 0
+        for segment in iter_segments(file_path, file_type):
+            batch.append(tuple(segment))
+            size += len(segment.text)
+            if size >= batch_chars:
+                if not send(("segments", batch)):
+                    return
+                batch, size = [], 0
+        if batch and not send(("segments", batch)):
+            return
+        send(("done", None))
+    except Exception as e:
+        send(("error", f"{type(e).__name__}: {e}"))
+
+def count_pdf_pages(file_path: str) -> int:
+    with open(file_path, "rb") as f:
+        return len(PyPDF2.PdfReader(f).pages)
+
+def extract_pdf_pages(file_path: str, start: int, end: int) -> Tuple[List[str], Optional[str]]:
+    """Extract pages ``start`` to ``end`` (0-based, exclusive) of a PDF.
+
+    Returns the texts of the pages finished so far plus an error message if
+    a page failed, so the caller can checkpoint the pages that did succeed.
+    """
+    texts = []
+    try:
+        with open(file_path, "rb") as f:
+            reader = PyPDF2.PdfReader(f)
+            for index in range(start, end):
+                texts.append(reader.pages[index].extract_text() or "")
+    except Exception as e:
+        return texts, f"page {start + len(texts) + 1}: {e}"
+    return texts, None
+
+class ExtractionEngine:
+    """Runs CPU-bound document parsing in a bounded process pool.
+
+    At most ``max_workers`` jobs run at once; further callers wait their turn
+    without blocking the event loop. A job that overruns its timeout takes
+    its worker process down with it, since a parser stuck in C code cannot be
+    interrupted any other way. Jobs that were sharing the recycled pool are
+    resubmitted once to the fresh pool.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, timeout: Optional[float] = None):
+        self.max_workers = max_workers or settings.EXTRACTION_WORKERS or os.cpu_count() or 1
+        self.timeout = timeout or settings.EXTRACTION_TIMEOUT
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._slots = asyncio.Semaphore(self.max_workers)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn avoids forking a process that already runs server threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _get_manager(self):
+        # Pool workers can only be handed queues through a manager
+        if self._manager is None:
+            self._manager = multiprocessing.get_context("spawn").Manager()
+        return self._manager
+
+    def _recycle(self, executor: ProcessPoolExecutor):
+        """Kill the workers of a pool and let the next job start a new one"""
+        if self._executor is executor:
+            self._executor = None
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, fn, *args, timeout: Optional[float] = None):
+        """Run ``fn(*args)`` in the pool and return its result"""
+        timeout = timeout or self.timeout
+        loop = asyncio.get_running_loop()
+        async with self._slots:
+            for attempt in range(2):
+                executor = self._get_executor()
+                future = loop.run_in_executor(executor, fn, *args)
+                try:
+                    return await asyncio.wait_for(future, timeout)
+                except asyncio.TimeoutError:
+                    logger.error(f"Extraction job {fn.__name__}{args} timed out after {timeout}s, recycling workers")
+                    self._recycle(executor)
+                    raise ExtractionTimeout(f"Extraction timed out after {timeout}s")
+                except BrokenProcessPool:
+                    self._recycle(executor)
+                    if attempt:
+                        raise
+                    logger.warning(f"Extraction pool was recycled, resubmitting {fn.__name__}{args}")
+                except asyncio.CancelledError:
+                    # A recycle cancels the futures still waiting for a worker;
+                    # only a cancellation of this task itself is passed on
+                    if not future.cancelled() or asyncio.current_task().cancelling():
+                        raise
+                    if attempt:
+                        raise ExtractionInterrupted(f"Extraction pool was recycled twice before {fn.__name__} ran")
+                    logger.warning(f"Extraction pool was recycled, resubmitting {fn.__name__}{args}")
+
+    async def extract(self, file_path: str, file_type: str) -> str:
+        """Extract the text of a document without blocking the event loop"""
+        return await self.run(extract_text, file_path, file_type)
+
+    async def stream(self, file_path: str, file_type: str, timeout: Optional[float] = None) -> AsyncIterator[Segment]:
+        """Yield a document's segments while a pool worker is still extracting it.
+
+        At most EXTRACTION_STREAM_BUFFER batches are in flight, which bounds
+        memory however large the file is. The timeout covers the whole
+        extraction, including time spent waiting for the consumer.
+        """
+        timeout = timeout or self.timeout
+        loop = asyncio.get_running_loop()
+        async with self._slots:
+            manager = await loop.run_in_executor(None, self._get_manager)
+            channel = manager.Queue(maxsize=settings.EXTRACTION_STREAM_BUFFER)
+            stop = manager.Event()
+            executor = self._get_executor()
+            future = loop.run_in_executor(
+                executor, produce_segments, file_path, file_type, channel, stop, settings.EXTRACTION_STREAM_BATCH_CHARS
+            )
+            deadline = loop.time() + timeout
+            try:
+                while True:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        logger.error(f"Streaming extraction of {file_path} timed out after {timeout}s, recycling workers")
+                        self._recycle(executor)
+                        raise ExtractionTimeout(f"Extraction timed out after {timeout}s")
+                    try:
+                        kind, payload = await loop.run_in_executor(None, channel.get, True, min(remaining, 1.0))
+                    except queue.Empty:
+                        if future.cancelled():
+                            # Dropped by a recycle before a worker picked it up
+                            raise ExtractionInterrupted(f"Extraction pool was recycled before {file_path} was extracted")
+                        if future.done() and future.exception() is not None:
+                            if isinstance(future.exception(), BrokenProcessPool):
+                                self._recycle(executor)
+                            raise future.exception()
+                        continue
+                    if kind == "done":
+                        break
+                    if kind == "error":
+                        raise RuntimeError(payload)
+                    for segment in payload:
+                        yield Segment(*segment)
+            finally:
+                if not future.done():
+                    # The consumer stopped early: let the worker finish its current segment and exit
+                    stop.set()
+
+    async def stream_sections(self, file_path: str, file_type: str) -> AsyncIterator[str]:
+        """Yield the text of each page or section as soon as extraction moves past it"""
+        number = None
+        parts: List[str] = []
+        async with aclosing(self.stream(file_path, file_type)) as segments:
+            async for segment in segments:
+                if segment.section != number and number is not None:
+                    yield "\n".join(parts)
+                    parts = []
+                number = segment.section
+                parts.append(segment.text)
+        yield "\n".join(parts)
+
+    async def extract_pdf(
+        self,
+        file_path: str,
+        done: Optional[Dict[int, str]] = None,
+        on_pages: Optional[Callable[[Dict[int, str], int], Awaitable[None]]] = None
+    ) -> List[str]:
+        """Extract a PDF page-parallel and return the text of every page.
+
+        ``done`` maps already extracted 1-based page numbers to their text;
+        those pages are skipped, so a retried job resumes where it stopped.
+        The missing pages are split into contiguous batches spread over the
+        pool, and ``on_pages(pages, page_count)`` is awaited with each batch's
+        pages as soon as they are available so the caller can checkpoint them.
+        """
+        done = dict(done or {})
+        page_count = await self.run(count_pdf_pages, file_path)
+        missing = [number for number in range(1, page_count + 1) if number not in done]
+        batch_size = max(1, min(settings.PDF_PAGE_BATCH_SIZE, math.ceil(len(missing) / self.max_workers)))
+
+        batches = []
+        for number in missing:
+            if batches and number == batches[-1][1] + 1 and batches[-1][1] - batches[-1][0] + 1 < batch_size:
+                batches[-1][1] = number
+            else:
+                batches.append([number, number])
+
+        async def run_batch(first: int, last: int):
+            texts, error = await self.run(extract_pdf_pages, file_path, first - 1, last)
+            pages = {first + offset: text for offset, text in enumerate(texts)}
+            done.update(pages)
+            if pages and on_pages:
+                await on_pages(pages, page_count)
+            if error:
+                raise RuntimeError(error)
+
+        if batches:
+            logger.info(f"Extracting {len(missing)} of {page_count} pages from {file_path} in {len(batches)} batches")
+        results = await asyncio.gather(*(run_batch(first, last) for first, last in batches), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            raise errors[0]
+
+        return [done[number] for number in range(1, page_count + 1)]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+extraction_engine = ExtractionEngine()
@@ -0,0 +1,171 @@
+"""
+本地 OpenAI 兼容的假 LLM 服务，用于测试和压测
+
+    python backend/fake_llm.py [--port 8799] [--ttft 0.2] [--tps 50] [--tokens 50] [--error-rate 0] [--stall-rate 0]
+
+实现 /v1/chat/completions（流式和非流式）和 /v1/models。首 token 延迟、
+每秒 token 数、错误率和“卡住不返回”的比例都可以配置；测试还可以通过
+``script`` 指定接下来几个请求的结果。把 llm.base_url 配置为
+http://127.0.0.1:<port>/v1 即可让应用使用它。
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Optional
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+# Outcomes a request can be scripted to have
+OK, ERROR, STALL, BAD_REQUEST = "ok", "error", "stall", "bad_request"
+
+@dataclass
+class Behaviour:
+    ttft: float = 0.2  # seconds before the first token
+    tokens_per_second: float = 50.0  # after the first token; 0 = as fast as possible
+    tokens: int = 50  # tokens per answer
+    error_rate: float = 0.0  # fraction of requests answered with error_status
+    error_status: int = 503
+    stall_rate: float = 0.0  # fraction of requests that never produce a token
+
+class FakeLLMServer:
+    """An OpenAI-compatible chat completions endpoint with configurable latency and failures"""
+
+    def __init__(self, behaviour: Optional[Behaviour] = None, seed: Optional[int] = None):
+        self.behaviour = behaviour or Behaviour()
+        self.script: Deque[str] = deque()  # outcomes for the next requests, before the rates apply
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.active = 0  # streams being written
+        self.completed = 0
+        self.aborted = 0  # streams the client closed early
+        self.app = Starlette(routes=[
+            Route("/v1/chat/completions", self.completions, methods=["POST"]),
+            Route("/v1/models", self.models, methods=["GET"])
+        ])
+        self._server: Optional[uvicorn.Server] = None
+
+    def reset(self, behaviour: Optional[Behaviour] = None):
+        """New behaviour, an empty script and zeroed counters"""
+        self.behaviour = behaviour or Behaviour()
+        self.script.clear()
+        self.requests = self.completed = self.aborted = 0
+
+    def _outcome(self) -> str:
+        if self.script:
+            return self.script.popleft()
+        roll = self.random.random()
+        if roll < self.behaviour.error_rate:
+            return ERROR
+        if roll < self.behaviour.error_rate + self.behaviour.stall_rate:
+            return STALL
+        return OK
+
+    def _chunk(self, model: str, delta: dict, finish_reason: Optional[str] = None) -> str:
+        body = {
+            "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        return f"data: {json.dumps(body)}\n\n"
+
+    async def models(self, request: Request):
+        return JSONResponse({"object": "list", "data": [{"id": "fake-model", "object": "model", "owned_by": "fake"}]})
+
+    async def completions(self, request: Request):
+        body = await request.json()
+        model = body.get("model", "fake-model")
+        self.requests += 1
+        outcome = self._outcome()
+        behaviour = self.behaviour
+
+        if outcome == ERROR:
+            await asyncio.sleep(behaviour.ttft / 2)
+            return JSONResponse({"error": {"message": "fake upstream error", "type": "server_error"}},
+                                status_code=behaviour.error_status)
+        if outcome == BAD_REQUEST:
+            return JSONResponse({"error": {"message": "fake bad request", "type": "invalid_request_error"}},
+                                status_code=400)
+        interval = 1.0 / behaviour.tokens_per_second if behaviour.tokens_per_second > 0 else 0.0
+
+        if not body.get("stream"):
+            if outcome == STALL:
+                await asyncio.sleep(3600)
+            await asyncio.sleep(behaviour.ttft + interval * max(behaviour.tokens - 1, 0))
+            self.completed += 1
+            return JSONResponse({
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant",
+                             "content": "".join(f"tok{i} " for i in range(behaviour.tokens))},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": behaviour.tokens, "total_tokens": behaviour.tokens}
+            })
+
+        async def stream():
+            self.active += 1
+            finished = False
+            try:
+                if outcome == STALL:
+                    await asyncio.sleep(3600)
+                await asyncio.sleep(behaviour.ttft)
+                yield self._chunk(model, {"role": "assistant", "content": ""})
+                for index in range(behaviour.tokens):
+                    if index:
+                        await asyncio.sleep(interval)
+                    yield self._chunk(model, {"content": f"tok{index} "})
+                yield self._chunk(model, {}, "stop")
+                yield "data: [DONE]\n\n"
+                finished = True
+            finally:
+                self.active -= 1
+                if finished:
+                    self.completed += 1
+                else:
+                    self.aborted += 1
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serve from a daemon thread; returns the base URL (…/v1)"""
+        self._server = uvicorn.Server(uvicorn.Config(self.app, host=host, port=port, log_level="warning", backlog=4096))
+        threading.Thread(target=self._server.run, daemon=True).start()
+        while not self._server.started:
+            time.sleep(0.02)
+        port = self._server.servers[0].sockets[0].getsockname()[1]
+        return f"http://{host}:{port}/v1"
+
+    def stop(self):
+        if self._server:
+            self._server.should_exit = True
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的假 LLM 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--ttft", type=float, default=0.2, help="首 token 延迟（秒）")
+    parser.add_argument("--tps", type=float, default=50.0, help="每秒 token 数，0 表示不限速")
+    parser.add_argument("--tokens", type=int, default=50, help="每个回答的 token 数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误的请求比例")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="不返回任何 token 的请求比例")
+    args = parser.parse_args()
+
+    server = FakeLLMServer(Behaviour(
+        ttft=args.ttft, tokens_per_second=args.tps, tokens=args.tokens,
+        error_rate=args.error_rate, error_status=args.error_status, stall_rate=args.stall_rate
+    ))
+    print(f"假 LLM 服务: http://{args.host}:{args.port}/v1")
+    uvicorn.run(server.app, host=args.host, port=args.port, log_level="warning", backlog=4096)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+from html.parser import HTMLParser
+from typing import Iterator, List, TextIO
+import re
+
+# Elements whose content is never shown as text
+SKIP_TAGS = {
+    "head", "script", "style", "noscript", "template", "svg", "math", "iframe",
+    "object", "embed", "canvas", "nav", "button", "select"
+}
+# Void elements never get an end tag, so they must not open a skipped region
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+BLOCK_TAGS = {
+    "address", "article", "aside", "blockquote", "body", "dd", "details", "dialog", "div", "dl", "dt",
+    "fieldset", "figcaption", "figure", "footer", "form", "header", "hgroup", "html", "li", "main",
+    "ol", "p", "section", "summary", "table", "tbody", "tfoot", "thead", "tr", "ul"
+}
+HEADING_TAGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+class HtmlToText(HTMLParser):
+    """Incremental HTML to plain text with lightweight markdown.
+
+    Headings become ``#`` lines, list items ``-`` or ``1.`` lines, table rows
+    ``cell | cell`` lines and ``<pre>`` keeps its whitespace; everything else
+    is collapsed. Feed it HTML in pieces and ``drain()`` finished lines.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._lines: List[str] = []
+        self._current: List[str] = []
+        self._prefix = ""
+        self._skip_depth = 0
+        self._pre_depth = 0
+        self._lists: List[List] = []  # [tag, next number] per open list
+        self._cells = 0  # cells seen in the current table row
+        self._blank = True  # last emitted line was blank (or nothing emitted yet)
+
+    def _flush(self):
+        if self._pre_depth:
+            return  # preformatted text is kept until its </pre>
+        text = "".join(self._current).strip()
+        self._current = []
+        if text:
+            self._lines.append(self._prefix + text)
+            self._blank = False
+        self._prefix = ""
+
+    def _paragraph_break(self):
+        if self._pre_depth:
+            return
+        self._flush()
+        if not self._blank:
+            self._lines.append("")
+            self._blank = True
+
+    def handle_starttag(self, tag, attrs):
+        if self._skip_depth:
+            if tag in SKIP_TAGS and tag not in VOID_TAGS:
+                self._skip_depth += 1
+            return
+        if tag in SKIP_TAGS:
+            if tag not in VOID_TAGS:
+                self._skip_depth = 1
+            return
+        if self._pre_depth and tag not in ("pre", "br"):
+            return  # markup inside <pre> keeps the text's own layout
+
+        if tag in HEADING_TAGS:
+            self._paragraph_break()
+            self._prefix = "#" * HEADING_TAGS[tag] + " "
+        elif tag == "li":
+            self._flush()
+            indent = "  " * max(len(self._lists) - 1, 0)
+            if self._lists and self._lists[-1][0] == "ol":
+                self._prefix = f"{indent}{self._lists[-1][1]}. "
+                self._lists[-1][1] += 1
+            else:
+                self._prefix = f"{indent}- "
+        elif tag in ("ul", "ol"):
+            self._flush()
+            self._lists.append([tag, 1])
+        elif tag == "tr":
+            self._flush()
+            self._cells = 0
+        elif tag in ("td", "th"):
+            if self._cells:
+                self._current.append(" | ")
+            self._cells += 1
+        elif tag == "pre":
+            self._paragraph_break()
+            self._pre_depth += 1
+        elif tag == "br":
+            if self._pre_depth:
+                self._current.append("\n")
+            else:
+                self._flush()
+        elif tag == "hr":
+            self._paragraph_break()
+        elif tag in ("p", "blockquote", "table"):
+            self._paragraph_break()
+        elif tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if self._skip_depth:
+            if tag in SKIP_TAGS:
+                self._skip_depth -= 1
+            return
+        if self._pre_depth and tag != "pre":
+            return
+
+        if tag in HEADING_TAGS:
+            self._flush()
+            self._paragraph_break()
+        elif tag in ("ul", "ol"):
+            self._flush()
+            if self._lists:
+                self._lists.pop()
+            if not self._lists:
+                self._paragraph_break()
+        elif tag == "pre":
+            if self._pre_depth:
+                self._pre_depth -= 1
+            if not self._pre_depth:
+                text = "".join(self._current).strip("\n")
+                self._current = []
+                if text:
+                    self._lines.extend(text.split("\n"))
+                    self._blank = False
+                self._paragraph_break()
+        elif tag in ("p", "blockquote", "table"):
+            self._paragraph_break()
+        elif tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        if self._pre_depth:
+            self._current.append(data)
+            return
+        text = _WHITESPACE_RE.sub(" ", data)
+        if text.strip() or (self._current and not self._current[-1].endswith(" ")):
+            if not self._current:
+                text = text.lstrip()
+            self._current.append(text)
+
+    def drain(self) -> List[str]:
+        """Lines completed so far"""
+        lines, self._lines = self._lines, []
+        return lines
+
+    def close(self):
+        super().close()
+        self._flush()
+        # No trailing blank line
+        while self._lines and not self._lines[-1]:
+            self._lines.pop()
+
+def iter_html_lines(f: TextIO, chunk_size: int = 64 * 1024) -> Iterator[str]:
+    """Text lines of an HTML file, parsed a chunk at a time"""
+    parser = HtmlToText()
+    for chunk in iter(lambda: f.read(chunk_size), ""):
+        parser.feed(chunk)
+        yield from parser.drain()
+    parser.close()
+    yield from parser.drain()
+
+def html_to_text(html: str) -> str:
+    parser = HtmlToText()
+    parser.feed(html)
+    parser.close()
+    return "\n".join(parser.drain())
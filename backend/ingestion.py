@@ -0,0 +1,496 @@
+from backend.database import SessionLocal
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from backend.models import Document, DocumentPage, DocumentChunk
+from backend.extraction import extraction_engine, extractor_version, paginate_text
+from backend.config import settings
+from backend.chunking import TextChunk, StreamingSplitter, split_text, page_starts_for
+from backend.tokens import ESTIMATOR, configured_model, get_tokenizer
+from backend.search import index_chunks, unindex_document
+from backend.vector_index import vector_index, get_embedder
+from backend.answer_cache import answer_cache
+from backend.storage import TextWriter, get_document_text, store_document_text
+from backend.events import publish_event
+from starlette.concurrency import run_in_threadpool
+from contextlib import aclosing
+from typing import List, Optional
+import asyncio
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+class EmptyDocumentError(Exception):
+    """Raised when extraction succeeds but yields no text; retrying will not help"""
+
+async def run_blocking(func, *args, **kwargs):
+    """Run database work in the threadpool, keeping the event loop free.
+
+    A thread cannot be interrupted, so a cancelled caller still waits for it
+    to return before the cancellation goes on to close the session it uses.
+    """
+    future = asyncio.ensure_future(run_in_threadpool(func, *args, **kwargs))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait({future})
+        raise
+
+def checkpointed_pages(db: Session, document: Document) -> dict:
+    """Text of the pages an earlier attempt stored, by page number. Blocking.
+
+    Pages left by a completed run hold only offsets into the text it stored;
+    they are dropped so that they are extracted again.
+    """
+    db.query(DocumentPage).filter(
+        DocumentPage.document_id == document.id,
+        DocumentPage.content == ""
+    ).delete(synchronize_session=False)
+    db.commit()
+    return {
+        number: text for number, text in db.query(DocumentPage.page_number, DocumentPage.content).filter(
+            DocumentPage.document_id == document.id
+        )
+    }
+
+async def extract_pdf_checkpointed(db, document: Document) -> List[str]:
+    """Extract a PDF page-parallel, persisting pages as batches finish.
+
+    Pages stored by an earlier, failed attempt are reused, so a retry only
+    parses what is still missing. Returns the text of every page.
+    """
+    done = await run_blocking(checkpointed_pages, db, document)
+    if done:
+        logger.info(f"Resuming document {document.id} with {len(done)} pages already extracted")
+
+    extracted = len(done)
+    # Batches finish concurrently, but their checkpoints share one session
+    writing = asyncio.Lock()
+
+    def store(pages, page_count):
+        db.add_all([
+            DocumentPage(document_id=document.id, page_number=number, content=text)
+            for number, text in pages.items()
+        ])
+        publish_event(db, document, "progress", status="processing", pages_done=extracted, total_pages=page_count)
+        db.commit()
+
+    async def checkpoint(pages, page_count):
+        nonlocal extracted
+        async with writing:
+            extracted += len(pages)
+            await run_blocking(store, pages, page_count)
+
+    return await extraction_engine.extract_pdf(document.file_url, done, on_pages=checkpoint)
+
+def find_reusable_extraction(db, document: Document):
+    """Return a completed document with the same file content and type, if any,
+    extracted by the current version of the extractor"""
+    if not document.content_hash:
+        return None
+    return db.query(Document).filter(
+        Document.content_hash == document.content_hash,
+        Document.file_type == document.file_type,
+        Document.status == "completed",
+        func.coalesce(Document.extractor_version, 1) == extractor_version(document.file_type),
+        Document.id != document.id
+    ).first()
+
+def page_texts(db: Session, document_id: int, pages) -> List[str]:
+    """The text of the given pages of a document.
+
+    A page keeps its own text only while its document is processed, as the
+    checkpoint a retry resumes from; after that it is a slice of the
+    document's stored text, so the text is stored once besides the chunks.
+    """
+    text = None
+    texts = []
+    for page in pages:
+        if page.content or page.start_offset is None or not page.char_count:
+            texts.append(page.content)
+            continue
+        if text is None:
+            text = get_document_text(db, document_id) or ""
+        texts.append(text[page.start_offset:page.start_offset + page.char_count])
+    return texts
+
+def load_sections(db: Session, document_id: int) -> Optional[List[str]]:
+    """A processed document's stored pages or sections, in order"""
+    pages = db.query(DocumentPage.content, DocumentPage.start_offset, DocumentPage.char_count).filter(
+        DocumentPage.document_id == document_id
+    ).order_by(DocumentPage.page_number).all()
+    if pages:
+        return page_texts(db, document_id, pages)
+    # Processed before every document had pages
+    content = get_document_text(db, document_id)
+    return [content] if content is not None else None
+
+def split_sections(sections: List[str]) -> List[TextChunk]:
+    """Split a document's text into chunks tagged with the page they start on"""
+    return split_text("\n".join(sections), page_starts=page_starts_for(sections))
+
+def store_pages(db: Session, document: Document, sections: List[str]):
+    """Store a document's pages with their offsets in its text. The caller commits."""
+    existing = {
+        page.page_number: page
+        for page in db.query(DocumentPage).filter(DocumentPage.document_id == document.id)
+    }
+    for number, (text, start) in enumerate(zip(sections, page_starts_for(sections)), start=1):
+        page = existing.pop(number, None)
+        if page is None:
+            page = DocumentPage(document_id=document.id, page_number=number)
+            db.add(page)
+        page.content = text
+        page.start_offset = start
+        page.char_count = len(text)
+    for page in existing.values():
+        db.delete(page)
+
+def add_chunks(db: Session, document: Document, pieces: List[TextChunk], tokenizer=None) -> List[DocumentChunk]:
+    """Add chunks to a document and the full-text index. The caller commits.
+
+    Token counts are measured once here, so prompt budgets are a sum of cached counts.
+    """
+    tokenizer = tokenizer or ESTIMATOR
+    token_counts = tokenizer.count_many([chunk.content for chunk in pieces])
+    chunks = [
+        DocumentChunk(
+            document_id=document.id,
+            notebook_id=document.notebook_id,
+            chunk_index=chunk.index,
+            content=chunk.content,
+            start_offset=chunk.start_offset,
+            end_offset=chunk.end_offset,
+            page_number=chunk.page_number,
+            char_count=len(chunk.content),
+            token_count=token_count,
+            token_encoding=tokenizer.name
+        )
+        for chunk, token_count in zip(pieces, token_counts)
+    ]
+    db.add_all(chunks)
+    db.flush()
+    index_chunks(db, chunks)
+    return chunks
+
+def store_chunks(db: Session, document: Document, pieces: List[TextChunk], tokenizer=None) -> List[DocumentChunk]:
+    """Replace a document's chunks and their full-text entries. The caller commits."""
+    unindex_document(db.connection(), document.id)
+    db.query(DocumentChunk).filter(DocumentChunk.document_id == document.id).delete(synchronize_session=False)
+    return add_chunks(db, document, pieces, tokenizer)
+
+def embed_chunks(document: Document, chunks: List[DocumentChunk], vectors: np.ndarray = None):
+    """Write a document's chunk vectors to its notebook's dense index"""
+    vector_index.add_document(
+        document.notebook_id,
+        document.id,
+        [chunk.id for chunk in chunks],
+        [chunk.content for chunk in chunks],
+        vectors=vectors
+    )
+
+def backfill_pages(db: Session) -> int:
+    """Page completed documents processed before every document had page offsets"""
+    missing = db.query(Document).filter(
+        Document.status == "completed",
+        ~Document.pages.any(DocumentPage.start_offset.isnot(None))
+    ).all()
+    for document in missing:
+        sections = [
+            text for (text,) in db.query(DocumentPage.content).filter(
+                DocumentPage.document_id == document.id
+            ).order_by(DocumentPage.page_number)
+        ]
+        if not sections:
+            content = get_document_text(db, document.id)
+            if content is None:
+                continue
+            sections = paginate_text(content)
+        store_pages(db, document, sections)
+        db.commit()
+    if missing:
+        logger.info(f"Paged {len(missing)} previously processed documents")
+    return len(missing)
+
+def release_page_text(db: Session) -> int:
+    """Drop the page text completed documents kept from before pages were read
+    as slices of the document text, where the slices match it"""
+    document_ids = [
+        document_id for (document_id,) in db.query(DocumentPage.document_id).join(Document).filter(
+            Document.status == "completed",
+            DocumentPage.content != ""
+        ).distinct()
+    ]
+    released = 0
+    for document_id in document_ids:
+        text = get_document_text(db, document_id)
+        pages = db.query(DocumentPage).filter(DocumentPage.document_id == document_id).all()
+        if text is None or any(
+            page.start_offset is None
+            or page.char_count != len(page.content)
+            or text[page.start_offset:page.start_offset + page.char_count] != page.content
+            for page in pages
+        ):
+            continue
+        for page in pages:
+            page.content = ""
+        db.commit()
+        released += 1
+    if released:
+        logger.info(f"Dropped the page text of {released} documents in favour of their stored text")
+    return released
+
+def backfill_chunks(db: Session) -> int:
+    """Chunk completed documents that were processed before chunking existed"""
+    missing = db.query(Document).filter(
+        Document.status == "completed",
+        ~Document.chunks.any()
+    ).all()
+    tokenizer = get_tokenizer(configured_model(db))
+    for document in missing:
+        sections = load_sections(db, document.id)
+        if sections:
+            embed_chunks(document, store_chunks(db, document, split_sections(sections), tokenizer))
+            db.commit()
+    if missing:
+        logger.info(f"Chunked {len(missing)} previously processed documents")
+    return len(missing)
+
+def backfill_vectors(db: Session) -> int:
+    """Build dense indexes for notebooks whose chunks predate them"""
+    notebook_ids = [notebook_id for (notebook_id,) in db.query(DocumentChunk.notebook_id).distinct()]
+    built = 0
+    for notebook_id in notebook_ids:
+        if vector_index.load(notebook_id) is not None:
+            continue
+        documents = db.query(Document).filter(
+            Document.notebook_id == notebook_id,
+            Document.status == "completed"
+        ).all()
+        for document in documents:
+            chunks = db.query(DocumentChunk).filter(
+                DocumentChunk.document_id == document.id
+            ).order_by(DocumentChunk.chunk_index).all()
+            embed_chunks(document, chunks)
+        built += 1
+    if built:
+        logger.info(f"Built dense vector indexes for {built} notebooks")
+    return built
+
+class DocumentIngest:
+    """Chunks, embeds and stores a document's sections as they arrive.
+
+    Every INGEST_BATCH_CHUNKS chunks are embedded and then written with
+    their pages and full-text entries in one commit, and the document text
+    is compressed as it comes in, so only the current batch is held as
+    plain text. Pages keep their text until the document text is stored. Retrieval ignores the chunks until the document is completed.
+    """
+
+    def __init__(self, db: Session, document: Document):
+        """Blocking (reads the configured model and loads its tokenizer)"""
+        self.db = db
+        self.document = document
+        self.splitter = StreamingSplitter()
+        self.tokenizer = get_tokenizer(configured_model(db))
+        self.text = TextWriter()
+        self.section_count = 0
+        self.chunk_count = 0
+        self._pages = []  # (page_number, text, start_offset) not written yet
+        self._pieces: List[TextChunk] = []
+        self._chunk_ids: List[int] = []
+        self._vectors: List[np.ndarray] = []
+
+    def reset(self):
+        """Drop chunks left by an earlier attempt. Blocking."""
+        unindex_document(self.db.connection(), self.document.id)
+        self.db.query(DocumentChunk).filter(
+            DocumentChunk.document_id == self.document.id
+        ).delete(synchronize_session=False)
+        self.db.commit()
+
+    async def add_section(self, text: str):
+        self.section_count += 1
+        self._pieces.extend(self.splitter.add_section(text))
+        self._pages.append((self.section_count, text, self.splitter.page_starts[-1]))
+        self.text.write(text if self.section_count == 1 else "\n" + text)
+        if len(self._pieces) >= settings.INGEST_BATCH_CHUNKS:
+            await self._flush()
+
+    async def _flush(self):
+        pieces, pages = self._pieces, self._pages
+        self._pieces, self._pages = [], []
+        # Embed before writing anything: awaiting while holding uncommitted
+        # writes would block every other SQLite writer
+        if pieces:
+            self._vectors.append(await run_in_threadpool(get_embedder().embed, [piece.content for piece in pieces]))
+        await run_blocking(self._write_batch, pieces, pages)
+
+    def _write_batch(self, pieces: List[TextChunk], pages: list):
+        existing = {
+            page.page_number: page
+            for page in self.db.query(DocumentPage).filter(
+                DocumentPage.document_id == self.document.id,
+                DocumentPage.page_number.in_([number for number, _, _ in pages])
+            )
+        }
+        for number, text, start in pages:
+            page = existing.get(number)
+            if page is None:
+                page = DocumentPage(document_id=self.document.id, page_number=number)
+                self.db.add(page)
+            page.content = text
+            page.start_offset = start
+            page.char_count = len(text)
+        chunks = add_chunks(self.db, self.document, pieces, self.tokenizer)
+        self._chunk_ids.extend(chunk.id for chunk in chunks)
+        self.chunk_count += len(chunks)
+        publish_event(self.db, self.document, "progress", status="processing",
+                      sections_done=self.section_count, chunks_done=self.chunk_count)
+        self.db.commit()
+
+    async def finish(self):
+        """Write what is left and the document's vectors and text. The caller commits."""
+        self._pieces.extend(self.splitter.finish())
+        await self._flush()
+        # Holds the notebook's index lock and writes files: keep it off the event loop
+        await run_in_threadpool(
+            vector_index.add_document,
+            self.document.notebook_id,
+            self.document.id,
+            self._chunk_ids,
+            [],
+            vectors=np.concatenate(self._vectors) if self._vectors else None
+        )
+        await run_blocking(self._store_text)
+
+    def _store_text(self):
+        self.db.query(DocumentPage).filter(
+            DocumentPage.document_id == self.document.id,
+            DocumentPage.page_number > self.section_count
+        ).delete(synchronize_session=False)
+        store_document_text(self.db, self.document, self.text)
+        # From here on pages are read as slices of that text
+        self.db.query(DocumentPage).filter(
+            DocumentPage.document_id == self.document.id
+        ).update({DocumentPage.content: ""}, synchronize_session=False)
+
+def _start_processing(db: Session, document_id: int) -> Optional[Document]:
+    document = db.query(Document).filter(Document.id == document_id).first()
+    if document:
+        document.status = "processing"
+        publish_event(db, document, "status", status="processing")
+        db.commit()
+    return document
+
+def _reusable_sections(db: Session, document: Document):
+    """(source document, its sections) for identical content extracted before, else (None, None)"""
+    source = find_reusable_extraction(db, document)
+    return source, (load_sections(db, source.id) if source else None)
+
+def _complete(db: Session, document: Document, ingest: DocumentIngest):
+    document.extractor_version = extractor_version(document.file_type)
+    document.status = "completed"
+    publish_event(db, document, "status", status="completed", pages=ingest.section_count, chunks=ingest.chunk_count)
+    db.commit()
+    # Answers given before this document was part of the notebook are outdated
+    answer_cache.invalidate_notebook(document.notebook_id)
+
+async def process_document(document_id: int):
+    """Extract a document's text and store it with its own database session.
+
+    Text flows from the extractor into chunking, embedding and indexing
+    section by section. Every database step runs in the threadpool, so the
+    API stays responsive while documents are processed. Raises on failure so
+    the job queue can decide whether to retry; the final ``failed`` status is
+    written by the queue once retries run out.
+    """
+    # Nothing else changes the document while it is processed; keeping its
+    # attributes loaded across commits spares lazy reloads on the event loop
+    db = SessionLocal(expire_on_commit=False)
+    try:
+        document = await run_blocking(_start_processing, db, document_id)
+        if not document:
+            logger.error(f"Document {document_id} not found in database")
+            return
+        logger.info(f"Started processing document {document_id}: {document.filename}")
+
+        ingest = await run_blocking(DocumentIngest, db, document)
+        await run_blocking(ingest.reset)
+
+        # Identical content was extracted before (e.g. in another notebook): reuse it
+        source, sections = await run_blocking(_reusable_sections, db, document)
+        if sections:
+            logger.info(f"Reusing extraction of document {source.id} for document {document_id}")
+        # PDFs are parsed page-parallel with checkpoints, then fed in page by page
+        elif document.file_type == "application/pdf":
+            sections = await extract_pdf_checkpointed(db, document)
+
+        if sections is not None:
+            for text in sections:
+                await ingest.add_section(text)
+        else:
+            # Everything else streams out of the extraction process pool
+            async with aclosing(extraction_engine.stream_sections(document.file_url, document.file_type)) as stream:
+                async for text in stream:
+                    await ingest.add_section(text)
+
+        if not ingest.splitter.length:
+            raise EmptyDocumentError(f"No text could be extracted from {document.filename}")
+        logger.info(f"Successfully extracted {ingest.splitter.length} characters in {ingest.section_count} pages from {document.file_url}")
+
+        await ingest.finish()
+        await run_blocking(_complete, db, document, ingest)
+
+        logger.info(f"Document {document_id} processing completed, content length: {ingest.splitter.length}, chunks: {ingest.chunk_count}")
+
+    finally:
+        db.close()
+
+# Types whose raw file is text, so its token count is meaningful
+TEXT_FILE_TYPES = {"text/plain", "text/markdown", "text/html"}
+
+def _file_tokens(path: str, tokenizer, chunk_size: int = 64 * 1024) -> int:
+    """Tokens of a text file, read a chunk at a time (split at a line end so no
+    word is cut in two)"""
+    tokens = 0
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            chunk += f.readline()
+            tokens += tokenizer.count(chunk)
+    return tokens
+
+def token_report(db: Session, document: Document) -> dict:
+    """Tokens of a document's uploaded file against its extracted text.
+
+    Shows what normalisation (e.g. dropping HTML markup) saves in every prompt
+    the document ends up in. ``file_tokens`` is None for binary formats.
+    """
+    tokenizer = get_tokenizer(configured_model(db))
+    text = get_document_text(db, document.id)
+    text_tokens = tokenizer.count(text) if text else 0
+    file_tokens = None
+    if document.file_type in TEXT_FILE_TYPES and document.file_url:
+        try:
+            file_tokens = _file_tokens(document.file_url, tokenizer)
+        except OSError as e:
+            logger.warning(f"Could not read {document.file_url}: {e}")
+    report = {
+        "document_id": document.id,
+        "filename": document.filename,
+        "file_type": document.file_type,
+        "extractor_version": document.extractor_version or 1,
+        "file_size": document.file_size,
+        "tokenizer": tokenizer.name,
+        "text_chars": len(text) if text else 0,
+        "file_tokens": file_tokens,
+        "text_tokens": text_tokens,
+        "saved_tokens": None,
+        "reduction": None
+    }
+    if file_tokens:
+        report["saved_tokens"] = file_tokens - text_tokens
+        report["reduction"] = round(1 - text_tokens / file_tokens, 4)
+    return report
@@ -0,0 +1,376 @@
+from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional, Sequence
+from backend.config import settings
+from backend.database import SessionLocal
+from backend.models import Document, MaintenanceLock, ProcessingJob
+from backend.ingestion import process_document, EmptyDocumentError
+from backend.extraction import EXTRACTOR_VERSIONS, ExtractionInterrupted
+from backend.events import publish_event
+from backend.tokens import recount_pending, recount_requested
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import os
+import random
+import socket
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Unique per process so leases from a crashed worker are never mistaken for ours
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def _claimable(now: datetime):
+    """Jobs that are due, or running under a lease that has lapsed"""
+    return or_(
+        and_(ProcessingJob.status == "queued", ProcessingJob.available_at <= now),
+        and_(ProcessingJob.status == "running", ProcessingJob.lease_expires_at < now)
+    )
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter for the given number of failed attempts"""
+    delay = min(settings.JOB_RETRY_BASE_DELAY * (2 ** max(attempts - 1, 0)), settings.JOB_RETRY_MAX_DELAY)
+    return delay * random.uniform(0.8, 1.2)
+
+def enqueue_document(db: Session, document_id: int) -> ProcessingJob:
+    """Queue a document for processing. The caller commits."""
+    job = ProcessingJob(
+        document_id=document_id,
+        status="queued",
+        attempts=0,
+        max_attempts=settings.JOB_MAX_ATTEMPTS,
+        available_at=utcnow()
+    )
+    db.add(job)
+    return job
+
+def claim_job(db: Session, worker_id: str = WORKER_ID) -> Optional[ProcessingJob]:
+    """Atomically take a lease on the next claimable job.
+
+    The claim is a conditional UPDATE, so when several workers race for the
+    same row exactly one of them sees it change.
+    """
+    now = utcnow()
+    candidates = db.query(ProcessingJob.id).filter(_claimable(now)).order_by(
+        ProcessingJob.available_at, ProcessingJob.id
+    ).limit(10).all()
+
+    for (job_id,) in candidates:
+        claimed = db.query(ProcessingJob).filter(
+            ProcessingJob.id == job_id,
+            _claimable(now)
+        ).update({
+            ProcessingJob.status: "running",
+            ProcessingJob.attempts: ProcessingJob.attempts + 1,
+            ProcessingJob.lease_owner: worker_id,
+            ProcessingJob.lease_expires_at: now + timedelta(seconds=settings.JOB_LEASE_SECONDS),
+            ProcessingJob.updated_at: now
+        }, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            continue
+
+        job = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).first()
+        if job.attempts > job.max_attempts:
+            # A worker kept dying on this job; stop handing it out
+            _finish(db, job, "failed", "Lease expired too many times")
+            continue
+        return job
+
+    return None
+
+def heartbeat(db: Session, job_id: int, worker_id: str = WORKER_ID) -> bool:
+    """Extend our lease. Returns False if the job was taken over by another worker."""
+    extended = db.query(ProcessingJob).filter(
+        ProcessingJob.id == job_id,
+        ProcessingJob.status == "running",
+        ProcessingJob.lease_owner == worker_id
+    ).update({
+        ProcessingJob.lease_expires_at: utcnow() + timedelta(seconds=settings.JOB_LEASE_SECONDS)
+    }, synchronize_session=False)
+    db.commit()
+    return bool(extended)
+
+def _finish(db: Session, job: ProcessingJob, status: str, error: Optional[str] = None):
+    job.status = status
+    job.last_error = error
+    job.lease_owner = None
+    job.lease_expires_at = None
+    if status == "failed":
+        document = db.query(Document).filter(Document.id == job.document_id).first()
+        if document:
+            document.status = "failed"
+            publish_event(db, document, "status", status="failed", error=error, attempts=job.attempts)
+    db.commit()
+
+def complete_job(db: Session, job_id: int, worker_id: str = WORKER_ID):
+    job = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).first()
+    if job and job.lease_owner == worker_id:
+        _finish(db, job, "completed")
+
+def fail_job(db: Session, job_id: int, error: str, retryable: bool = True, worker_id: str = WORKER_ID):
+    """Record a failed attempt and schedule a retry if any attempts are left"""
+    job = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).first()
+    if not job or job.lease_owner != worker_id:
+        return
+
+    if retryable and job.attempts < job.max_attempts:
+        delay = retry_delay(job.attempts)
+        job.status = "queued"
+        job.available_at = utcnow() + timedelta(seconds=delay)
+        job.last_error = error
+        job.lease_owner = None
+        job.lease_expires_at = None
+        document = db.query(Document).filter(Document.id == job.document_id).first()
+        if document:
+            document.status = "pending"
+            publish_event(db, document, "status", status="pending", error=error, attempts=job.attempts,
+                          retry_in=round(delay, 1))
+        db.commit()
+        logger.warning(f"Job {job_id} attempt {job.attempts} failed, retrying in {delay:.1f}s: {error}")
+    else:
+        _finish(db, job, "failed", error)
+        logger.error(f"Job {job_id} failed permanently after {job.attempts} attempts: {error}")
+
+def release_job(db: Session, job_id: int, worker_id: str = WORKER_ID):
+    """Hand a job back to the queue without counting the attempt (graceful shutdown)"""
+    db.query(ProcessingJob).filter(
+        ProcessingJob.id == job_id,
+        ProcessingJob.lease_owner == worker_id,
+        ProcessingJob.status == "running"
+    ).update({
+        ProcessingJob.status: "queued",
+        ProcessingJob.attempts: ProcessingJob.attempts - 1,
+        ProcessingJob.lease_owner: None,
+        ProcessingJob.lease_expires_at: None,
+        ProcessingJob.available_at: utcnow()
+    }, synchronize_session=False)
+    db.commit()
+
+def acquire_lock(db: Session, name: str, seconds: Optional[int] = None, worker_id: str = WORKER_ID) -> bool:
+    """Take or extend the named lease. Returns False while another worker holds it.
+
+    Like job claims, taking it is a conditional UPDATE, so exactly one of
+    several racing workers succeeds.
+    """
+    if not db.query(MaintenanceLock.name).filter(MaintenanceLock.name == name).first():
+        try:
+            db.add(MaintenanceLock(name=name))
+            db.commit()
+        except IntegrityError:
+            db.rollback()  # another worker created it first
+
+    now = utcnow()
+    taken = db.query(MaintenanceLock).filter(
+        MaintenanceLock.name == name,
+        or_(
+            MaintenanceLock.owner.is_(None),
+            MaintenanceLock.owner == worker_id,
+            MaintenanceLock.expires_at < now
+        )
+    ).update({
+        MaintenanceLock.owner: worker_id,
+        MaintenanceLock.expires_at: now + timedelta(seconds=seconds or settings.MAINTENANCE_LEASE_SECONDS)
+    }, synchronize_session=False)
+    db.commit()
+    return bool(taken)
+
+def release_lock(db: Session, name: str, worker_id: str = WORKER_ID):
+    db.query(MaintenanceLock).filter(
+        MaintenanceLock.name == name,
+        MaintenanceLock.owner == worker_id
+    ).update({
+        MaintenanceLock.owner: None,
+        MaintenanceLock.expires_at: None
+    }, synchronize_session=False)
+    db.commit()
+
+def run_exclusive(db: Session, name: str, steps: Sequence[Callable[[Session], object]]) -> bool:
+    """Run ``steps`` in order under the named lease, extending it after each.
+
+    Returns False without running anything when another worker holds the
+    lease; whatever it is doing then covers this worker too.
+    """
+    if not acquire_lock(db, name):
+        logger.info(f"Skipping {name}: another worker is running it")
+        return False
+    try:
+        for step in steps:
+            step(db)
+            acquire_lock(db, name)
+    finally:
+        db.rollback()
+        release_lock(db, name)
+    return True
+
+def recover_stale_documents(db: Session) -> int:
+    """Queue documents left pending/processing without a live job.
+
+    Covers documents uploaded before the queue existed and documents whose
+    job row was lost. Jobs with lapsed leases need no help here: any worker
+    reclaims them through ``claim_job``.
+    """
+    active_jobs = db.query(ProcessingJob.document_id).filter(
+        ProcessingJob.status.in_(["queued", "running"])
+    )
+    stale = db.query(Document.id).filter(
+        Document.status.in_(["pending", "processing"]),
+        ~Document.id.in_(active_jobs)
+    ).all()
+    for (document_id,) in stale:
+        enqueue_document(db, document_id)
+    db.commit()
+    if stale:
+        logger.info(f"Re-queued {len(stale)} stale documents")
+    return len(stale)
+
+def requeue_outdated_documents(db: Session) -> int:
+    """Queue completed documents whose extractor has changed since they were processed"""
+    active_jobs = db.query(ProcessingJob.document_id).filter(
+        ProcessingJob.status.in_(["queued", "running"])
+    )
+    outdated = []
+    for file_type, version in EXTRACTOR_VERSIONS.items():
+        if version <= 1:
+            continue
+        outdated += db.query(Document).filter(
+            Document.file_type == file_type,
+            Document.status == "completed",
+            func.coalesce(Document.extractor_version, 1) < version,
+            ~Document.id.in_(active_jobs)
+        ).all()
+    for document in outdated:
+        document.status = "pending"
+        publish_event(db, document, "status", status="pending")
+        enqueue_document(db, document.id)
+    db.commit()
+    if outdated:
+        logger.info(f"Re-queued {len(outdated)} documents for re-extraction")
+    return len(outdated)
+
+def _in_session(func, *args, **kwargs):
+    """Call ``func(db, ...)`` with a session of its own. Blocking; run in the threadpool"""
+    db = SessionLocal()
+    try:
+        return func(db, *args, **kwargs)
+    finally:
+        db.close()
+
+class JobWorker:
+    """Claims processing jobs from the database and runs them in this process.
+
+    Every server process runs one worker; they coordinate only through job
+    leases, so any number of processes or hosts can share the queue.
+    """
+
+    def __init__(self, concurrency: Optional[int] = None, poll_interval: Optional[float] = None):
+        self.concurrency = concurrency or settings.JOB_WORKER_CONCURRENCY
+        self.poll_interval = poll_interval or settings.JOB_POLL_INTERVAL
+        self._running: Dict[int, asyncio.Task] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        db = SessionLocal()
+        try:
+            # Every server process starts a worker; only one should queue these
+            run_exclusive(db, "recover-jobs", [recover_stale_documents, requeue_outdated_documents])
+        finally:
+            db.close()
+        self._wakeup = asyncio.Event()
+        self._loop_task = asyncio.create_task(self._run())
+        logger.info(f"Job worker {WORKER_ID} started with concurrency {self.concurrency}")
+
+    def notify(self):
+        """Wake the worker so newly queued jobs start without waiting for the next poll"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self):
+        if self._loop_task:
+            self._loop_task.cancel()
+        job_ids = list(self._running)
+        tasks = list(self._running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for job_id in job_ids:
+            await run_in_threadpool(_in_session, release_job, job_id)
+
+    def _claim_jobs(self, slots: int):
+        """Claim up to ``slots`` jobs as (job_id, document_id). Blocking; run in the threadpool"""
+        claimed = []
+        db = SessionLocal()
+        try:
+            while len(claimed) < slots:
+                job = claim_job(db)
+                if not job:
+                    break
+                claimed.append((job.id, job.document_id))
+        except Exception as e:
+            logger.error(f"Error claiming jobs: {e}")
+        finally:
+            db.close()
+        return claimed
+
+    async def _run(self):
+        while True:
+            claimed = []
+            if len(self._running) < self.concurrency:
+                # Off the event loop: waiting for a pooled connection here would
+                # stall every request that has to run to release one
+                claimed = await run_in_threadpool(self._claim_jobs, self.concurrency - len(self._running))
+                for job_id, document_id in claimed:
+                    self._running[job_id] = asyncio.create_task(self._execute(job_id, document_id))
+
+            if not claimed:
+                if recount_pending():
+                    # Idle: recount chunks measured by a previous model's tokenizer
+                    try:
+                        await run_in_threadpool(_in_session, recount_requested)
+                    except Exception as e:
+                        logger.error(f"Error recounting chunk tokens: {e}")
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _execute(self, job_id: int, document_id: int):
+        work = asyncio.create_task(process_document(document_id))
+        try:
+            while not work.done():
+                await asyncio.wait({work}, timeout=settings.JOB_LEASE_SECONDS / 3)
+                if work.done():
+                    break
+                if not await run_in_threadpool(_in_session, heartbeat, job_id):
+                    logger.warning(f"Lost lease on job {job_id}, abandoning it")
+                    work.cancel()
+                    return
+
+            # A cancelled pool future surfaces as a cancelled task, which has no exception()
+            error = ExtractionInterrupted("Processing was cancelled") if work.cancelled() else work.exception()
+            if error is None:
+                await run_in_threadpool(_in_session, complete_job, job_id)
+            elif isinstance(error, ExtractionInterrupted):
+                # Not the document's fault: back in the queue straight away, attempt not counted
+                logger.warning(f"Job {job_id} was interrupted ({error}), requeueing it")
+                await run_in_threadpool(_in_session, release_job, job_id)
+            else:
+                logger.error(f"Error processing document {document_id}: {error}")
+                await run_in_threadpool(_in_session, fail_job, job_id, str(error) or type(error).__name__,
+                                        retryable=not isinstance(error, EmptyDocumentError))
+        finally:
+            if not work.done():
+                work.cancel()
+            self._running.pop(job_id, None)
+            # A slot just opened up
+            self.notify()
+
+job_worker = JobWorker()
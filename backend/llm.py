@@ -0,0 +1,147 @@
+from contextlib import contextmanager
+from typing import Dict, Optional
+from backend.config import settings
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import httpx
+import logging
+
+try:
+    from langchain_openai import ChatOpenAI
+    LLM_AVAILABLE = True
+except ImportError:
+    LLM_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+def client_key(api_key: str, base_url: Optional[str], model: str, temperature: float, max_tokens: int) -> str:
+    """Hash of the settings a client is built from, so API keys are not kept as plain dictionary keys"""
+    payload = json.dumps([api_key, base_url or "", model, float(temperature), int(max_tokens)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class PooledClient:
+    def __init__(self, llm, http_client: httpx.Client, http_async_client: httpx.AsyncClient):
+        self.llm = llm
+        self.http_client = http_client
+        self.http_async_client = http_async_client
+        self.leases = 0
+        self.last_used = time.monotonic()
+
+class LLMClientRegistry:
+    """Process-wide chat model clients, one per distinct configuration.
+
+    Each client owns an HTTP connection pool that is kept alive between
+    requests, so only the first request to a provider pays for the TCP and
+    TLS handshakes. A changed configuration hashes to a new key and gets a
+    new client; clients nobody has used for LLM_CLIENT_IDLE_TTL are closed.
+    """
+
+    def __init__(self, idle_ttl: Optional[float] = None, max_clients: Optional[int] = None):
+        self.idle_ttl = idle_ttl or settings.LLM_CLIENT_IDLE_TTL
+        self.max_clients = max_clients or settings.LLM_CLIENT_MAX
+        self._clients: Dict[str, PooledClient] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def start(self):
+        # Async pools must be closed on the loop that used them
+        self._loop = asyncio.get_running_loop()
+        self._sweeper = asyncio.create_task(self._sweep())
+
+    async def _sweep(self):
+        # lease() evicts too, but once traffic stops nothing would close idle pools
+        while True:
+            await asyncio.sleep(self.idle_ttl / 2)
+            try:
+                with self._lock:
+                    self._evict(time.monotonic())
+            except Exception as e:
+                logger.error(f"Error closing idle LLM clients: {e}")
+
+    def _build(self, api_key: str, base_url: Optional[str], model: str, temperature: float, max_tokens: int) -> PooledClient:
+        limits = httpx.Limits(
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_MAX_CONNECTIONS,
+            keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY
+        )
+        timeout = httpx.Timeout(settings.LLM_REQUEST_TIMEOUT, connect=10.0)
+        http_client = httpx.Client(limits=limits, timeout=timeout)
+        http_async_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+        kwargs = {
+            "api_key": api_key,
+            "model_name": model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "http_client": http_client,
+            "http_async_client": http_async_client,
+            # The SDK would otherwise apply its own 600 s timeout and retry on
+            # its own; deadlines and retries are handled in llm_calls
+            "timeout": timeout,
+            "max_retries": 0
+        }
+        if base_url:
+            kwargs["base_url"] = base_url
+        return PooledClient(ChatOpenAI(**kwargs), http_client, http_async_client)
+
+    def _close(self, client: PooledClient):
+        client.http_client.close()
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                asyncio.run_coroutine_threadsafe(client.http_async_client.aclose(), loop)
+            except RuntimeError:
+                pass  # loop shutting down
+
+    def _evict(self, now: float):
+        """Close idle clients and, beyond max_clients, the least recently used idle ones. Holds the lock."""
+        idle = sorted(
+            (client.last_used, key) for key, client in self._clients.items() if not client.leases
+        )
+        excess = len(self._clients) - self.max_clients
+        for last_used, key in idle:
+            if now - last_used < self.idle_ttl and excess <= 0:
+                break
+            self._close(self._clients.pop(key))
+            excess -= 1
+
+    @contextmanager
+    def lease(self, api_key: str, model: str, temperature: float, max_tokens: int, base_url: Optional[str] = None):
+        """Borrow the client for a configuration, building it on first use.
+
+        A leased client is never evicted, however long its response streams.
+        """
+        key = client_key(api_key, base_url, model, temperature, max_tokens)
+        with self._lock:
+            now = time.monotonic()
+            client = self._clients.get(key)
+            if client is None:
+                client = self._build(api_key, base_url, model, temperature, max_tokens)
+                self._clients[key] = client
+                logger.info(f"Created LLM client {key[:12]} for model {model} ({len(self._clients)} pooled)")
+            client.leases += 1
+            client.last_used = now
+            self._evict(now)
+        try:
+            yield client.llm
+        finally:
+            with self._lock:
+                client.leases -= 1
+                client.last_used = time.monotonic()
+
+    async def aclose(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.http_client.close()
+            await client.http_async_client.aclose()
+
+llm_clients = LLMClientRegistry()
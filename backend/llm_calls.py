@@ -0,0 +1,197 @@
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional
+from backend.config import settings
+import asyncio
+import random
+import time
+import httpx
+import logging
+
+try:
+    import openai
+    OPENAI_ERRORS = True
+except ImportError:
+    OPENAI_ERRORS = False
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth another try: timeouts, conflicts, rate limits and server errors
+TRANSIENT_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+class FirstTokenTimeout(Exception):
+    """The model produced nothing before the first-token deadline"""
+
+class DeadlineExceeded(Exception):
+    """The whole answer took longer than the total deadline"""
+
+def is_transient(error: BaseException) -> bool:
+    if isinstance(error, (FirstTokenTimeout, httpx.TransportError)):
+        return True
+    if OPENAI_ERRORS:
+        if isinstance(error, openai.APIConnectionError):  # includes APITimeoutError
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in TRANSIENT_STATUS
+    return False
+
+def backoff_delay(retry: int) -> float:
+    """Full-jitter exponential backoff for the given (0-based) retry"""
+    ceiling = min(settings.LLM_RETRY_MAX_DELAY, settings.LLM_RETRY_BASE_DELAY * 2 ** retry)
+    return random.uniform(0, ceiling)
+
+class LatencyTracker:
+    """Recent times to first token per model, for the hedging threshold"""
+
+    def __init__(self, size: int = 200):
+        self.size = size
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, model: str, seconds: float):
+        self._samples.setdefault(model, deque(maxlen=self.size)).append(seconds)
+
+    def percentile(self, model: str, fraction: float) -> Optional[float]:
+        samples = self._samples.get(model)
+        if not samples or len(samples) < settings.LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+first_token_latency = LatencyTracker()
+
+def hedge_delay(model: str) -> Optional[float]:
+    """Seconds after which a slow request gets a hedge, or None for no hedging"""
+    if not settings.LLM_HEDGE:
+        return None
+    if settings.LLM_HEDGE_AFTER is not None:
+        return settings.LLM_HEDGE_AFTER
+    return first_token_latency.percentile(model, 0.95)
+
+class _Attempt:
+    """One upstream request, started by pulling its first chunk in a task"""
+
+    def __init__(self, open_stream: Callable[[], AsyncIterator]):
+        self.stream = open_stream()
+        self.first = asyncio.ensure_future(self.stream.__anext__())
+
+    async def close(self):
+        if not self.first.done():
+            # Cancelling the pending read unwinds the stream from inside,
+            # which closes the request; awaiting it here could be cut short
+            self.first.cancel()
+            return
+        if not self.first.cancelled():
+            self.first.exception()  # retrieved, so asyncio does not log it
+        aclose = getattr(self.stream, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+async def _race_first_chunk(open_stream, model: str, first_token_deadline: float):
+    """Start a request (plus a hedge if it is slow) and return (winning attempt, first chunk).
+
+    The first chunk is None when the stream ended without output. Losing
+    requests are closed. Raises the error of the last attempt to fail, or
+    FirstTokenTimeout.
+    """
+    started = time.monotonic()
+    attempts: List[_Attempt] = [_Attempt(open_stream)]
+    hedge_after = hedge_delay(model)
+    last_error: Optional[BaseException] = None
+    try:
+        while True:
+            now = time.monotonic()
+            wake = first_token_deadline
+            if hedge_after is not None and len(attempts) == 1:
+                wake = min(wake, started + hedge_after)
+            pending = [attempt.first for attempt in attempts if not attempt.first.done()]
+            if pending:
+                await asyncio.wait(pending, timeout=max(wake - now, 0), return_when=asyncio.FIRST_COMPLETED)
+
+            for attempt in list(attempts):
+                if not attempt.first.done():
+                    continue
+                error = attempt.first.exception()
+                if error is None or isinstance(error, StopAsyncIteration):
+                    first_token_latency.record(model, time.monotonic() - started)
+                    if len(attempts) > 1:
+                        logger.info(f"Hedged request to {model}: attempt {attempts.index(attempt) + 1} answered first")
+                    attempts.remove(attempt)
+                    return attempt, (None if error else attempt.first.result())
+                # Failed; let any other attempt carry on
+                last_error = error
+                attempts.remove(attempt)
+                await attempt.close()
+
+            now = time.monotonic()
+            if not attempts:
+                raise last_error
+            if now >= first_token_deadline:
+                raise FirstTokenTimeout(f"No output from {model} within {settings.LLM_TIMEOUT}s")
+            if hedge_after is not None and len(attempts) == 1 and last_error is None and now >= started + hedge_after:
+                logger.info(f"No first token from {model} after {hedge_after:.2f}s, sending a hedged request")
+                attempts.append(_Attempt(open_stream))
+                hedge_after = None
+    finally:
+        for attempt in attempts:
+            await attempt.close()
+
+async def stream_chat(llm, messages, model: str = "") -> AsyncIterator:
+    """``llm.astream(messages)`` with deadlines, retries and optional hedging.
+
+    The first chunk must arrive within LLM_TIMEOUT and the whole answer within
+    LLM_TOTAL_TIMEOUT. Transient failures before the first chunk are retried
+    up to LLM_MAX_RETRIES times with jittered backoff; once output has been
+    passed on, an error is raised as is, since the caller cannot take the
+    chunks back. With LLM_HEDGE, a request that is slower to start than the
+    p95 first-token time is raced against a second one.
+    """
+    model = model or getattr(llm, "model_name", "")
+    total_deadline = time.monotonic() + settings.LLM_TOTAL_TIMEOUT
+    retry = 0
+    while True:
+        first_token_deadline = min(time.monotonic() + settings.LLM_TIMEOUT, total_deadline)
+        try:
+            attempt, chunk = await _race_first_chunk(lambda: llm.astream(messages), model, first_token_deadline)
+            break
+        except Exception as e:
+            if not is_transient(e) or retry >= settings.LLM_MAX_RETRIES:
+                raise
+            delay = backoff_delay(retry)
+            if time.monotonic() + delay >= total_deadline:
+                raise
+            retry += 1
+            logger.warning(f"LLM call to {model} failed ({type(e).__name__}: {e}), retry {retry} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    stream = attempt.stream
+    try:
+        if chunk is None:
+            return
+        yield chunk
+        while True:
+            remaining = total_deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"Answer from {model} took longer than {settings.LLM_TOTAL_TIMEOUT}s")
+            # asyncio.timeout rather than wait_for: the read stays in this task, so
+            # a cancellation from outside unwinds the stream before it is closed
+            try:
+                async with asyncio.timeout(remaining):
+                    chunk = await stream.__anext__()
+            except StopAsyncIteration:
+                return
+            except TimeoutError:
+                raise DeadlineExceeded(f"Answer from {model} took longer than {settings.LLM_TOTAL_TIMEOUT}s")
+            yield chunk
+    finally:
+        await attempt.close()
+
+async def invoke_chat(llm, messages, model: str = "") -> str:
+    """The whole answer as text, under the same deadlines, retries and hedging as stream_chat"""
+    parts = []
+    stream = stream_chat(llm, messages, model)
+    try:
+        async for chunk in stream:
+            if chunk.content:
+                parts.append(chunk.content)
+    finally:
+        await stream.aclose()
+    return "".join(parts)
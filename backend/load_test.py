@@ -0,0 +1,307 @@
+"""
+聊天 / 内容生成流式接口压测
+
+    python backend/load_test.py [--concurrency 1,10,50] [--requests 3] [--endpoints chat,content]
+                                [--ttft 0.2] [--tps 50] [--tokens 50] [--error-rate 0] [--stall-rate 0]
+
+在独立子进程中分别启动假 LLM 服务（fake_llm.py）和应用本身（临时数据库，
+预置一个文档），然后按每个并发级别对 /api/v1/chat/ 和 /api/v1/content/stream
+发起请求（每个并发连接 --requests 个），报告：
+  - 首 token 时间（TTFT）分位数，以及减去假服务配置的 TTFT 后的自身开销
+  - token 间隔（ITL）分位数
+  - 吞吐量（请求/秒、token/秒）
+  - 应用进程的 CPU 占用和 RSS 分位数
+假服务的延迟是已知的，所以多出来的部分就是我们自己流式链路的开销。
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import json
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import unicodedata
+import httpx
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@dataclass
+class Result:
+    status: str  # ok, rejected (429), error
+    ttft: Optional[float] = None
+    gaps: List[float] = field(default_factory=list)  # seconds between consecutive tokens
+    tokens: int = 0
+    duration: float = 0.0
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class ProcessSampler:
+    """Samples a process's CPU use (percent of one core) and RSS from a background thread"""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.cpu: List[float] = []
+        self.rss: List[float] = []  # MB
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._process = psutil.Process(pid) if PSUTIL_AVAILABLE else None
+
+    def _read(self):
+        """(CPU seconds, RSS bytes)"""
+        if self._process is not None:
+            times = self._process.cpu_times()
+            return times.user + times.system, self._process.memory_info().rss
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        cpu = (int(fields[11]) + int(fields[12])) / ticks  # utime, stime
+        with open(f"/proc/{self.pid}/status") as f:
+            rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+        return cpu, rss
+
+    def _run(self):
+        last_cpu, _ = self._read()
+        last_time = time.monotonic()
+        while not self._stop.wait(self.interval):
+            cpu, rss = self._read()
+            now = time.monotonic()
+            self.cpu.append((cpu - last_cpu) / (now - last_time) * 100)
+            self.rss.append(rss / 1024 / 1024)
+            last_cpu, last_time = cpu, now
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+def seed_database(database_url: str) -> int:
+    """Create the schema with one completed document; the server chunks and indexes it on startup"""
+    os.environ["DATABASE_URL"] = database_url
+    from backend.database import SessionLocal, engine
+    from backend.models import Base, Notebook, Document
+    from backend.storage import set_document_text
+    Base.metadata.create_all(bind=engine)
+
+    text = "\n\n".join(
+        f"第 {index} 节：检索增强生成把文档切分成块，为问题找出最相关的片段，"
+        f"再交给模型回答。Section {index} covers retrieval, chunking and streaming answers."
+        for index in range(200)
+    )
+    db = SessionLocal()
+    try:
+        notebook = Notebook(name="load test")
+        db.add(notebook)
+        db.flush()
+        document = Document(
+            notebook_id=notebook.id, filename="load_test.txt", file_type="text/plain",
+            file_url="", file_size=len(text.encode("utf-8")), status="completed"
+        )
+        db.add(document)
+        db.flush()
+        set_document_text(db, document, text)
+        db.commit()
+        return notebook.id
+    finally:
+        db.close()
+
+def wait_for(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args} exited with {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+async def one_request(client: httpx.AsyncClient, url: str, payload: dict) -> Result:
+    start = time.monotonic()
+    try:
+        async with client.stream("POST", url, json=payload) as response:
+            if response.status_code == 429:
+                await response.aread()
+                return Result("rejected", duration=time.monotonic() - start)
+            if response.status_code != 200:
+                await response.aread()
+                return Result("error", duration=time.monotonic() - start)
+            result = Result("ok")
+            last = None
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                event = json.loads(line[5:])
+                if event.get("type") == "error":
+                    result.status = "error"
+                elif event.get("type") == "content":
+                    now = time.monotonic()
+                    if last is None:
+                        result.ttft = now - start
+                    else:
+                        result.gaps.append(now - last)
+                    last = now
+                    result.tokens += 1
+            result.duration = time.monotonic() - start
+            return result
+    except httpx.HTTPError:
+        return Result("error", duration=time.monotonic() - start)
+
+async def run_level(url: str, payload: dict, concurrency: int, requests_per_worker: int) -> List[Result]:
+    results: List[Result] = []
+
+    async def worker():
+        for _ in range(requests_per_worker):
+            results.append(await one_request(client, url, payload))
+
+    limits = httpx.Limits(max_connections=concurrency + 10, max_keepalive_connections=concurrency + 10)
+    async with httpx.AsyncClient(timeout=600, limits=limits) as client:
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return results
+
+def _ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.0f}"
+
+def report_row(endpoint: str, concurrency: int, results: List[Result], elapsed: float,
+               sampler: ProcessSampler, configured_ttft: float) -> str:
+    ok = [result for result in results if result.status == "ok"]
+    rejected = sum(result.status == "rejected" for result in results)
+    errors = sum(result.status == "error" for result in results)
+    ttfts = [result.ttft for result in ok if result.ttft is not None]
+    gaps = [gap for result in ok for gap in result.gaps]
+    tokens = sum(result.tokens for result in ok)
+    overhead = percentile(ttfts, 0.5)
+    overhead = None if overhead is None else overhead - configured_ttft
+    cpu_p50, cpu_p95 = percentile(sampler.cpu, 0.5), percentile(sampler.cpu, 0.95)
+    rss_p50, rss_max = percentile(sampler.rss, 0.5), max(sampler.rss, default=None)
+    return (
+        f"{endpoint:<9}{concurrency:>6}{len(ok):>6}{rejected:>6}{errors:>6}"
+        f"{len(ok) / elapsed:>9.1f}{tokens / elapsed:>9.0f}"
+        f"{_ms(percentile(ttfts, 0.5)):>9}{_ms(percentile(ttfts, 0.95)):>8}{_ms(percentile(ttfts, 0.99)):>8}"
+        f"{_ms(overhead):>8}"
+        f"{_ms(percentile(gaps, 0.5)):>8}{_ms(percentile(gaps, 0.95)):>7}{_ms(percentile(gaps, 0.99)):>7}"
+        f"{'-' if cpu_p50 is None else f'{cpu_p50:.0f}':>8}{'-' if cpu_p95 is None else f'{cpu_p95:.0f}':>7}"
+        f"{'-' if rss_p50 is None else f'{rss_p50:.0f}':>8}{'-' if rss_max is None else f'{rss_max:.0f}':>8}"
+    )
+
+def _align(text: str, width: int, left: bool = False) -> str:
+    """Pad to a terminal width, counting CJK characters as two columns"""
+    columns = sum(2 if unicodedata.east_asian_width(char) in "WF" else 1 for char in text)
+    padding = " " * max(width - columns, 0)
+    return text + padding if left else padding + text
+
+HEADER = _align("接口", 9, left=True) + "".join(_align(title, width) for title, width in [
+    ("并发", 6), ("成功", 6), ("429", 6), ("失败", 6), ("请求/s", 9), ("token/s", 9),
+    ("TTFT p50", 9), ("p95", 8), ("p99", 8), ("开销p50", 8),
+    ("ITL p50", 8), ("p95", 7), ("p99", 7), ("CPU%p50", 8), ("p95", 7), ("RSS p50", 8), ("max", 8)
+])
+
+def main():
+    parser = argparse.ArgumentParser(description="聊天 / 内容生成流式接口压测")
+    parser.add_argument("--concurrency", default="1,10,50", help="逗号分隔的并发级别")
+    parser.add_argument("--requests", type=int, default=3, help="每个并发连接发起的请求数")
+    parser.add_argument("--endpoints", default="chat,content", help="chat、content 或两者")
+    parser.add_argument("--ttft", type=float, default=0.2, help="假服务的首 token 延迟（秒）")
+    parser.add_argument("--tps", type=float, default=50.0, help="假服务每秒 token 数")
+    parser.add_argument("--tokens", type=int, default=50, help="每个回答的 token 数")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    parser.add_argument("--llm-concurrency", type=int, default=10000,
+                        help="应用的 LLM_MAX_CONCURRENCY（默认足够大，不触发准入控制）")
+    parser.add_argument("--llm-queue", type=int, default=10000, help="应用的 LLM_MAX_QUEUE")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(",")]
+    endpoints = args.endpoints.split(",")
+
+    workdir = tempfile.mkdtemp(prefix="notebooklm-load-")
+    database_url = f"sqlite:///{os.path.join(workdir, 'load.db')}"
+    notebook_id = seed_database(database_url)
+
+    llm_port, app_port = free_port(), free_port()
+    fake = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "backend", "fake_llm.py"), "--port", str(llm_port),
+        "--ttft", str(args.ttft), "--tps", str(args.tps), "--tokens", str(args.tokens),
+        "--error-rate", str(args.error_rate), "--stall-rate", str(args.stall_rate)
+    ], stdout=subprocess.DEVNULL)
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        VECTOR_INDEX_DIR=os.path.join(workdir, "vectors"),
+        LLM_MAX_CONCURRENCY=str(args.llm_concurrency),
+        LLM_MAX_QUEUE=str(args.llm_queue),
+        ANSWER_CACHE="false"  # every request repeats the question; measure the LLM path, not replays
+    )
+    server = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "backend.main:app",
+        "--host", "127.0.0.1", "--port", str(app_port), "--log-level", "warning", "--backlog", "4096"
+    ], cwd=ROOT, env=env)
+    # Stopped from outside (Ctrl+C is already an exception): still shut the servers down
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+    try:
+        wait_for(f"http://127.0.0.1:{llm_port}/v1/models", fake)
+        wait_for(f"http://127.0.0.1:{app_port}/health", server)
+        base = f"http://127.0.0.1:{app_port}/api/v1"
+        for key, value in {
+            "llm.api_key": "load-test",
+            "llm.model_id": "fake-model",
+            "llm.base_url": f"http://127.0.0.1:{llm_port}/v1",
+            "llm.max_tokens": str(args.tokens * 2)
+        }.items():
+            httpx.post(f"{base}/config/", params={"key": key, "value": value, "category": "llm"}).raise_for_status()
+
+        targets: Dict[str, tuple] = {
+            "chat": (f"{base}/chat/", {"notebook_id": notebook_id, "message": "检索增强生成是怎么工作的？"}),
+            "content": (f"{base}/content/stream", {"notebook_id": notebook_id, "content_type": "report"})
+        }
+        print(f"假 LLM: TTFT {args.ttft * 1000:.0f} ms, {args.tps:g} token/s, {args.tokens} token/回答, "
+              f"错误率 {args.error_rate:g}, 卡住率 {args.stall_rate:g}")
+        print(f"应用进程 PID {server.pid}，CPU/RSS 采样{'（psutil）' if PSUTIL_AVAILABLE else '（/proc）'}；时间单位 ms，RSS 单位 MB\n")
+        print(HEADER)
+        for concurrency in levels:
+            for endpoint in endpoints:
+                url, payload = targets[endpoint]
+                with ProcessSampler(server.pid) as sampler:
+                    start = time.monotonic()
+                    results = asyncio.run(run_level(url, payload, concurrency, args.requests))
+                    elapsed = time.monotonic() - start
+                print(report_row(endpoint, concurrency, results, elapsed, sampler, args.ttft), flush=True)
+    finally:
+        for process in (server, fake):
+            process.terminate()
+        for process in (server, fake):
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+if __name__ == "__main__":
+    main()
@@ -3,20 +3,56 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from backend.config import settings
-from backend.database import engine
+from backend.database import engine, migrate_schema, SessionLocal
 from backend.models import Base, Notebook, Document, Conversation, Message, Note
 from backend.config_model import Config
 from backend.routers import notebooks, documents, chat, content, config, podcast, notes
+from backend.extraction import extraction_engine
+from backend.jobs import job_worker, run_exclusive
+from backend.events import event_broker
+from backend.llm import llm_clients
+from backend.storage import collect_unreferenced_blobs, migrate_document_text
+from backend.ingestion import backfill_pages, release_page_text, backfill_chunks, backfill_vectors
+from backend.search import create_fts_index, backfill_index
+from contextlib import asynccontextmanager
 import os
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
+migrate_schema()
+create_fts_index()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db = SessionLocal()
+    try:
+        # Every uvicorn worker runs this; the lease keeps them from racing on the same rows and files
+        run_exclusive(db, "startup-maintenance", [
+            collect_unreferenced_blobs,
+            migrate_document_text,
+            backfill_pages,
+            release_page_text,
+            backfill_chunks,
+            backfill_index,
+            backfill_vectors
+        ])
+    finally:
+        db.close()
+    llm_clients.start()
+    await event_broker.start()
+    await job_worker.start()
+    yield
+    await job_worker.stop()
+    await event_broker.stop()
+    await llm_clients.aclose()
+    extraction_engine.shutdown()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="NotebookLM API",
     description="AI-powered intelligent notebook assistant",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
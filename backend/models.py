@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, LargeBinary, UniqueConstraint, event, update
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from backend.database import Base
 import enum
 
@@ -24,11 +24,126 @@ class Document(Base):
     file_type = Column(String(50), nullable=False)
     file_url = Column(String(512), nullable=False)
     file_size = Column(Integer, nullable=False)
-    content = Column(Text, nullable=True)  # Extracted text content
+    extractor_version = Column(Integer, nullable=True)  # see extraction.EXTRACTOR_VERSIONS; NULL = 1
+    content_hash = Column(String(64), nullable=True, index=True)  # SHA-256 of the uploaded file
+    # Legacy location of the extracted text; new text lives in DocumentContent.
+    # Deferred so listing documents never loads it.
+    content = deferred(Column(Text, nullable=True))
     status = Column(String(20), default='pending')  # Use String for SQLite compatibility
     created_at = Column(DateTime, server_default=func.now())
     
     notebook = relationship("Notebook", back_populates="documents")
+    jobs = relationship("ProcessingJob", back_populates="document", cascade="all, delete-orphan")
+    pages = relationship("DocumentPage", back_populates="document", cascade="all, delete-orphan")
+    chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan")
+    text = relationship("DocumentContent", uselist=False, cascade="all, delete-orphan")
+
+class DocumentContent(Base):
+    """Extracted text of a document, kept apart so document rows stay small"""
+    __tablename__ = "document_contents"
+    
+    document_id = Column(Integer, ForeignKey("documents.id"), primary_key=True)
+    data = deferred(Column(LargeBinary, nullable=False))
+    compression = Column(String(10), nullable=False, default="none")  # none, zlib, zstd
+    size = Column(Integer, nullable=False)  # length of the text in characters
+
+class DocumentPage(Base):
+    __tablename__ = "document_pages"
+    __table_args__ = (UniqueConstraint("document_id", "page_number"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, index=True)
+    page_number = Column(Integer, nullable=False)  # 1-based; a section for documents without pages
+    content = Column(Text, nullable=False, default="")
+    start_offset = Column(Integer, nullable=True)  # where the page begins in the document text
+    char_count = Column(Integer, nullable=True)
+    
+    document = relationship("Document", back_populates="pages")
+
+class DocumentChunk(Base):
+    __tablename__ = "document_chunks"
+    __table_args__ = (UniqueConstraint("document_id", "chunk_index"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, index=True)
+    notebook_id = Column(Integer, ForeignKey("notebooks.id"), nullable=False, index=True)
+    chunk_index = Column(Integer, nullable=False)  # position within the document
+    content = Column(Text, nullable=False)
+    start_offset = Column(Integer, nullable=False)  # character offsets into the extracted text
+    end_offset = Column(Integer, nullable=False)
+    page_number = Column(Integer, nullable=True)  # page the chunk starts on, when known
+    char_count = Column(Integer, nullable=False)
+    token_count = Column(Integer, nullable=False)
+    token_encoding = Column(String(64), nullable=True)  # tokenizer that measured token_count; NULL = estimate
+    
+    document = relationship("Document", back_populates="chunks")
+
+class Blob(Base):
+    __tablename__ = "blobs"
+    
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(Integer, nullable=False)
+    path = Column(String(512), nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)  # documents pointing at this blob
+    created_at = Column(DateTime, server_default=func.now())
+
+class ProcessingJob(Base):
+    __tablename__ = "processing_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, index=True)
+    status = Column(String(20), default='queued', index=True)  # queued, running, completed, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    available_at = Column(DateTime, nullable=False)  # not claimable before this time (retry backoff)
+    lease_owner = Column(String(128), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, onupdate=func.now())
+    
+    document = relationship("Document", back_populates="jobs")
+
+class MaintenanceLock(Base):
+    """A named lease, so that one server process at a time runs a maintenance task"""
+    __tablename__ = "maintenance_locks"
+    
+    name = Column(String(50), primary_key=True)
+    owner = Column(String(128), nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+
+class DocumentEvent(Base):
+    """A document status change or progress update, streamed to clients of its notebook"""
+    __tablename__ = "document_events"
+    # Ids are stream positions (SSE Last-Event-ID) and must never be handed out again
+    # once older rows are pruned. Tables created before this keep plain rowids, which
+    # EventBroker._prune covers by always keeping the newest row.
+    __table_args__ = {"sqlite_autoincrement": True}
+    
+    # No foreign keys: events outlive the documents they describe (e.g. "deleted")
+    id = Column(Integer, primary_key=True, index=True)
+    notebook_id = Column(Integer, nullable=False, index=True)
+    document_id = Column(Integer, nullable=False)
+    event = Column(String(20), nullable=False)  # status, progress, deleted
+    status = Column(String(20), nullable=True)
+    data = Column(Text, nullable=True)  # JSON details: error, pages done, chunk count...
+    created_at = Column(DateTime, server_default=func.now(), index=True)
+
+# Keep Blob.ref_count in step with the documents that reference a blob, whichever
+# code path inserts or deletes them (including notebook cascades)
+@event.listens_for(Document, "after_insert")
+def _acquire_blob(mapper, connection, target):
+    if target.content_hash:
+        connection.execute(
+            update(Blob).where(Blob.sha256 == target.content_hash).values(ref_count=Blob.ref_count + 1)
+        )
+
+@event.listens_for(Document, "after_delete")
+def _release_blob(mapper, connection, target):
+    if target.content_hash:
+        connection.execute(
+            update(Blob).where(Blob.sha256 == target.content_hash).values(ref_count=Blob.ref_count - 1)
+        )
 
 class Conversation(Base):
     __tablename__ = "conversations"
@@ -45,6 +160,7 @@ class Message(Base):
     conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
     role = Column(String(20), nullable=False)  # Use String for SQLite compatibility
     content = Column(Text, nullable=False)
+    status = Column(String(20), nullable=True)  # NULL = complete; "interrupted" when the client left mid-answer
     created_at = Column(DateTime, server_default=func.now())
 
 class Note(Base):
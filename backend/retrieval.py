@@ -0,0 +1,192 @@
+from sqlalchemy.orm import Session
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from backend.config import settings
+from backend.models import Document, DocumentChunk
+from backend.search import search_chunks
+from backend.vector_index import vector_index
+from backend.tokens import ESTIMATOR, chunk_token_count, request_recount
+from backend.storage import get_document_texts
+import logging
+
+logger = logging.getLogger(__name__)
+
+class RetrievedChunk(NamedTuple):
+    chunk_id: int
+    document_id: int
+    filename: str
+    chunk_index: int
+    start_offset: int
+    end_offset: int
+    content: str
+    token_count: int
+    token_encoding: Optional[str]
+    score: float
+
+def _load_chunks(db: Session, query) -> List[RetrievedChunk]:
+    rows = query.with_entities(
+        DocumentChunk.id, DocumentChunk.document_id, Document.filename, DocumentChunk.chunk_index,
+        DocumentChunk.start_offset, DocumentChunk.end_offset, DocumentChunk.content,
+        DocumentChunk.token_count, DocumentChunk.token_encoding
+    ).all()
+    return [RetrievedChunk(*row, 0.0) for row in rows]
+
+def _completed_chunks(db: Session, notebook_id: int):
+    return db.query(DocumentChunk).join(Document).filter(
+        DocumentChunk.notebook_id == notebook_id,
+        Document.status == "completed"
+    )
+
+def leading_chunks(db: Session, notebook_id: int, limit: int) -> List[RetrievedChunk]:
+    """The opening chunks of every document, interleaved, for questions nothing matches"""
+    query = _completed_chunks(db, notebook_id).order_by(
+        DocumentChunk.chunk_index, DocumentChunk.document_id
+    ).limit(limit)
+    return _load_chunks(db, query)
+
+# Reciprocal rank fusion constant; 60 is the value from the original RRF paper
+RRF_K = 60
+
+def fuse_rankings(*rankings: List[Tuple[int, float]], limit: int) -> List[Tuple[int, float]]:
+    """Merge ranked (chunk_id, score) lists by reciprocal rank fusion"""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (chunk_id, _) in enumerate(ranking):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+def rank_chunks(db: Session, notebook_id: int, question: str, limit: int, mode: str = None) -> List[Tuple[int, float]]:
+    """(chunk_id, score) pairs from the configured retrieval mode, best first"""
+    mode = mode or settings.CHAT_RETRIEVAL
+    if mode == "bm25":
+        return search_chunks(db, notebook_id, question, limit=limit)
+    if mode == "dense":
+        return vector_index.search(notebook_id, question, limit=limit)
+    return fuse_rankings(
+        search_chunks(db, notebook_id, question, limit=limit),
+        vector_index.search(notebook_id, question, limit=limit),
+        limit=limit
+    )
+
+def retrieve_chunks(db: Session, notebook_id: int, question: str, limit: int = None) -> List[RetrievedChunk]:
+    """Chunks of completed documents ranked by relevance to the question"""
+    limit = limit or settings.CHAT_TOP_K
+    hits = rank_chunks(db, notebook_id, question, limit)
+    if not hits:
+        return leading_chunks(db, notebook_id, limit)
+
+    scores = dict(hits)
+    by_id = {
+        chunk.chunk_id: chunk
+        for chunk in _load_chunks(db, _completed_chunks(db, notebook_id).filter(DocumentChunk.id.in_(scores)))
+    }
+    return [by_id[chunk_id]._replace(score=score) for chunk_id, score in hits if chunk_id in by_id]
+
+def format_context(chunks: List[RetrievedChunk], max_tokens: int, tokenizer=None) -> str:
+    """Fit ranked chunks into a token budget and render them per document.
+
+    Chunks are taken best first until the budget is used up, then shown in
+    reading order under their document's name, with the overlap between
+    neighbouring chunks removed. Chunk token counts come from the ingestion
+    cache unless it was measured by a different tokenizer.
+    """
+    tokenizer = tokenizer or ESTIMATOR
+    selected = []
+    total_tokens = 0
+    for chunk in chunks:
+        tokens = chunk_token_count(tokenizer, chunk.token_count, chunk.token_encoding, chunk.content)
+        if total_tokens + tokens > max_tokens:
+            continue
+        selected.append(chunk)
+        total_tokens += tokens
+
+    by_document = {}
+    for chunk in selected:
+        by_document.setdefault(chunk.document_id, []).append(chunk)
+
+    parts = []
+    for document_chunks in by_document.values():
+        document_chunks.sort(key=lambda chunk: chunk.start_offset)
+        pieces = []
+        covered = -1
+        for chunk in document_chunks:
+            if pieces and chunk.start_offset <= covered:
+                # Continues the previous chunk: append only the text not shown yet
+                pieces[-1] += chunk.content[covered - chunk.start_offset:]
+            else:
+                pieces.append(chunk.content)
+            covered = max(covered, chunk.end_offset)
+        parts.append(f"【文档: {document_chunks[0].filename}】\n" + "\n...\n".join(pieces))
+
+    return "\n\n".join(parts)
+
+def share_budget(sizes: Dict[int, int], budget: int) -> Dict[int, int]:
+    """Split a token budget over documents: small ones fit whole, the rest share what is left equally"""
+    shares = {}
+    remaining = budget
+    pending = sorted(sizes.items(), key=lambda item: item[1])
+    while pending:
+        fair = remaining // len(pending)
+        document_id, size = pending.pop(0)
+        shares[document_id] = min(size, fair)
+        remaining -= shares[document_id]
+    return shares
+
+def fit_documents(db: Session, document_ids: List[int], max_tokens: int, tokenizer=None) -> Dict[int, Tuple[str, bool]]:
+    """Documents' text cut to fit a token budget, as {id: (text, truncated)}.
+
+    Sizes are summed from the chunks' cached token counts (overlaps make them
+    a slight overestimate), so no document is tokenised here; each document
+    is cut at the end of its last chunk that fits its share of the budget.
+    Counts cached by another tokenizer stand in until the job worker has
+    recounted them, and documents without chunks are sized by the estimator.
+    """
+    tokenizer = tokenizer or ESTIMATOR
+    rows = db.query(
+        DocumentChunk.document_id, DocumentChunk.end_offset, DocumentChunk.token_count, DocumentChunk.token_encoding
+    ).filter(
+        DocumentChunk.document_id.in_(document_ids)
+    ).order_by(DocumentChunk.document_id, DocumentChunk.chunk_index).all()
+
+    sizes: Dict[int, int] = {}
+    chunks: Dict[int, List[Tuple[int, int]]] = {}
+    stale = set()
+    for document_id, end_offset, token_count, token_encoding in rows:
+        if (token_encoding or ESTIMATOR.name) != tokenizer.name:
+            stale.add(document_id)
+        sizes[document_id] = sizes.get(document_id, 0) + token_count
+        chunks.setdefault(document_id, []).append((end_offset, token_count))
+    if stale:
+        request_recount(stale)
+
+    texts = get_document_texts(db, document_ids)
+    for document_id, text in texts.items():
+        if text and document_id not in sizes:
+            sizes[document_id] = ESTIMATOR.count(text)
+    shares = share_budget(sizes, max_tokens)
+
+    fitted = {}
+    for document_id in document_ids:
+        text = texts.get(document_id)
+        if not text:
+            continue
+        share = shares[document_id]
+        if share >= sizes[document_id]:
+            fitted[document_id] = (text, False)
+            continue
+        if document_id not in chunks:
+            # No chunk boundaries to cut at; cut in proportion to the share
+            end = len(text) * share // sizes[document_id]
+        else:
+            end = 0
+            used = 0
+            for end_offset, token_count in chunks[document_id]:
+                if used + token_count > share:
+                    break
+                used += token_count
+                end = end_offset
+        if end:
+            fitted[document_id] = (text[:end], True)
+        else:
+            logger.warning(f"Left document {document_id} out of the prompt: nothing fits its share of {share} tokens")
+    logger.info(f"Fitted {len(fitted)} of {len(document_ids)} documents into {max_tokens} tokens")
+    return fitted
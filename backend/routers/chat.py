@@ -1,49 +1,40 @@
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List, Generator, Optional
+from contextlib import aclosing
+from typing import List, Generator, Optional, Tuple
+import anyio
+import asyncio
 import json
 import logging
 from datetime import datetime
-from backend.database import get_db
-from backend.models import Conversation, Message, Document
+from backend.database import SessionLocal, get_db
+from backend.models import Conversation, Message
 from backend.schemas import ChatRequest, ConversationCreate, ConversationResponse
-from backend.config_model import Config
+from backend.config_service import config_service
+from backend.config import settings
+from backend.retrieval import retrieve_chunks, format_context
+from backend.tokens import get_tokenizer, prompt_budget
+from backend.llm import llm_clients
+from backend.llm_calls import stream_chat
+from backend.streaming import DisconnectAwareResponse
+from backend.admission import admit_or_reject
+from backend.answer_cache import answer_cache, cache_key, document_set_fingerprint
 
 try:
-    from langchain_openai import ChatOpenAI
     from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-    LLM_AVAILABLE = True
+    from backend.llm import LLM_AVAILABLE
 except ImportError:
     LLM_AVAILABLE = False
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-def get_llm_config(db: Session) -> dict:
-    """Get LLM configuration from database"""
-    try:
-        configs = db.query(Config).filter(Config.category.in_(['llm', 'custom'])).all()
-        llm_config = {}
-        for config in configs:
-            key = config.key
-            if key.startswith("llm."):
-                normalized_key = key[4:]
-                llm_config[normalized_key] = config.value
-            elif key.startswith("llm_"):
-                normalized_key = key[4:]
-                llm_config[normalized_key] = config.value
-            else:
-                llm_config[key] = config.value
-        
-        if "model_id" in llm_config and "model" not in llm_config:
-            llm_config["model"] = llm_config["model_id"]
-        
-        logger.info(f"LLM configuration loaded: model={llm_config.get('model')}, base_url={llm_config.get('base_url')}")
-        return llm_config
-    except Exception as e:
-        logger.error(f"Error loading LLM configuration: {e}")
-        return {}
+# Bump whenever the prompts in prepare_chat change, so answers to the old ones are not replayed
+PROMPT_VERSION = 1
+
+# Characters per content event when a cached answer is replayed
+REPLAY_CHUNK_CHARS = 64
 
 def get_text_content(content) -> str:
     """Safely extract text from AIMessage content."""
@@ -84,50 +75,28 @@ def get_conversation_history(db: Session, conversation_id: int, max_messages: in
     
     return history
 
-def build_knowledge_context(documents: List[Document], max_chars: int = 8000) -> str:
-    """Build knowledge context from documents."""
-    context_parts = []
-    total_chars = 0
-    
-    logger.info(f"Building knowledge context from {len(documents)} documents")
+def build_knowledge_context(db: Session, notebook_id: int, question: str, max_tokens: int = None, tokenizer=None) -> str:
+    """Build knowledge context from the document chunks most relevant to the question."""
+    max_tokens = settings.CHAT_CONTEXT_TOKENS if max_tokens is None else max_tokens
+    chunks = retrieve_chunks(db, notebook_id, question)
+    logger.info(f"Retrieved {len(chunks)} chunks for notebook {notebook_id}")
     
-    for doc in documents:
-        logger.info(f"Processing document {doc.id}: {doc.filename}, status: {doc.status}, content length: {len(doc.content) if doc.content else 0}")
-        
-        if doc.content:
-            doc_content = f"【文档: {doc.filename}】\n{doc.content}"
-            if total_chars + len(doc_content) > max_chars:
-                remaining = max_chars - total_chars
-                if remaining > 200:
-                    doc_content = doc_content[:remaining] + "..."
-                    context_parts.append(doc_content)
-                    logger.info(f"Truncated document {doc.id} to {remaining} characters")
-                break
-            context_parts.append(doc_content)
-            total_chars += len(doc_content)
-        else:
-            logger.warning(f"Document {doc.id} ({doc.filename}) has no content")
-    
-    result = "\n\n".join(context_parts) if context_parts else "暂无相关文档内容。"
-    logger.info(f"Knowledge context built: {len(result)} characters from {len(context_parts)} documents")
+    result = format_context(chunks, max_tokens, tokenizer) or "暂无相关文档内容。"
+    logger.info(f"Knowledge context built: {len(result)} characters for a budget of {max_tokens} tokens")
     
     return result
 
-@router.post("/")
-async def chat(request: ChatRequest, db: Session = Depends(get_db)):
-    """AI Chat endpoint with streaming response"""
-    
-    logger.info(f"Chat request for notebook {request.notebook_id}")
-    
-    documents = db.query(Document).filter(
-        Document.notebook_id == request.notebook_id,
-        Document.status == "completed"
-    ).all()
-    
-    logger.info(f"Found {len(documents)} completed documents for notebook {request.notebook_id}")
-    
-    knowledge = build_knowledge_context(documents)
-    
+def save_assistant_message(conversation_id: int, content: str, status: Optional[str] = None):
+    """Store an answer with a session of its own; run it in the threadpool"""
+    db = SessionLocal()
+    try:
+        db.add(Message(conversation_id=conversation_id, role="assistant", content=content, status=status))
+        db.commit()
+    finally:
+        db.close()
+
+def start_conversation(request: ChatRequest, db: Session) -> int:
+    """Store the question, in a new conversation unless it continues an existing one"""
     conversation_id = None
     if request.conversation_id:
         conversation = db.query(Conversation).filter(Conversation.id == request.conversation_id).first()
@@ -154,6 +123,37 @@ async def chat(request: ChatRequest, db: Session = Depends(get_db)):
     )
     db.add(user_message)
     db.commit()
+    return conversation_id
+
+def find_cached_answer(request: ChatRequest, db: Session, llm_settings) -> Tuple[Optional[str], Optional[str]]:
+    """(cache key, cached answer) for the question.
+
+    The key is None when the answer cannot be cached: the cache is off, or
+    earlier messages of the conversation are part of the prompt.
+    """
+    if not settings.ANSWER_CACHE:
+        return None, None
+    if request.conversation_id and db.query(Message.id).filter(Message.conversation_id == request.conversation_id).first():
+        return None, None
+    fingerprint = document_set_fingerprint(db, request.notebook_id)
+    key = cache_key(request.message, fingerprint, llm_settings.model, PROMPT_VERSION)
+    return key, answer_cache.get(request.notebook_id, key)
+
+def save_cached_exchange(request: ChatRequest, db: Session, answer: str) -> int:
+    """Store the question and its replayed answer like any other exchange"""
+    conversation_id = start_conversation(request, db)
+    db.add(Message(conversation_id=conversation_id, role="assistant", content=answer))
+    db.commit()
+    return conversation_id
+
+def prepare_chat(request: ChatRequest, db: Session):
+    """Store the question and assemble the prompt.
+
+    Returns (conversation_id, llm_settings, messages). Blocking; the endpoint
+    runs it in the threadpool so that only the LLM stream lives on the event loop.
+    """
+    logger.info(f"Chat request for notebook {request.notebook_id}")
+    conversation_id = start_conversation(request, db)
     
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
@@ -178,16 +178,84 @@ async def chat(request: ChatRequest, db: Session = Depends(get_db)):
 
 当前时间：{current_time}"""
     
-    user_prompt = f"""## 知识库内容
+    user_prompt_template = """## 知识库内容
 {knowledge}
 
 ## 用户问题
-{request.message}
+{question}
 
 请基于知识库内容回答用户问题，如果知识库中没有相关信息，请如实说明。"""
     
-    def generate():
-        """Streaming response generator"""
+    llm_settings = config_service.get(db).llm_settings
+    history = []
+    if request.conversation_id and LLM_AVAILABLE:
+        history = get_conversation_history(db, request.conversation_id, max_messages=6)
+    
+    # Whatever the model's window leaves after the prompt, history and answer, up to CHAT_CONTEXT_TOKENS
+    tokenizer = get_tokenizer(llm_settings.model)
+    budget = prompt_budget(
+        tokenizer,
+        [system_prompt, user_prompt_template.format(knowledge="", question=request.message)]
+        + [get_text_content(message.content) for message in history],
+        output_tokens=llm_settings.max_tokens,
+        context_window=llm_settings.context_window,
+        cap=settings.CHAT_CONTEXT_TOKENS
+    )
+    knowledge = build_knowledge_context(db, request.notebook_id, request.message, budget, tokenizer)
+    user_prompt = user_prompt_template.format(knowledge=knowledge, question=request.message)
+    
+    messages = None
+    if LLM_AVAILABLE:
+        messages = [SystemMessage(content=system_prompt)]
+        messages.extend(history)
+        messages.append(HumanMessage(content=user_prompt))
+    
+    return conversation_id, llm_settings, messages
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+    "Access-Control-Allow-Origin": "*"
+}
+
+async def replay_answer(answer: str, conversation_id: int):
+    """A cached answer as the same events a live answer produces, marked as cached when done"""
+    for start in range(0, len(answer), REPLAY_CHUNK_CHARS):
+        escaped_content = escape_json_string(answer[start:start + REPLAY_CHUNK_CHARS])
+        yield f"data: {{\"type\": \"content\", \"content\": \"{escaped_content}\"}}\n\n"
+    yield f"data: {{\"type\": \"done\", \"conversation_id\": {conversation_id}, \"cached\": true}}\n\n"
+
+@router.post("/")
+async def chat(request: ChatRequest, db: Session = Depends(get_db)):
+    """AI Chat endpoint with streaming response"""
+    try:
+        llm_settings = (await run_in_threadpool(config_service.get, db)).llm_settings
+        # A repeated question is answered from the cache, without queueing for the LLM
+        key, cached_answer = await run_in_threadpool(find_cached_answer, request, db, llm_settings)
+        if cached_answer is not None:
+            conversation_id = await run_in_threadpool(save_cached_exchange, request, db, cached_answer)
+            logger.info(f"Answered conversation {conversation_id} from the answer cache")
+            return DisconnectAwareResponse(
+                replay_answer(cached_answer, conversation_id),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS
+            )
+        # Admitted before anything is stored, so a rejected question leaves no trace
+        ticket = admit_or_reject(llm_settings.model, llm_settings.base_url)
+        try:
+            conversation_id, llm_settings, messages = await run_in_threadpool(prepare_chat, request, db)
+        except BaseException:
+            ticket.release()
+            raise
+    finally:
+        # Hand the connection back now rather than when the stream ends, or
+        # long streams would exhaust the pool their final write needs
+        db.close()
+    
+    async def generate():
+        """Streaming response generator; tokens are relayed on the event loop without holding a thread"""
+        parts = []
         try:
             if not LLM_AVAILABLE:
                 error_message = "LLM 服务不可用，请检查依赖安装"
@@ -195,75 +263,60 @@ async def chat(request: ChatRequest, db: Session = Depends(get_db)):
                 yield f"data: {json.dumps({'type': 'error', 'message': error_message}, ensure_ascii=False)}\n\n"
                 return
             
-            llm_config = get_llm_config(db)
-            
-            api_key = llm_config.get("api_key")
+            api_key = llm_settings.api_key
             if not api_key:
                 error_message = "未配置 API Key，请在设置中配置"
                 logger.error(error_message)
                 yield f"data: {json.dumps({'type': 'error', 'message': error_message}, ensure_ascii=False)}\n\n"
                 return
             
-            model_name = llm_config.get("model", "gpt-3.5-turbo")
-            temperature = float(llm_config.get("temperature", 0.7))
-            max_tokens = int(llm_config.get("max_tokens", 2000))
-            base_url = llm_config.get("base_url")
+            model_name = llm_settings.model
             
-            llm_kwargs = {
-                "api_key": api_key,
-                "model_name": model_name,
-                "temperature": temperature,
-                "max_tokens": max_tokens,
-                "streaming": True
-            }
-            if base_url:
-                llm_kwargs["base_url"] = base_url
-            
-            llm = ChatOpenAI(**llm_kwargs)
-            
-            messages = [SystemMessage(content=system_prompt)]
-            
-            if request.conversation_id:
-                history = get_conversation_history(db, request.conversation_id, max_messages=6)
-                messages.extend(history)
-            
-            messages.append(HumanMessage(content=user_prompt))
+            async for position in ticket.wait():
+                yield f"data: {json.dumps({'type': 'queued', 'position': position})}\n\n"
             
             logger.info(f"Starting stream for conversation {conversation_id} with model {model_name}")
             
-            assistant_response = ""
-            for chunk in llm.stream(messages):
-                if chunk.content:
-                    assistant_response += chunk.content
-                    escaped_content = escape_json_string(chunk.content)
-                    yield f"data: {{\"type\": \"content\", \"content\": \"{escaped_content}\"}}\n\n"
+            with llm_clients.lease(
+                api_key, model_name, llm_settings.temperature, llm_settings.max_tokens, llm_settings.base_url
+            ) as llm:
+                # aclosing: leaving early closes the provider stream instead of leaving it to the GC
+                async with aclosing(stream_chat(llm, messages, model_name)) as stream:
+                    async for chunk in stream:
+                        if chunk.content:
+                            parts.append(chunk.content)
+                            escaped_content = escape_json_string(chunk.content)
+                            yield f"data: {{\"type\": \"content\", \"content\": \"{escaped_content}\"}}\n\n"
             
-            assistant_message = Message(
-                conversation_id=conversation_id,
-                role="assistant",
-                content=assistant_response
-            )
-            db.add(assistant_message)
-            db.commit()
+            assistant_response = "".join(parts)
+            await run_in_threadpool(save_assistant_message, conversation_id, assistant_response)
+            if key and assistant_response:
+                await run_in_threadpool(answer_cache.put, request.notebook_id, key, assistant_response)
             
             logger.info(f"Completed response for conversation {conversation_id}, length: {len(assistant_response)}")
             
             yield f"data: {{\"type\": \"done\", \"conversation_id\": {conversation_id}}}\n\n"
             
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client disconnected; the provider stream is already closed.
+            # Keep what was said so far, shielded since we are being cancelled
+            if parts:
+                with anyio.CancelScope(shield=True):
+                    await run_in_threadpool(save_assistant_message, conversation_id, "".join(parts), "interrupted")
+            logger.info(f"Client left conversation {conversation_id} after {len(parts)} chunks; generation aborted")
+            raise
         except Exception as e:
             logger.error(f"Error in chat stream: {e}", exc_info=True)
             error_msg = str(e).replace('"', '\\"').replace('\n', ' ')
             yield f"data: {{\"type\": \"error\", \"message\": \"{error_msg}\"}}\n\n"
+        finally:
+            ticket.release()
     
-    return StreamingResponse(
+    return DisconnectAwareResponse(
         generate(),
+        on_close=ticket.release,
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-            "Access-Control-Allow-Origin": "*"
-        }
+        headers=SSE_HEADERS
     )
 
 @router.get("/conversations/{notebook_id}", response_model=List[ConversationResponse])
@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from typing import List, Optional
 from backend.database import get_db
 from backend.config_model import Config
+from backend.config_service import bump_config_version
 
 router = APIRouter()
 
@@ -84,6 +85,7 @@ def create_config(key: str, value: str, description: Optional[str] = None, categ
         )
         db.add(config)
     
+    bump_config_version(db)
     db.commit()
     db.refresh(config)
     
@@ -105,6 +107,7 @@ def update_config(key: str, value: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Configuration not found")
     
     config.value = value
+    bump_config_version(db)
     db.commit()
     db.refresh(config)
     
@@ -125,6 +128,7 @@ def delete_config(key: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Configuration not found")
     
     db.delete(config)
+    bump_config_version(db)
     db.commit()
     
     return {
@@ -146,6 +150,7 @@ def reset_to_defaults(keys: Optional[List[str]] = None, db: Session = Depends(ge
         # Reset all custom configurations
         db.query(Config).filter(Config.category == "llm").delete()
     
+    bump_config_version(db)
     db.commit()
     
     return {
@@ -1,54 +1,37 @@
 from fastapi import APIRouter, Depends, HTTPException
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from backend.database import get_db
-from backend.models import Document
-from backend.config_model import Config
+from contextlib import aclosing
+from backend.database import get_db, SessionLocal
+from backend.models import Document, Note
+from backend.config_service import LLMSettings, config_service
 from backend.schemas import ContentGenerationRequest, ContentGenerationResponse
 from backend.config import settings
+from backend.retrieval import fit_documents
+from backend.tokens import get_tokenizer, prompt_budget
+from backend.llm import llm_clients
+from backend.llm_calls import invoke_chat, stream_chat
+from backend.streaming import DisconnectAwareResponse
+from backend.admission import QueueTimeout, Ticket, admit_or_reject
 import json
 import asyncio
+import anyio
+import logging
 
 # 尝试导入 LLM 相关库
 try:
-    from langchain_openai import ChatOpenAI
     from langchain_core.messages import SystemMessage, HumanMessage
     LLM_AVAILABLE = True
 except ImportError:
     LLM_AVAILABLE = True
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-# Get LLM configuration from database
+# Get LLM configuration from the configuration cache
 def get_llm_config(db: Session):
-    """Get LLM configuration from database"""
-    try:
-        # Get configs with category 'llm' or 'custom'
-        configs = db.query(Config).filter(Config.category.in_(["llm", "custom"])).all()
-        llm_config = {}
-        for config in configs:
-            key = config.key
-            # Handle dot notation (llm.api_key) and underscore notation (llm_api_key)
-            if key.startswith("llm."):
-                # Remove llm. prefix
-                normalized_key = key[4:]
-                llm_config[normalized_key] = config.value
-            elif key.startswith("llm_"):
-                # Remove llm_ prefix
-                normalized_key = key[4:]
-                llm_config[normalized_key] = config.value
-            else:
-                llm_config[key] = config.value
-        
-        # Map model_id to model for compatibility with frontend
-        if "model_id" in llm_config and "model" not in llm_config:
-            llm_config["model"] = llm_config["model_id"]
-        
-        print(f"LLM configuration: {llm_config}")
-        return llm_config
-    except Exception as e:
-        print(f"Error loading LLM configuration: {e}")
-        # Return default configuration if database query fails
-        return {}
+    """Get LLM configuration with the llm./llm_ prefixes removed"""
+    return config_service.get(db).llm
 
 # Content type prompts
 CONTENT_PROMPTS = {
@@ -290,33 +273,55 @@ D) 选项D
     """
 }
 
-# Generate content based on document content and custom prompt
-def generate_content_with_llm(content_type: str, documents: list, custom_prompt: str = None, db: Session = None):
-    """Generate content using LLM based on document content and custom prompt"""
-    # Extract document content and filenames
-    document_filenames = [doc.filename for doc in documents]
-    document_contents = [doc.content for doc in documents if doc.content]
-    
-    # Assemble document content
-    document_text = "\n\n".join([f"# {filename}\n\n{content}" for filename, content in zip(document_filenames, document_contents)])
-    
-    # Get base prompt
+CONTENT_SYSTEM_PROMPT = "You are an AI assistant specialized in content generation based on documents."
+
+def completed_documents(notebook_id: int, db: Session) -> list:
+    """The notebook's documents that are ready to be used"""
+    return db.query(Document).filter(
+        Document.notebook_id == notebook_id,
+        Document.status == "completed"
+    ).all()
+
+# Build the generation prompt within the model's context window
+def build_content_prompt(content_type: str, documents: list, custom_prompt: str, db: Session, llm_settings: LLMSettings) -> str:
+    """Assemble the prompt, cutting documents down to the tokens the model has room for"""
     base_prompt = CONTENT_PROMPTS.get(content_type, "")
+    extra = f"## 用户额外要求：\n{custom_prompt}\n" if custom_prompt else ""
     
-    # Assemble final prompt
-    final_prompt = f"{base_prompt}\n\n## 文档内容：\n{document_text}\n\n"
-    if custom_prompt:
-        final_prompt += f"## 用户额外要求：\n{custom_prompt}\n"
+    # Budget what is left of the window once the instructions, headings and answer are accounted for
+    tokenizer = get_tokenizer(llm_settings.model)
+    budget = prompt_budget(
+        tokenizer,
+        [CONTENT_SYSTEM_PROMPT, f"{base_prompt}\n\n## 文档内容：\n\n\n{extra}"]
+        + [f"# {doc.filename}\n\n" for doc in documents],
+        output_tokens=llm_settings.max_tokens,
+        context_window=llm_settings.context_window
+    )
+    fitted = fit_documents(db, [doc.id for doc in documents], budget, tokenizer)
     
+    # Assemble document content
+    parts = []
+    for doc in documents:
+        if doc.id not in fitted:
+            continue
+        text, truncated = fitted[doc.id]
+        parts.append(f"# {doc.filename}\n\n{text}" + ("\n\n……（文档过长，后续内容已省略）" if truncated else ""))
+    document_text = "\n\n".join(parts)
+    
+    return f"{base_prompt}\n\n## 文档内容：\n{document_text}\n\n{extra}"
+
+# Generate content based on document content and custom prompt
+async def generate_content_with_llm(content_type: str, documents: list, custom_prompt: str = None, db: Session = None,
+                                    ticket: Ticket = None):
+    """Generate content using LLM based on document content and custom prompt"""
     # If LLM is available, use it to generate content
     if LLM_AVAILABLE and db:
         try:
-            # Get LLM configuration from database
-            llm_config = get_llm_config(db)
-            print(llm_config)
+            # Get LLM configuration
+            llm_settings = (await run_in_threadpool(config_service.get, db)).llm_settings
             
             # Get API key from config
-            api_key = llm_config.get("api_key")
+            api_key = llm_settings.api_key
             
             # Check if API key is provided
             if not api_key:
@@ -324,28 +329,35 @@ def generate_content_with_llm(content_type: str, documents: list, custom_prompt:
                 # Raise exception if API key is not provided
                 raise HTTPException(status_code=400, detail="API key not found in configuration. Please set it in the settings.")
             
-            # Initialize LLM client with configuration parameters
-            llm = ChatOpenAI(
-                api_key=api_key,
-                model_name=llm_config["model"],
-                temperature=float(llm_config["temperature"]),
-                max_tokens=int(llm_config["max_tokens"]),
-                base_url=llm_config.get("base_url")
-            )
+            # Reads and tokenises documents, so it runs off the event loop
+            final_prompt = await run_in_threadpool(build_content_prompt, content_type, documents, custom_prompt, db, llm_settings)
+            # Nothing else is read; release the connection while the model works
+            db.close()
             
             # Generate content using LLM
             messages = [
-                SystemMessage(content="You are an AI assistant specialized in content generation based on documents."),
+                SystemMessage(content=CONTENT_SYSTEM_PROMPT),
                 HumanMessage(content=final_prompt)
             ]
             
-            # Get response from LLM
-            response = llm.invoke(messages)
+            # Wait for a slot at the backend (see admission.py)
+            if ticket:
+                await ticket.acquire()
             
-            # Extract content from response
-            return response.content
+            # Get response from the pooled LLM client for this configuration
+            with llm_clients.lease(
+                api_key,
+                llm_settings.model,
+                llm_settings.temperature,
+                llm_settings.max_tokens,
+                llm_settings.base_url
+            ) as llm:
+                # Deadlines, retries and hedging as configured (see llm_calls)
+                return await invoke_chat(llm, messages, llm_settings.model)
         except HTTPException:
             raise
+        except QueueTimeout as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(settings.LLM_RETRY_AFTER)})
         except Exception as e:
             print(f"LLM generation failed: {e}")
             # Raise exception if LLM fails
@@ -354,32 +366,32 @@ def generate_content_with_llm(content_type: str, documents: list, custom_prompt:
         # Raise exception if LLM is not available
         raise HTTPException(status_code=503, detail="LLM service is not available. Please install required dependencies.")
 
+def save_interrupted_content(notebook_id: int, content_type: str, content: str):
+    """Keep a partial generation as a note of the notebook; run it in the threadpool.
+
+    Finished content is returned to the client only, but a client that left
+    mid-stream would otherwise lose what was already paid for.
+    """
+    db = SessionLocal()
+    try:
+        db.add(Note(notebook_id=notebook_id, title=f"{content_type}（生成中断）", content=content))
+        db.commit()
+    finally:
+        db.close()
+
 # Stream generate content using LLM
-def stream_generate_content_with_llm(content_type: str, documents: list, custom_prompt: str = None, db: Session = None):
+async def stream_generate_content_with_llm(content_type: str, documents: list, custom_prompt: str = None, db: Session = None,
+                                           ticket: Ticket = None, notebook_id: int = None):
     """Stream generate content using LLM based on document content and custom prompt"""
-    # Extract document content and filenames
-    document_filenames = [doc.filename for doc in documents]
-    document_contents = [doc.content for doc in documents if doc.content]
-    
-    # Assemble document content
-    document_text = "\n\n".join([f"# {filename}\n\n{content}" for filename, content in zip(document_filenames, document_contents)])
-    
-    # Get base prompt
-    base_prompt = CONTENT_PROMPTS.get(content_type, "")
-    
-    # Assemble final prompt
-    final_prompt = f"{base_prompt}\n\n## 文档内容：\n{document_text}\n\n"
-    if custom_prompt:
-        final_prompt += f"## 用户额外要求：\n{custom_prompt}\n"
-    
+    parts = []
     # If LLM is available, use it to generate content
     if LLM_AVAILABLE and db:
         try:
-            # Get LLM configuration from database
-            llm_config = get_llm_config(db)
+            # Get LLM configuration
+            llm_settings = (await run_in_threadpool(config_service.get, db)).llm_settings
             
             # Get API key from config
-            api_key = llm_config.get("api_key")
+            api_key = llm_settings.api_key
             
             # Check if API key is provided
             if not api_key:
@@ -388,34 +400,56 @@ def stream_generate_content_with_llm(content_type: str, documents: list, custom_
                 yield f"data: {{\"type\": \"error\", \"content\": \"API key not found in configuration. Please set it in the settings.\"}}\n\n"
                 return
             
-            # Initialize LLM client with configuration parameters
-            llm = ChatOpenAI(
-                api_key=api_key,
-                model_name=llm_config["model"],
-                temperature=float(llm_config["temperature"]),
-                max_tokens=int(llm_config["max_tokens"]),
-                base_url=llm_config.get("base_url"),
-                streaming=True  # Enable streaming
-            )
+            # Reads and tokenises documents, so it runs off the event loop
+            final_prompt = await run_in_threadpool(build_content_prompt, content_type, documents, custom_prompt, db, llm_settings)
+            # Nothing else is read; release the connection while the model works
+            db.close()
             
             # Generate content using LLM with streaming
             messages = [
-                SystemMessage(content="You are an AI assistant specialized in content generation based on documents."),
+                SystemMessage(content=CONTENT_SYSTEM_PROMPT),
                 HumanMessage(content=final_prompt)
             ]
             
-            # Stream response from LLM
-            for chunk in llm.stream(messages):
-                if chunk.content:
-                    # Escape special characters for JSON
-                    escaped_content = chunk.content.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
-                    yield f"data: {{\"type\": \"content\", \"content\": \"{escaped_content}\"}}\n\n"
+            # Wait for a slot at the backend, telling the client where it is in line
+            if ticket:
+                async for position in ticket.wait():
+                    yield f"data: {{\"type\": \"queued\", \"position\": {position}}}\n\n"
+            
+            # Stream response from the pooled LLM client for this configuration
+            with llm_clients.lease(
+                api_key,
+                llm_settings.model,
+                llm_settings.temperature,
+                llm_settings.max_tokens,
+                llm_settings.base_url
+            ) as llm:
+                # aclosing: leaving early closes the provider stream instead of leaving it to the GC
+                async with aclosing(stream_chat(llm, messages, llm_settings.model)) as stream:
+                    async for chunk in stream:
+                        if chunk.content:
+                            parts.append(chunk.content)
+                            # Escape special characters for JSON
+                            escaped_content = chunk.content.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+                            yield f"data: {{\"type\": \"content\", \"content\": \"{escaped_content}\"}}\n\n"
             return
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client disconnected; the provider stream is already closed.
+            # Keep what was generated so far, shielded since we are being cancelled
+            partial = "".join(parts)
+            if partial and notebook_id:
+                with anyio.CancelScope(shield=True):
+                    await run_in_threadpool(save_interrupted_content, notebook_id, content_type, partial)
+            logger.info(f"Client disconnected, {content_type} generation aborted after {len(partial)} characters")
+            raise
         except Exception as e:
             print(f"LLM generation failed: {e}")
             # Return error message if LLM fails
             yield f"data: {{\"type\": \"error\", \"content\": \"LLM generation failed: {str(e)}\"}}\n\n"
             return
+        finally:
+            if ticket:
+                ticket.release()
     else:
         # Return error message if LLM is not available
         yield f"data: {{\"type\": \"error\", \"content\": \"LLM service is not available. Please install required dependencies.\"}}\n\n"
@@ -433,17 +467,22 @@ async def generate_content(request: ContentGenerationRequest, db: Session = Depe
             detail=f"Invalid content type. Supported types: {', '.join(CONTENT_PROMPTS.keys())}"
         )
     
-    # Get documents for the notebook
-    documents = db.query(Document).filter(
-        Document.notebook_id == request.notebook_id,
-        Document.status == "completed"
-    ).all()
+    # Blocking reads go to the threadpool: waiting for a pooled connection on
+    # the event loop would stall the very streams that are due to return one
+    documents = await run_in_threadpool(completed_documents, request.notebook_id, db)
     
     if not documents:
         raise HTTPException(status_code=404, detail="No documents found in this notebook")
     
+    # Fails fast with 429 when the backend's queue is full
+    llm_settings = (await run_in_threadpool(config_service.get, db)).llm_settings
+    ticket = admit_or_reject(llm_settings.model, llm_settings.base_url)
+    
     # Generate content based on document content, custom prompt, and LLM
-    generated_content = generate_content_with_llm(request.content_type, documents, request.custom_prompt, db)
+    try:
+        generated_content = await generate_content_with_llm(request.content_type, documents, request.custom_prompt, db, ticket)
+    finally:
+        ticket.release()
     
     return ContentGenerationResponse(
         content_type=request.content_type,
@@ -451,8 +490,6 @@ async def generate_content(request: ContentGenerationRequest, db: Session = Depe
         format="markdown"
     )
 
-from fastapi.responses import StreamingResponse
-
 @router.post("/stream")
 @router.post("/stream/")
 async def stream_generate_content(request: ContentGenerationRequest, db: Session = Depends(get_db)):
@@ -465,21 +502,23 @@ async def stream_generate_content(request: ContentGenerationRequest, db: Session
             detail=f"Invalid content type. Supported types: {', '.join(CONTENT_PROMPTS.keys())}"
         )
     
-    # Get documents for the notebook
-    documents = db.query(Document).filter(
-        Document.notebook_id == request.notebook_id,
-        Document.status == "completed"
-    ).all()
+    # Blocking reads go to the threadpool: waiting for a pooled connection on
+    # the event loop would stall the very streams that are due to return one
+    documents = await run_in_threadpool(completed_documents, request.notebook_id, db)
     
     if not documents:
         raise HTTPException(status_code=404, detail="No documents found in this notebook")
     
-    def generate():
-        # Stream generate content using LLM
-        for chunk in stream_generate_content_with_llm(request.content_type, documents, request.custom_prompt, db):
-            yield chunk
+    # Fails fast with 429 when the backend's queue is full
+    llm_settings = (await run_in_threadpool(config_service.get, db)).llm_settings
+    ticket = admit_or_reject(llm_settings.model, llm_settings.base_url)
     
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    # Stream generate content using LLM; an async generator, so open streams hold no threads
+    return DisconnectAwareResponse(
+        stream_generate_content_with_llm(request.content_type, documents, request.custom_prompt, db, ticket, request.notebook_id),
+        on_close=ticket.release,
+        media_type="text/event-stream"
+    )
 
 @router.get("/types/")
 def get_content_types():
@@ -1,92 +1,91 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, Request
 from fastapi.responses import FileResponse, Response
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List
-from backend.database import get_db, SessionLocal
-from backend.models import Document
-from backend.schemas import DocumentResponse
+from typing import List, Optional
+from backend.config import settings
+from backend.database import get_db
+from backend.models import Document, DocumentPage, Notebook, ProcessingJob
+from backend.schemas import (
+    DocumentResponse, DocumentContentResponse, DocumentPageItem, DocumentPagesResponse, BatchUploadItem, BatchUploadResponse,
+    DocumentProgressItem, DocumentProgressResponse, DocumentTokenReport
+)
+from backend.storage import (
+    store_upload, stage_upload, stage_file, discard_staged, adopt_blob,
+    is_blob_path, release_blobs, get_document_text
+)
+from backend.jobs import enqueue_document, job_worker
+from backend.ingestion import page_texts, token_report
+from backend.events import publish_event
+from backend.vector_index import vector_index
+from backend.answer_cache import answer_cache
 import os
-import asyncio
-import PyPDF2
-from docx import Document as DocxDocument
+import zipfile
 from urllib.parse import quote
+from email.utils import formatdate, parsedate_to_datetime
 import logging
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Temporary upload directory (in production, use object storage)
-# Use project-based uploads directory for cross-platform compatibility
-UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Types inferred from the extension when the client sends none (archive members, octet-stream)
+EXTENSION_TYPES = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".txt": "text/plain",
+    ".md": "text/markdown",
+    ".markdown": "text/markdown",
+    ".html": "text/html",
+    ".htm": "text/html"
+}
+ARCHIVE_TYPES = ["application/zip", "application/x-zip-compressed"]
 
-async def extract_content(file_path: str, file_type: str) -> str:
-    """Extract content from different file types"""
-    content = ""
-    
-    try:
-        if file_type == "application/pdf":
-            # Extract content from PDF
-            with open(file_path, "rb") as f:
-                reader = PyPDF2.PdfReader(f)
-                for page in reader.pages:
-                    content += page.extract_text() + "\n"
-        
-        elif file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            # Extract content from DOCX
-            doc = DocxDocument(file_path)
-            for paragraph in doc.paragraphs:
-                content += paragraph.text + "\n"
-        
-        elif file_type in ["text/plain", "text/markdown", "text/html"]:
-            # Extract content from text files
-            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                content = f.read()
-        
-        logger.info(f"Successfully extracted {len(content)} characters from {file_path}")
-    
-    except Exception as e:
-        logger.error(f"Error extracting content from {file_path}: {e}")
-        content = ""
-    
-    return content
-
-async def process_document(document_id: int, file_path: str, file_type: str):
-    """Process document asynchronously with its own database session"""
-    db = SessionLocal()
-    try:
-        # Update status to processing
-        document = db.query(Document).filter(Document.id == document_id).first()
-        if not document:
-            logger.error(f"Document {document_id} not found in database")
-            return
-        
-        document.status = "processing"
-        db.commit()
-        logger.info(f"Started processing document {document_id}: {document.filename}")
-        
-        # Extract content
-        content = await extract_content(file_path, file_type)
-        
-        # Update document with content and status
-        document.content = content
-        document.status = "completed" if content else "failed"
-        db.commit()
-        
-        logger.info(f"Document {document_id} processing completed with status: {document.status}, content length: {len(content) if content else 0}")
-    
-    except Exception as e:
-        logger.error(f"Error processing document {document_id}: {e}")
-        try:
-            document = db.query(Document).filter(Document.id == document_id).first()
-            if document:
-                document.status = "failed"
-                db.commit()
-        except Exception as commit_error:
-            logger.error(f"Error updating document status: {commit_error}")
-    
-    finally:
-        db.close()
+def _file_type(filename: str, content_type: Optional[str] = None) -> Optional[str]:
+    if content_type in settings.ALLOWED_FILE_TYPES:
+        return content_type
+    return EXTENSION_TYPES.get(os.path.splitext(filename or "")[1].lower())
+
+def _is_archive(file: UploadFile) -> bool:
+    return file.content_type in ARCHIVE_TYPES or (file.filename or "").lower().endswith(".zip")
+
+def _stage_archive(archive, budget: int) -> List[tuple]:
+    """Copy the supported members of a zip archive into the incoming directory.
+
+    Returns (filename, file_type, staged or None, error or None) per member;
+    ``staged`` is the (path, size, sha256) triple from stage_file.
+    """
+    results = []
+    staged_count = 0  # only staged members count against the batch limit
+    remaining = settings.MAX_ARCHIVE_SIZE
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or not name or name.startswith(".") or info.filename.startswith("__MACOSX/"):
+                continue
+            file_type = _file_type(name)
+            if file_type is None:
+                results.append((name, None, None, "File type not supported"))
+                continue
+            if staged_count >= budget:
+                results.append((name, file_type, None, "Too many files in one batch"))
+                continue
+            if info.file_size > settings.MAX_UPLOAD_SIZE or info.file_size > remaining:
+                results.append((name, file_type, None, "File too large"))
+                continue
+            try:
+                # The size check is repeated while copying: member headers can lie
+                with zf.open(info) as member:
+                    staged = stage_file(member, max_size=min(settings.MAX_UPLOAD_SIZE, remaining))
+            except HTTPException:
+                results.append((name, file_type, None, "File too large"))
+                continue
+            except (zipfile.BadZipFile, NotImplementedError, RuntimeError) as e:
+                results.append((name, file_type, None, f"Could not read archive member: {e}"))
+                continue
+            remaining -= staged[1]
+            staged_count += 1
+            results.append((name, file_type, staged, None))
+    return results
 
 @router.post("/upload/{notebook_id}", response_model=DocumentResponse)
 async def upload_document(
@@ -108,34 +107,159 @@ async def upload_document(
     if file.content_type not in allowed_types:
         raise HTTPException(status_code=400, detail="File type not supported")
     
-    # Save file
-    file_path = os.path.join(UPLOAD_DIR, f"{notebook_id}_{file.filename}")
-    content = await file.read()
-    
-    with open(file_path, "wb") as f:
-        f.write(content)
+    # Stream file into the content-addressed store, enforcing the upload size limit
+    blob = await store_upload(db, file)
     
     # Create document record
     db_document = Document(
         notebook_id=notebook_id,
         filename=file.filename,
         file_type=file.content_type,
-        file_url=file_path,
-        file_size=len(content),
+        file_url=blob.path,
+        file_size=blob.size,
+        content_hash=blob.sha256,
         status="pending"
     )
     
     db.add(db_document)
+    db.flush()
+    
+    # Queue processing in the same transaction so the document is never left without a job
+    enqueue_document(db, db_document.id)
+    publish_event(db, db_document, "status", status="pending", filename=db_document.filename)
     db.commit()
     db.refresh(db_document)
     
     logger.info(f"Document {db_document.id} uploaded successfully: {file.filename}")
-    
-    # Start asynchronous processing with a new database session
-    asyncio.create_task(process_document(db_document.id, file_path, file.content_type))
+    job_worker.notify()
     
     return db_document
 
+def _create_batch(db: Session, notebook_id: int, staged: list):
+    """Adopt the staged files and create their documents and jobs, committing
+    once. Returns (items, queued documents). Blocking; run in the threadpool."""
+    items = []
+    documents = []
+    for filename, file_type, staged_file, error in staged:
+        if error:
+            items.append(BatchUploadItem(filename=filename, status="rejected", error=error))
+            continue
+        blob = adopt_blob(db, *staged_file)
+        document = Document(
+            notebook_id=notebook_id,
+            filename=filename,
+            file_type=file_type,
+            file_url=blob.path,
+            file_size=blob.size,
+            content_hash=blob.sha256,
+            status="pending"
+        )
+        db.add(document)
+        documents.append(document)
+        items.append(BatchUploadItem(filename=filename, status="queued"))
+    db.flush()
+    for document in documents:
+        enqueue_document(db, document.id)
+        publish_event(db, document, "status", status="pending", filename=document.filename)
+    db.commit()
+    
+    queued = iter(documents)
+    for item in items:
+        if item.status == "queued":
+            item.document_id = next(queued).id
+    return items, documents
+
+@router.post("/upload-batch/{notebook_id}", response_model=BatchUploadResponse)
+async def upload_documents(
+    notebook_id: int,
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(get_db)
+):
+    """Upload many documents, or zip archives of them, to a notebook in one request.
+
+    Every file is streamed to disk first; the documents and their processing
+    jobs are then created in a single transaction, and the job queue works
+    through them with bounded concurrency. Unsupported or oversized files are
+    reported per file without failing the rest of the batch.
+    """
+    if not await run_in_threadpool(db.query(Notebook.id).filter(Notebook.id == notebook_id).first):
+        raise HTTPException(status_code=404, detail="Notebook not found")
+    
+    staged = []  # (filename, file_type, (path, size, sha256) or None, error or None)
+    try:
+        for file in files:
+            budget = settings.MAX_BATCH_FILES - sum(1 for item in staged if item[2])
+            if _is_archive(file):
+                try:
+                    staged.extend(await run_in_threadpool(_stage_archive, file.file, budget))
+                except zipfile.BadZipFile:
+                    staged.append((file.filename, None, None, "Not a valid zip archive"))
+                continue
+            file_type = _file_type(file.filename, file.content_type)
+            if file_type is None:
+                staged.append((file.filename, None, None, "File type not supported"))
+            elif budget <= 0:
+                staged.append((file.filename, file_type, None, "Too many files in one batch"))
+            else:
+                try:
+                    staged.append((file.filename, file_type, await stage_upload(file), None))
+                except HTTPException as e:
+                    staged.append((file.filename, file_type, None, e.detail))
+    except BaseException:
+        for _, _, staged_file, _ in staged:
+            if staged_file:
+                discard_staged(staged_file[0])
+        raise
+    
+    # One transaction for the whole batch, in the threadpool: adopting blobs
+    # moves files and every step below touches the database
+    items, documents = await run_in_threadpool(_create_batch, db, notebook_id, staged)
+    
+    logger.info(f"Batch upload to notebook {notebook_id}: {len(documents)} queued, {len(items) - len(documents)} rejected")
+    job_worker.notify()
+    
+    return BatchUploadResponse(
+        notebook_id=notebook_id,
+        queued=len(documents),
+        rejected=len(items) - len(documents),
+        files=items
+    )
+
+@router.get("/progress/{notebook_id}", response_model=DocumentProgressResponse)
+def get_document_progress(
+    notebook_id: int,
+    ids: Optional[str] = Query(None, description="Comma-separated document ids, e.g. from a batch upload"),
+    db: Session = Depends(get_db)
+):
+    """Processing status of a notebook's documents, with the last error of failed ones"""
+    query = db.query(Document.id, Document.filename, Document.status).filter(Document.notebook_id == notebook_id)
+    if ids:
+        try:
+            query = query.filter(Document.id.in_([int(value) for value in ids.split(",") if value.strip()]))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="ids must be comma-separated integers")
+    rows = query.order_by(Document.id).all()
+    
+    failed = [document_id for document_id, _, status in rows if status == "failed"]
+    errors = {}
+    if failed:
+        for document_id, last_error in db.query(ProcessingJob.document_id, ProcessingJob.last_error).filter(
+            ProcessingJob.document_id.in_(failed)
+        ).order_by(ProcessingJob.id):
+            errors[document_id] = last_error
+    
+    counts = {}
+    for _, _, status in rows:
+        counts[status] = counts.get(status, 0) + 1
+    return DocumentProgressResponse(
+        total=len(rows),
+        counts=counts,
+        documents=[
+            DocumentProgressItem(id=document_id, filename=filename, status=status, error=errors.get(document_id))
+            for document_id, filename, status in rows
+        ]
+    )
+
 @router.delete("/{document_id}")
 def delete_document(document_id: int, db: Session = Depends(get_db)):
     """Delete a document"""
@@ -143,70 +267,119 @@ def delete_document(document_id: int, db: Session = Depends(get_db)):
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Delete file
-    if os.path.exists(document.file_url):
-        os.remove(document.file_url)
+    content_hash = document.content_hash
+    legacy_file = None if is_blob_path(document.file_url) else document.file_url
     
+    publish_event(db, document, "deleted")
     db.delete(document)
     db.commit()
+    vector_index.remove_document(document.notebook_id, document_id)
+    answer_cache.invalidate_notebook(document.notebook_id)
+    
+    # Stored blobs may be shared with other documents; only the last reference removes the file
+    if legacy_file:
+        if os.path.exists(legacy_file):
+            os.remove(legacy_file)
+    elif content_hash:
+        release_blobs(db, [content_hash])
     
     return {"message": "Document deleted successfully"}
 
+@router.get("/{document_id}/content", response_model=DocumentContentResponse)
+def get_document_content(document_id: int, db: Session = Depends(get_db)):
+    """Get a document's extracted text"""
+    if not db.query(Document.id).filter(Document.id == document_id).first():
+        raise HTTPException(status_code=404, detail="Document not found")
+    return DocumentContentResponse(id=document_id, content=get_document_text(db, document_id))
+
+@router.get("/{document_id}/token-report", response_model=DocumentTokenReport)
+def get_token_report(document_id: int, db: Session = Depends(get_db)):
+    """Estimated tokens of the uploaded file versus the text sent to the LLM"""
+    document = db.query(Document).filter(Document.id == document_id).first()
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return DocumentTokenReport(**token_report(db, document))
+
+# Text types are sent with an explicit charset; everything else goes out as stored
+PREVIEW_MEDIA_TYPES = {
+    "text/plain": "text/plain; charset=utf-8",
+    "text/markdown": "text/plain; charset=utf-8",
+    "text/html": "text/html; charset=utf-8"
+}
+
+def _not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since (RFC 9110: If-None-Match wins when present)"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+@router.get("/{document_id}/pages", response_model=DocumentPagesResponse)
+def get_document_pages(
+    document_id: int,
+    start: int = Query(1, ge=1, description="First page, 1-based"),
+    count: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    """Get the extracted text of a range of pages (sections for documents without pages)"""
+    if not db.query(Document.id).filter(Document.id == document_id).first():
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    total_pages = db.query(DocumentPage).filter(DocumentPage.document_id == document_id).count()
+    pages = db.query(DocumentPage).filter(
+        DocumentPage.document_id == document_id,
+        DocumentPage.page_number >= start,
+        DocumentPage.page_number < start + count
+    ).order_by(DocumentPage.page_number).all()
+    items = [
+        DocumentPageItem(page_number=page.page_number, start_offset=page.start_offset,
+                         char_count=page.char_count, content=text)
+        for page, text in zip(pages, page_texts(db, document_id, pages))
+    ]
+    return DocumentPagesResponse(document_id=document_id, total_pages=total_pages, start=start, pages=items)
+
 @router.get("/preview/{document_id}")
-def preview_document(document_id: int, db: Session = Depends(get_db)):
-    """Preview a document - returns the file for inline viewing"""
+def preview_document(document_id: int, request: Request, db: Session = Depends(get_db)):
+    """Preview a document - streams the file for inline viewing.
+
+    Supports Range requests (so PDF viewers can load progressively) and
+    conditional GETs: stored files never change, so the content hash makes
+    a strong ETag and a revalidation returns 304 without touching the file.
+    """
     document = db.query(Document).filter(Document.id == document_id).first()
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    if not os.path.exists(document.file_url):
+    try:
+        stat_result = os.stat(document.file_url)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found")
     
-    filename = document.filename
-    file_type = document.file_type
-    encoded_filename = quote(filename, safe='')
-    
-    if file_type == "application/pdf":
-        return FileResponse(
-            path=document.file_url,
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"inline; filename*=UTF-8''{encoded_filename}"
-            }
-        )
-    elif file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-        return FileResponse(
-            path=document.file_url,
-            media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            headers={
-                "Content-Disposition": f"inline; filename*=UTF-8''{encoded_filename}"
-            }
-        )
-    elif file_type in ["text/plain", "text/markdown"]:
-        with open(document.file_url, "r", encoding="utf-8", errors="ignore") as f:
-            content = f.read()
-        return Response(
-            content=content,
-            media_type="text/plain; charset=utf-8",
-            headers={
-                "Content-Disposition": f"inline; filename*=UTF-8''{encoded_filename}"
-            }
-        )
-    elif file_type == "text/html":
-        with open(document.file_url, "r", encoding="utf-8", errors="ignore") as f:
-            content = f.read()
-        return Response(
-            content=content,
-            media_type="text/html; charset=utf-8",
-            headers={
-                "Content-Disposition": f"inline; filename*=UTF-8''{encoded_filename}"
-            }
-        )
+    if document.content_hash:
+        etag = f'"{document.content_hash}"'
     else:
-        return FileResponse(
-            path=document.file_url,
-            media_type=file_type,
-            headers={
-                "Content-Disposition": f"inline; filename*=UTF-8''{encoded_filename}"
-            }
-        )
+        etag = f'"{int(stat_result.st_mtime)}-{stat_result.st_size}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": "private, no-cache",
+        "Accept-Ranges": "bytes"
+    }
+    if _not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+    
+    encoded_filename = quote(document.filename, safe='')
+    headers["Content-Disposition"] = f"inline; filename*=UTF-8''{encoded_filename}"
+    return FileResponse(
+        path=document.file_url,
+        media_type=PREVIEW_MEDIA_TYPES.get(document.file_type, document.file_type),
+        headers=headers,
+        stat_result=stat_result
+    )
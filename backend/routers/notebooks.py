@@ -1,10 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from typing import List
-from backend.database import get_db
-from backend.models import Notebook, Document, Message, Conversation
+from typing import List, Optional
+from backend.config import settings
+from backend.database import get_db, SessionLocal
+from backend.models import Notebook, Document, DocumentEvent, Message, Conversation
 from backend.schemas import NotebookCreate, NotebookResponse, DocumentResponse
+from backend.storage import release_blobs
+from backend.vector_index import vector_index
+from backend.answer_cache import answer_cache
+from backend.events import event_broker, events_since, event_payload, format_sse, latest_event_id
+from starlette.concurrency import run_in_threadpool
+import asyncio
 import json
 
 router = APIRouter()
@@ -57,12 +65,104 @@ def get_notebook_documents(notebook_id: int, db: Session = Depends(get_db)):
     documents = db.query(Document).filter(Document.notebook_id == notebook_id).all()
     return documents
 
+def _initial_events(notebook_id: int, last_event_id: Optional[int]):
+    """The messages a new stream starts with and the id they reach, or None
+    if the notebook does not exist. Blocking; run in the threadpool."""
+    db = SessionLocal()
+    try:
+        if not db.query(Notebook.id).filter(Notebook.id == notebook_id).first():
+            return None
+        if last_event_id is not None and last_event_id > latest_event_id(db):
+            # From before the event table was emptied; its ids mean nothing now
+            last_event_id = None
+        if last_event_id is not None:
+            missed = events_since(db, notebook_id, last_event_id)
+            initial = [format_sse(row.id, row.event, event_payload(row)) for row in missed]
+            return initial, (missed[-1].id if missed else last_event_id)
+        latest = db.query(func.max(DocumentEvent.id)).filter(DocumentEvent.notebook_id == notebook_id).scalar() or 0
+        documents = db.query(Document.id, Document.filename, Document.status).filter(
+            Document.notebook_id == notebook_id
+        ).order_by(Document.id).all()
+        return [format_sse(latest, "snapshot", {"documents": [
+            {"document_id": document_id, "filename": filename, "status": status}
+            for document_id, filename, status in documents
+        ]})], latest
+    finally:
+        db.close()
+
+@router.get("/{notebook_id}/events")
+async def notebook_events(
+    notebook_id: int,
+    request: Request,
+    last_event_id: Optional[int] = Query(None, description="Resume after this event (same as the Last-Event-ID header)")
+):
+    """Server-sent events for the documents of a notebook.
+
+    A new stream starts with a ``snapshot`` of every document's status, then
+    sends ``status``, ``progress`` and ``deleted`` events as the processing
+    pipeline produces them. Reconnecting with Last-Event-ID replays what was
+    missed instead of sending a new snapshot.
+    """
+    header = request.headers.get("last-event-id")
+    if header and header.isdigit():
+        last_event_id = int(header)
+    
+    # Subscribe before reading, so nothing committed in between is lost
+    subscription = event_broker.subscribe(notebook_id)
+    try:
+        start = await run_in_threadpool(_initial_events, notebook_id, last_event_id)
+    except BaseException:
+        event_broker.unsubscribe(subscription)
+        raise
+    if start is None:
+        event_broker.unsubscribe(subscription)
+        raise HTTPException(status_code=404, detail="Notebook not found")
+    initial, sent = start
+    
+    async def stream():
+        nonlocal sent
+        try:
+            yield "retry: 3000\n\n"
+            for message in initial:
+                yield message
+            while True:
+                try:
+                    event_id, event, payload = await asyncio.wait_for(
+                        subscription.queue.get(), settings.EVENT_KEEPALIVE
+                    )
+                except asyncio.TimeoutError:
+                    if subscription.overflowed:
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                if event_id > sent:
+                    sent = event_id
+                    yield format_sse(event_id, event, payload)
+                if subscription.overflowed and subscription.queue.empty():
+                    # Fell behind; the client reconnects and catches up from Last-Event-ID
+                    break
+        finally:
+            event_broker.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.delete("/{notebook_id}")
 def delete_notebook(notebook_id: int, db: Session = Depends(get_db)):
     """Delete a notebook"""
     notebook = db.query(Notebook).filter(Notebook.id == notebook_id).first()
     if not notebook:
         raise HTTPException(status_code=404, detail="Notebook not found")
+    content_hashes = [h for (h,) in db.query(Document.content_hash).filter(
+        Document.notebook_id == notebook_id,
+        Document.content_hash.isnot(None)
+    ).all()]
     db.delete(notebook)
     db.commit()
+    release_blobs(db, content_hashes)
+    vector_index.drop_notebook(notebook_id)
+    answer_cache.invalidate_notebook(notebook_id)
     return {"message": "Notebook deleted successfully"}
@@ -1,5 +1,4 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
-from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 import asyncio
 import websockets
@@ -8,7 +7,8 @@ import struct
 import uuid
 from backend.database import get_db
 from backend.config import settings
-from backend.config_model import Config
+from backend.config_service import config_service
+from backend.streaming import DisconnectAwareResponse
 
 router = APIRouter()
 
@@ -40,30 +40,8 @@ class MsgType:
     Error = 0x0F
 
 def get_podcast_config(db: Session):
-    """从数据库获取播客API配置"""
-    try:
-        configs = db.query(Config).filter(Config.category.in_(["podcast", "doubao", "custom"])).all()
-        podcast_config = {}
-        for config in configs:
-            key = config.key
-            if key.startswith("podcast."):
-                normalized_key = key[8:]
-                podcast_config[normalized_key] = config.value
-            elif key.startswith("podcast_"):
-                normalized_key = key[8:]
-                podcast_config[normalized_key] = config.value
-            elif key.startswith("doubao."):
-                normalized_key = key[7:]
-                podcast_config[normalized_key] = config.value
-            elif key.startswith("doubao_"):
-                normalized_key = key[7:]
-                podcast_config[normalized_key] = config.value
-            else:
-                podcast_config[key] = config.value
-        return podcast_config
-    except Exception as e:
-        print(f"加载播客配置失败: {e}")
-        return {}
+    """从配置缓存获取播客API配置（已去掉 podcast./doubao. 前缀）"""
+    return config_service.get(db).podcast
 
 def get_speakers_from_config(podcast_config: dict) -> list:
     """从配置中获取发音人列表"""
@@ -294,6 +272,14 @@ async def generate_podcast_audio(podcast_script: str, app_id: str, access_key: s
         if podcast_audio:
             yield bytes(podcast_audio)
     
+    except (asyncio.CancelledError, GeneratorExit):
+        # 客户端已断开：立即中止上游连接，不再等待关闭握手
+        print(f"客户端已断开，音频生成已中止（已收到 {len(podcast_audio)} bytes）")
+        if websocket:
+            websocket.transport.abort()
+            websocket = None
+        raise
+    
     except Exception as e:
         print(f"生成音频失败: {e}")
         raise HTTPException(status_code=500, detail=f"音频生成失败: {str(e)}")
@@ -324,7 +310,7 @@ async def generate_podcast_audio_endpoint(
         async for audio_chunk in generate_podcast_audio(podcast_script, app_id, access_key, speakers):
             yield audio_chunk
     
-    return StreamingResponse(audio_generator(), media_type="audio/mp3")
+    return DisconnectAwareResponse(audio_generator(), media_type="audio/mp3")
 
 @router.post("/convert-script")
 async def convert_script_to_audio(request: Request, db: Session = Depends(get_db)):
@@ -347,7 +333,7 @@ async def convert_script_to_audio(request: Request, db: Session = Depends(get_db
         async for audio_chunk in generate_podcast_audio(podcast_script, app_id, access_key, speakers):
             yield audio_chunk
     
-    return StreamingResponse(audio_generator(), media_type="audio/mp3")
+    return DisconnectAwareResponse(audio_generator(), media_type="audio/mp3")
 
 @router.get("/config-status")
 async def get_podcast_config_status(db: Session = Depends(get_db)):
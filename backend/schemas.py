@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 
 # Notebook Schemas
@@ -32,13 +32,67 @@ class DocumentResponse(DocumentBase):
     id: int
     notebook_id: int
     file_url: str
-    content: Optional[str] = None
     status: str
     created_at: datetime
     
     class Config:
         from_attributes = True
 
+class DocumentContentResponse(BaseModel):
+    id: int
+    content: Optional[str] = None
+
+class DocumentTokenReport(BaseModel):
+    document_id: int
+    filename: str
+    file_type: str
+    extractor_version: int
+    file_size: int
+    tokenizer: str
+    text_chars: int
+    file_tokens: Optional[int] = None  # None for binary formats
+    text_tokens: int
+    saved_tokens: Optional[int] = None
+    reduction: Optional[float] = None  # fraction of the file's tokens removed
+
+class DocumentPageItem(BaseModel):
+    page_number: int
+    start_offset: Optional[int] = None
+    char_count: Optional[int] = None
+    content: str
+    
+    class Config:
+        from_attributes = True
+
+class DocumentPagesResponse(BaseModel):
+    document_id: int
+    total_pages: int
+    start: int
+    pages: List[DocumentPageItem]
+
+class BatchUploadItem(BaseModel):
+    filename: str
+    status: str  # queued, or rejected with an error
+    document_id: Optional[int] = None
+    error: Optional[str] = None
+
+class BatchUploadResponse(BaseModel):
+    notebook_id: int
+    queued: int
+    rejected: int
+    files: List[BatchUploadItem]
+
+class DocumentProgressItem(BaseModel):
+    id: int
+    filename: str
+    status: str
+    error: Optional[str] = None
+
+class DocumentProgressResponse(BaseModel):
+    total: int
+    counts: Dict[str, int]
+    documents: List[DocumentProgressItem]
+
 # Conversation Schemas
 class ConversationBase(BaseModel):
     notebook_id: int
@@ -65,6 +119,7 @@ class MessageCreate(MessageBase):
 class MessageResponse(MessageBase):
     id: int
     conversation_id: int
+    status: Optional[str] = None
     created_at: datetime
     
     class Config:
@@ -0,0 +1,177 @@
+from sqlalchemy import event, literal_column, select, table, text
+from sqlalchemy.orm import Session
+from typing import Dict, List, Sequence, Tuple
+from backend.chunking import CJK_RANGES
+from backend.database import engine
+from backend.models import Document, DocumentChunk
+import math
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Notebook scoped; replaces chunk_fts, whose notebook_id column was not indexed
+FTS_TABLE = "chunk_fts2"
+_OLD_FTS_TABLE = "chunk_fts"
+
+_TOKEN_RE = re.compile(f"[{CJK_RANGES}]+|[^\\W_]+")
+_CJK_RUN_RE = re.compile(f"[{CJK_RANGES}]+")
+
+# BM25 parameters, matching SQLite FTS5's defaults
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_fts_available = None
+
+def segment(value: str) -> List[str]:
+    """Tokenise text for indexing and querying.
+
+    Chinese/Japanese/Korean has no spaces between words, so runs of CJK
+    characters become overlapping character bigrams ("知识库" -> "知识 识库");
+    other words are lowercased as-is. Queries go through the same function,
+    which lets the plain unicode61 tokenizer match CJK text.
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer(value):
+        token = match.group(0)
+        if _CJK_RUN_RE.fullmatch(token):
+            if len(token) == 1:
+                tokens.append(token)
+            else:
+                tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            tokens.append(token.lower())
+    return tokens
+
+def create_fts_index() -> bool:
+    """Create the FTS5 table if the database supports it. Called at startup."""
+    global _fts_available
+    _fts_available = False
+    if engine.dialect.name == "sqlite":
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                    "body, notebook, document_id UNINDEXED, tokenize='unicode61')"
+                ))
+                # backfill_index fills the new table from the chunks
+                conn.execute(text(f"DROP TABLE IF EXISTS {_OLD_FTS_TABLE}"))
+            _fts_available = True
+        except Exception as e:
+            logger.warning(f"SQLite FTS5 unavailable, falling back to in-process BM25: {e}")
+    return _fts_available
+
+def fts_available() -> bool:
+    """Whether chunks are indexed in SQLite FTS5 (otherwise ranking runs in Python)"""
+    if _fts_available is None:
+        create_fts_index()
+    return _fts_available
+
+def notebook_token(notebook_id: int) -> str:
+    """The term a notebook's chunks carry in the index's notebook column.
+
+    Matching it as part of the query keeps FTS5 from scoring other
+    notebooks' chunks at all.
+    """
+    return f"nb{notebook_id}"
+
+def index_chunks(db: Session, chunks: Sequence[DocumentChunk]):
+    """Add chunks to the full-text index. Chunks must be flushed (have ids)."""
+    if not chunks or not fts_available():
+        return
+    db.execute(
+        text(f"INSERT INTO {FTS_TABLE}(rowid, body, notebook, document_id) VALUES (:id, :body, :notebook, :document_id)"),
+        [
+            {
+                "id": chunk.id,
+                "body": " ".join(segment(chunk.content)),
+                "notebook": notebook_token(chunk.notebook_id),
+                "document_id": chunk.document_id
+            }
+            for chunk in chunks
+        ]
+    )
+
+def unindex_document(connection, document_id: int):
+    if fts_available():
+        connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE document_id = :document_id"), {"document_id": document_id})
+
+@event.listens_for(Document, "after_delete")
+def _unindex_deleted_document(mapper, connection, target):
+    unindex_document(connection, target.id)
+
+def backfill_index(db: Session) -> int:
+    """Index chunks that are missing from the full-text index"""
+    if not fts_available():
+        return 0
+    indexed = select(literal_column("rowid")).select_from(table(FTS_TABLE))
+    missing = db.query(DocumentChunk).filter(~DocumentChunk.id.in_(indexed)).all()
+    for start in range(0, len(missing), 500):
+        index_chunks(db, missing[start:start + 500])
+    db.commit()
+    if missing:
+        logger.info(f"Indexed {len(missing)} chunks for full-text search")
+    return len(missing)
+
+def _match_expression(notebook_id: int, tokens: List[str]) -> str:
+    terms = " OR ".join('"' + token.replace('"', '""') + '"' for token in dict.fromkeys(tokens))
+    return f'notebook : "{notebook_token(notebook_id)}" AND ({terms})'
+
+def _python_bm25(db: Session, notebook_id: int, tokens: List[str], limit: int) -> List[Tuple[int, float]]:
+    """BM25 over a notebook's chunks for databases without FTS5"""
+    rows = db.query(DocumentChunk.id, DocumentChunk.content).join(Document).filter(
+        DocumentChunk.notebook_id == notebook_id,
+        Document.status == "completed"
+    ).all()
+    if not rows:
+        return []
+
+    query_terms = set(tokens)
+    stats = []  # (chunk_id, term frequencies, chunk length) per chunk
+    document_frequency: Dict[str, int] = {}
+    for chunk_id, content in rows:
+        chunk_tokens = segment(content)
+        frequencies: Dict[str, int] = {}
+        for token in chunk_tokens:
+            if token in query_terms:
+                frequencies[token] = frequencies.get(token, 0) + 1
+        for token in frequencies:
+            document_frequency[token] = document_frequency.get(token, 0) + 1
+        stats.append((chunk_id, frequencies, len(chunk_tokens)))
+
+    average_length = sum(length for _, _, length in stats) / len(stats) or 1
+    scored = []
+    for chunk_id, frequencies, length in stats:
+        score = 0.0
+        for token, frequency in frequencies.items():
+            idf = math.log(1 + (len(stats) - document_frequency[token] + 0.5) / (document_frequency[token] + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+            score += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        if score > 0:
+            scored.append((chunk_id, score))
+    scored.sort(key=lambda item: item[1], reverse=True)
+    return scored[:limit]
+
+def search_chunks(db: Session, notebook_id: int, query: str, limit: int = 20) -> List[Tuple[int, float]]:
+    """Return (chunk_id, score) for the best BM25 matches in a notebook, best first"""
+    tokens = segment(query)
+    if not tokens:
+        return []
+    if not fts_available():
+        return _python_bm25(db, notebook_id, tokens, limit)
+
+    # bm25() is lower-is-better in FTS5; negate it so higher scores are better.
+    # The notebook column gets no weight, so only the text decides the ranking.
+    # Chunks of documents still processing (or failed) are left out before the
+    # LIMIT, so callers get a full top-k.
+    rank = f"bm25({FTS_TABLE}, 1.0, 0.0)"
+    rows = db.execute(
+        text(
+            f"SELECT rowid, -{rank} AS score FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH :match AND document_id IN ("
+            "SELECT id FROM documents WHERE notebook_id = :notebook_id AND status = 'completed'"
+            f") ORDER BY {rank} LIMIT :limit"
+        ),
+        {"match": _match_expression(notebook_id, tokens), "notebook_id": notebook_id, "limit": limit}
+    ).all()
+    return [(row[0], row[1]) for row in rows]
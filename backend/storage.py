@@ -0,0 +1,279 @@
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, Dict, Iterable, Optional, Tuple
+from backend.config import settings
+from backend.models import Blob, Document, DocumentContent
+import hashlib
+import os
+import uuid
+import zlib
+import logging
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Temporary upload directory (in production, use object storage)
+# Use project-based uploads directory for cross-platform compatibility
+UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploads")
+# Content-addressed store: every distinct file is kept once, named by its SHA-256
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")
+INCOMING_DIR = os.path.join(UPLOAD_DIR, "incoming")
+os.makedirs(BLOB_DIR, exist_ok=True)
+os.makedirs(INCOMING_DIR, exist_ok=True)
+
+# Unreferenced blobs younger than this may belong to an upload still in flight
+BLOB_GC_GRACE = timedelta(hours=1)
+
+async def save_upload_stream(
+    file: UploadFile,
+    dest_path: str,
+    max_size: Optional[int] = None,
+    chunk_size: Optional[int] = None
+) -> Tuple[int, str]:
+    """Stream an upload to disk in fixed-size chunks.
+
+    Returns (byte_count, sha256_hex). The file is written to a temporary
+    sibling first and only moved into place once the whole upload has been
+    copied, so an aborted upload never leaves a truncated file behind.
+    """
+    max_size = settings.MAX_UPLOAD_SIZE if max_size is None else max_size
+    chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE
+
+    # Reject early when the client told us the size up front
+    if max_size and file.size is not None and file.size > max_size:
+        raise HTTPException(status_code=413, detail=f"File too large (limit {max_size} bytes)")
+
+    tmp_path = f"{dest_path}.{uuid.uuid4().hex}.part"
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = await file.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_size and size > max_size:
+                    raise HTTPException(status_code=413, detail=f"File too large (limit {max_size} bytes)")
+                digest.update(chunk)
+                await run_in_threadpool(out.write, chunk)
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    logger.info(f"Stored upload {file.filename} ({size} bytes, sha256={digest.hexdigest()[:12]})")
+    return size, digest.hexdigest()
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(BLOB_DIR, sha256[:2], sha256)
+
+def is_blob_path(path: str) -> bool:
+    return os.path.abspath(path).startswith(os.path.abspath(BLOB_DIR) + os.sep)
+
+def adopt_blob(db: Session, tmp_path: str, size: int, sha256: str) -> Blob:
+    """Move a fully written file into the blob store and register it.
+
+    If the content is already stored the new copy is discarded. The blob's
+    reference count is raised when a Document pointing at it is inserted,
+    which must happen in the caller's current transaction: the blob row is
+    locked until then, so a concurrent release cannot drop it in between.
+    """
+    path = blob_path(sha256)
+    # A write takes the row lock (SQLite: the database write lock) up front;
+    # _drop_blob deletes the file before committing, so it is either gone by
+    # now and put back below, or stays until our reference is committed
+    locked = db.query(Blob).filter(Blob.sha256 == sha256).update(
+        {Blob.ref_count: Blob.ref_count}, synchronize_session=False
+    )
+    if locked and os.path.exists(path):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+    blob = db.query(Blob).filter(Blob.sha256 == sha256).first()
+    if blob:
+        return blob
+    try:
+        with db.begin_nested():
+            blob = Blob(sha256=sha256, size=size, path=path, ref_count=0)
+            db.add(blob)
+    except IntegrityError:
+        # Another request registered the same content concurrently
+        blob = db.query(Blob).filter(Blob.sha256 == sha256).first()
+    return blob
+
+async def stage_upload(file: UploadFile, max_size: Optional[int] = None) -> Tuple[str, int, str]:
+    """Stream an upload into the incoming directory; returns (path, size, sha256) for adopt_blob"""
+    tmp_path = os.path.join(INCOMING_DIR, uuid.uuid4().hex)
+    size, sha256 = await save_upload_stream(file, tmp_path, max_size=max_size)
+    return tmp_path, size, sha256
+
+def stage_file(src: BinaryIO, max_size: Optional[int] = None, chunk_size: Optional[int] = None) -> Tuple[str, int, str]:
+    """Blocking counterpart of stage_upload for file objects such as archive members"""
+    max_size = settings.MAX_UPLOAD_SIZE if max_size is None else max_size
+    chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE
+    tmp_path = os.path.join(INCOMING_DIR, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_size and size > max_size:
+                    raise HTTPException(status_code=413, detail=f"File too large (limit {max_size} bytes)")
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return tmp_path, size, digest.hexdigest()
+
+def discard_staged(tmp_path: str):
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+async def store_upload(db: Session, file: UploadFile, max_size: Optional[int] = None) -> Blob:
+    """Stream an upload into the content-addressed store and return its blob"""
+    tmp_path, size, sha256 = await stage_upload(file, max_size=max_size)
+    return adopt_blob(db, tmp_path, size, sha256)
+
+def _drop_blob(db: Session, sha256: str, path: str) -> bool:
+    deleted = db.query(Blob).filter(Blob.sha256 == sha256, Blob.ref_count <= 0).delete(
+        synchronize_session=False
+    )
+    # Remove the file while the row is still locked: an adopt_blob waiting
+    # for the lock then finds the row gone and stores its own copy
+    if deleted and os.path.exists(path):
+        os.remove(path)
+    db.commit()
+    return bool(deleted)
+
+def release_blobs(db: Session, hashes) -> int:
+    """Drop the given blobs if no document references them any more.
+
+    Call after committing the deletion of the documents that used them.
+    """
+    removed = 0
+    for blob in db.query(Blob).filter(Blob.sha256.in_(set(hashes)), Blob.ref_count <= 0).all():
+        removed += _drop_blob(db, blob.sha256, blob.path)
+    return removed
+
+def collect_unreferenced_blobs(db: Session) -> int:
+    """Sweep blobs left unreferenced, e.g. by uploads that failed after storing the file"""
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - BLOB_GC_GRACE
+    removed = 0
+    for blob in db.query(Blob).filter(Blob.ref_count <= 0, Blob.created_at < cutoff).all():
+        removed += _drop_blob(db, blob.sha256, blob.path)
+    if removed:
+        logger.info(f"Removed {removed} unreferenced blobs")
+    return removed
+
+class TextWriter:
+    """Compresses a document's text as it is produced, per DOCUMENT_TEXT_COMPRESSION"""
+
+    def __init__(self, compression: Optional[str] = None):
+        compression = compression or settings.DOCUMENT_TEXT_COMPRESSION
+        if compression == "zstd" and ZSTD_AVAILABLE:
+            self._compressor = zstandard.ZstdCompressor(level=6).compressobj()
+            self.compression = "zstd"
+        elif compression in ("zlib", "zstd"):
+            self._compressor = zlib.compressobj(6)
+            self.compression = "zlib"
+        else:
+            self._compressor = None
+            self.compression = "none"
+        self._parts = []
+        self.size = 0  # characters written
+
+    def write(self, text: str):
+        data = text.encode("utf-8")
+        self._parts.append(self._compressor.compress(data) if self._compressor else data)
+        self.size += len(text)
+
+    def getvalue(self) -> bytes:
+        if self._compressor:
+            self._parts.append(self._compressor.flush())
+            self._compressor = None
+        return b"".join(self._parts)
+
+def _decompress(data: bytes, compression: str) -> bytes:
+    if compression == "zstd":
+        # Streamed frames carry no content size, which ZstdDecompressor.decompress requires
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    if compression == "zlib":
+        return zlib.decompress(data)
+    return data
+
+def store_document_text(db: Session, document: Document, writer: TextWriter):
+    """Store the text collected by a TextWriter as the document's text. The caller commits."""
+    stored = db.query(DocumentContent).filter(DocumentContent.document_id == document.id).first()
+    if stored is None:
+        stored = DocumentContent(document_id=document.id)
+        db.add(stored)
+    stored.data = writer.getvalue()
+    stored.compression = writer.compression
+    stored.size = writer.size
+    document.content = None
+
+def set_document_text(db: Session, document: Document, text: str):
+    """Store a document's extracted text. The caller commits."""
+    writer = TextWriter()
+    writer.write(text)
+    store_document_text(db, document, writer)
+
+def get_document_texts(db: Session, document_ids: Iterable[int]) -> Dict[int, str]:
+    """Extracted text of the given documents, keyed by id; documents without text are left out"""
+    document_ids = list(document_ids)
+    if not document_ids:
+        return {}
+    texts = {
+        document_id: _decompress(data, compression).decode("utf-8")
+        for document_id, data, compression in db.query(
+            DocumentContent.document_id, DocumentContent.data, DocumentContent.compression
+        ).filter(DocumentContent.document_id.in_(document_ids))
+    }
+    # Documents processed before the side table existed
+    missing = [document_id for document_id in document_ids if document_id not in texts]
+    if missing:
+        texts.update(
+            (document_id, content)
+            for document_id, content in db.query(Document.id, Document.content).filter(
+                Document.id.in_(missing), Document.content.isnot(None)
+            )
+        )
+    return texts
+
+def get_document_text(db: Session, document_id: int) -> Optional[str]:
+    """A document's extracted text, or None if it has none yet"""
+    return get_document_texts(db, [document_id]).get(document_id)
+
+def migrate_document_text(db: Session) -> int:
+    """Move text still stored inline on document rows into the compressed side table"""
+    moved = 0
+    while True:
+        batch = db.query(Document).filter(Document.content.isnot(None)).limit(100).all()
+        if not batch:
+            break
+        for document in batch:
+            set_document_text(db, document, document.content)
+        db.commit()
+        moved += len(batch)
+    if moved:
+        logger.info(f"Moved the text of {moved} documents to compressed storage")
+    return moved
@@ -0,0 +1,49 @@
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+from typing import Callable, Optional
+import anyio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class DisconnectAwareResponse(StreamingResponse):
+    """A StreamingResponse that stops its body as soon as the client goes away.
+
+    The request's ``http.disconnect`` is always listened for (Starlette skips
+    this for ASGI 2.4 servers and only notices on the next write), and the body
+    is cancelled at whatever it is awaiting, typically the upstream LLM or TTS
+    connection. The body iterator is then closed with cancellation shielded, so
+    its ``finally`` blocks can still await to abort the upstream request and
+    record the partial result.
+
+    ``on_close`` runs last in every case, even if the body never started, so
+    it is the place to give back anything reserved for the stream.
+    """
+
+    def __init__(self, content, *args, on_close: Optional[Callable[[], None]] = None, **kwargs):
+        super().__init__(content, *args, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            async with anyio.create_task_group() as task_group:
+                async def stream():
+                    try:
+                        await self.stream_response(send)
+                    except OSError:
+                        logger.info("Client went away while streaming")
+                    task_group.cancel_scope.cancel()
+
+                task_group.start_soon(stream)
+                await self.listen_for_disconnect(receive)
+                task_group.cancel_scope.cancel()
+        finally:
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose is not None:
+                with anyio.CancelScope(shield=True):
+                    await aclose()
+            if self.on_close is not None:
+                self.on_close()
+
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,124 @@
+"""
+测试 LLM 后端的准入控制：并发上限、先进先出的等待队列、队满时的 429 与 Retry-After、
+超时或取消后让出名额，以及 LLM_MODEL_LIMITS 的按模型配置。
+"""
+import asyncio
+import pytest
+from fastapi import HTTPException
+from backend.admission import AdmissionController, BackendLimiter, QueueFull, QueueTimeout, admit_or_reject
+from backend.config import settings
+
+def test_waiters_move_up_in_order():
+    limiter = BackendLimiter("test", concurrency=1, max_queue=3)
+    running = limiter.admit()
+    first, second, third = limiter.admit(), limiter.admit(), limiter.admit()
+    assert running.position == 0
+    assert [first.position, second.position, third.position] == [1, 2, 3]
+
+    running.release()
+    assert first.granted and first.position == 0
+    assert [second.position, third.position] == [1, 2]
+    # A waiter leaving lets the ones behind it move up, without taking a slot
+    second.release()
+    assert third.position == 1 and limiter.active == 1
+
+    first.release()
+    assert third.granted and limiter.active == 1 and not limiter.waiters
+    third.release()
+    third.release()  # idempotent
+    assert limiter.active == 0
+
+def test_wait_reports_each_position():
+    async def scenario():
+        limiter = BackendLimiter("test", concurrency=1, max_queue=3)
+        holders = [limiter.admit(), limiter.admit(), limiter.admit()]
+        ticket = limiter.admit()
+        positions = []
+
+        async def waiting():
+            async for position in ticket.wait(timeout=5):
+                positions.append(position)
+
+        task = asyncio.create_task(waiting())
+        for holder in holders:
+            await asyncio.sleep(0.01)
+            holder.release()
+        await asyncio.wait_for(task, 5)
+        assert positions == [3, 2, 1]
+        assert ticket.granted
+        ticket.release()
+
+    asyncio.run(scenario())
+
+def test_full_queue_is_rejected_with_retry_after():
+    limiter = BackendLimiter("test", concurrency=1, max_queue=1)
+    limiter.admit()
+    limiter.admit()
+    with pytest.raises(QueueFull) as error:
+        limiter.admit()
+    assert error.value.retry_after >= 1
+    assert limiter.stats()["rejected"] == 1
+
+def test_admit_or_reject_answers_429(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_MODEL_LIMITS", {"busy-model": {"concurrency": 1, "queue": 0}})
+    monkeypatch.setattr("backend.admission.admission", AdmissionController())
+    ticket = admit_or_reject("busy-model")
+    try:
+        with pytest.raises(HTTPException) as error:
+            admit_or_reject("busy-model")
+        assert error.value.status_code == 429
+        assert int(error.value.headers["Retry-After"]) >= 1
+    finally:
+        ticket.release()
+    admit_or_reject("busy-model").release()
+
+def test_queue_timeout_gives_up_the_place():
+    async def scenario():
+        limiter = BackendLimiter("test", concurrency=1, max_queue=2)
+        running = limiter.admit()
+        late, next_in_line = limiter.admit(), limiter.admit()
+        with pytest.raises(QueueTimeout):
+            await late.acquire(timeout=0.05)
+        assert late.released and next_in_line.position == 1
+        running.release()
+        assert next_in_line.granted and limiter.active == 1
+        next_in_line.release()
+        assert limiter.active == 0
+
+    asyncio.run(scenario())
+
+def test_cancelled_waiter_frees_its_place():
+    async def scenario():
+        limiter = BackendLimiter("test", concurrency=1, max_queue=2)
+        running = limiter.admit()
+        cancelled, next_in_line = limiter.admit(), limiter.admit()
+
+        async def request():
+            # As the endpoints do: the ticket is released however the request ends
+            try:
+                await cancelled.acquire(timeout=5)
+            finally:
+                cancelled.release()
+
+        task = asyncio.create_task(request())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert next_in_line.position == 1
+        running.release()
+        assert next_in_line.granted and limiter.active == 1
+        next_in_line.release()
+
+    asyncio.run(scenario())
+
+def test_limits_per_model_and_backend(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_MODEL_LIMITS", {"big-model": {"concurrency": 2, "queue": 5}})
+    controller = AdmissionController()
+    big = controller.limiter("big-model")
+    assert (big.concurrency, big.max_queue) == (2, 5)
+    other = controller.limiter("other-model")
+    assert (other.concurrency, other.max_queue) == (settings.LLM_MAX_CONCURRENCY, settings.LLM_MAX_QUEUE)
+    assert controller.limiter("big-model") is big
+    # The same model behind another base URL is a separate backend
+    assert controller.limiter("big-model", "http://elsewhere/v1") is not big
@@ -0,0 +1,102 @@
+"""
+测试答案缓存
+
+缓存本身：规范化、LRU、TTL、磁盘层和按笔记本失效；以及 /chat/ 的端到端行为：
+同一问题第二次提问不再调用 LLM，而是以相同的 SSE 格式回放，文档集合变化后缓存失效。
+"""
+import json
+import time
+import httpx
+from backend.answer_cache import AnswerCache, cache_key, normalize_question
+from backend.fake_llm import Behaviour, FakeLLMServer
+from backend.models import Message
+
+def test_normalize_question():
+    assert normalize_question("  What are the KEY findings?  ") == "what are the key findings"
+    assert normalize_question("总结一下这份文档？") == normalize_question("总结一下这份文档")
+    assert normalize_question("ＡＢＣ　ｄｅｆ") == "abc def"  # full-width letters and space
+    assert cache_key("Summarise this!", "f", "m", 1) == cache_key("summarise   this", "f", "m", 1)
+    assert cache_key("summarise this", "f", "m", 1) != cache_key("summarise this", "g", "m", 1)
+    assert cache_key("summarise this", "f", "m", 1) != cache_key("summarise this", "f", "m", 2)
+
+def test_lru_eviction():
+    cache = AnswerCache(max_entries=2, ttl=0, directory="")
+    cache.put(1, "a", "A")
+    cache.put(1, "b", "B")
+    assert cache.get(1, "a") == "A"  # now the most recently used
+    cache.put(1, "c", "C")
+    assert cache.get(1, "b") is None
+    assert cache.get(1, "a") == "A" and cache.get(1, "c") == "C"
+
+def test_ttl_expiry():
+    cache = AnswerCache(max_entries=10, ttl=0.1, directory="")
+    cache.put(1, "a", "A")
+    assert cache.get(1, "a") == "A"
+    time.sleep(0.15)
+    assert cache.get(1, "a") is None
+
+def test_disk_tier_and_invalidation(tmp_path):
+    directory = str(tmp_path)
+    cache = AnswerCache(max_entries=10, ttl=0, directory=directory)
+    cache.put(1, "a", "答案 A")
+    cache.put(2, "b", "答案 B")
+
+    # A new process (empty memory) finds the answers on disk
+    restarted = AnswerCache(max_entries=10, ttl=0, directory=directory)
+    assert restarted.get(1, "a") == "答案 A"
+
+    restarted.invalidate_notebook(1)
+    assert restarted.get(1, "a") is None
+    assert AnswerCache(max_entries=10, ttl=0, directory=directory).get(1, "a") is None
+    assert restarted.get(2, "b") == "答案 B"
+
+def ask(base: str, notebook_id: int, question: str, conversation_id: int = None):
+    """(answer text, done event) of one /chat/ request"""
+    payload = {"notebook_id": notebook_id, "message": question}
+    if conversation_id:
+        payload["conversation_id"] = conversation_id
+    parts, done = [], None
+    with httpx.Client(timeout=30) as client:
+        with client.stream("POST", f"{base}/chat/", json=payload) as response:
+            assert response.status_code == 200
+            for line in response.iter_lines():
+                if not line.startswith("data:"):
+                    continue
+                event = json.loads(line[5:])
+                assert event["type"] != "error", event
+                if event["type"] == "content":
+                    parts.append(event["content"])
+                elif event["type"] == "done":
+                    done = event
+    return "".join(parts), done
+
+def test_chat_replays_cached_answers(api_base, db, new_notebook, add_document):
+    upstream = FakeLLMServer(Behaviour(ttft=0.01, tokens_per_second=0, tokens=200))
+    upstream_url = upstream.start()
+    for key, value in {
+        "llm.api_key": "test-key", "llm.model_id": "fake-model", "llm.base_url": upstream_url
+    }.items():
+        httpx.post(f"{api_base}/config/", params={"key": key, "value": value, "category": "llm"}).raise_for_status()
+
+    notebook_id = new_notebook("answer cache test")
+    add_document(notebook_id, "答案缓存测试文档。" * 50)
+
+    first, done = ask(api_base, notebook_id, "这份文档的要点是什么？")
+    assert not done.get("cached") and upstream.requests == 1
+
+    # Same question, spelled a little differently: replayed, the LLM is not called
+    second, done = ask(api_base, notebook_id, "  这份文档的要点是什么  ")
+    assert done.get("cached") and upstream.requests == 1
+    assert second == first
+    stored = db.query(Message).filter(Message.conversation_id == done["conversation_id"]).all()
+    assert [message.role for message in stored] == ["user", "assistant"]
+    assert stored[1].content == first
+
+    # A follow-up depends on the conversation so far, and is never answered from the cache
+    _, done = ask(api_base, notebook_id, "这份文档的要点是什么？", conversation_id=done["conversation_id"])
+    assert not done.get("cached") and upstream.requests == 2
+
+    # A new document changes the fingerprint
+    add_document(notebook_id, "另一份文档。" * 50)
+    _, done = ask(api_base, notebook_id, "这份文档的要点是什么？")
+    assert not done.get("cached") and upstream.requests == 3
@@ -0,0 +1,50 @@
+"""
+测试批量上传：zip 包中不支持的成员会被逐个报告，但不占用每批文件数的额度；
+接受的文件在一个事务里创建文档和处理任务。
+"""
+import io
+import zipfile
+import httpx
+from backend.models import ProcessingJob
+from backend.routers.documents import _stage_archive
+from backend.storage import discard_staged
+
+def archive(members: dict) -> io.BytesIO:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for name, content in members.items():
+            zf.writestr(name, content)
+    buffer.seek(0)
+    return buffer
+
+def test_rejected_members_do_not_use_the_budget():
+    results = _stage_archive(archive({
+        "a.exe": b"junk", "b.png": b"junk", "c.bin": b"junk",
+        "notes.txt": b"first", "more.md": b"second", "extra.txt": b"third"
+    }), budget=2)
+    try:
+        outcome = {name: error for name, _, _, error in results}
+        assert outcome == {
+            "a.exe": "File type not supported", "b.png": "File type not supported",
+            "c.bin": "File type not supported", "notes.txt": None, "more.md": None,
+            "extra.txt": "Too many files in one batch"
+        }
+    finally:
+        for _, _, staged, _ in results:
+            if staged:
+                discard_staged(staged[0])
+
+def test_batch_upload_queues_documents(api_base, db, new_notebook):
+    notebook_id = new_notebook("batch test")
+    files = [
+        ("files", ("one.txt", b"first batch file", "text/plain")),
+        ("files", ("two.exe", b"junk", "application/octet-stream")),
+        ("files", ("docs.zip", archive({"three.md": b"third batch file"}).getvalue(), "application/zip"))
+    ]
+    response = httpx.post(f"{api_base}/documents/upload-batch/{notebook_id}", files=files, timeout=30)
+    response.raise_for_status()
+    body = response.json()
+    assert (body["queued"], body["rejected"]) == (2, 1)
+    queued = [item["document_id"] for item in body["files"] if item["status"] == "queued"]
+    assert db.query(ProcessingJob).filter(ProcessingJob.document_id.in_(queued)).count() == 2
+    assert httpx.post(f"{api_base}/documents/upload-batch/999999", files=files[:1]).status_code == 404
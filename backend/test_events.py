@@ -0,0 +1,62 @@
+"""
+测试文档事件的清理与 id 连续性：清理掉全部过期事件后，新事件的 id 仍然大于之前发出的任何 id，
+监听中的客户端能继续收到；事件表被清空、id 回退时，分发器会从头读取。
+"""
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+import httpx
+from backend.events import EventBroker, publish_event
+from backend.models import DocumentEvent
+
+NOTEBOOK_ID = 424242
+
+def publish(db, status: str):
+    publish_event(db, SimpleNamespace(notebook_id=NOTEBOOK_ID, id=1), "status", status)
+    db.commit()
+
+async def receive(subscription) -> tuple:
+    return await asyncio.wait_for(subscription.queue.get(), 5)
+
+def test_events_survive_pruning(db):
+    async def scenario():
+        broker = EventBroker(poll_interval=0.05)
+        await broker.start()
+        subscription = broker.subscribe(NOTEBOOK_ID)
+        try:
+            for status in ("pending", "processing", "processing", "processing", "completed"):
+                publish(db, status)
+            received = [await receive(subscription) for _ in range(5)]
+            last_id = received[-1][0]
+
+            # Every event is past its retention period
+            db.query(DocumentEvent).update({DocumentEvent.created_at: datetime(2000, 1, 1)})
+            db.commit()
+            broker._prune(db)
+            publish(db, "deleted")
+            event_id, _, payload = await receive(subscription)
+            assert event_id > last_id and payload["status"] == "deleted"
+
+            # A position from before the table was emptied (plain rowids hand out 1 again)
+            db.query(DocumentEvent).delete()
+            db.commit()
+            broker._last_id = event_id + 1000
+            publish(db, "pending")
+            _, _, payload = await receive(subscription)
+            assert payload["status"] == "pending"
+        finally:
+            broker.unsubscribe(subscription)
+            await broker.stop()
+
+    asyncio.run(scenario())
+
+def test_stream_starts_with_snapshot(api_base, new_notebook):
+    notebook_id = new_notebook("events test")
+    assert httpx.get(f"{api_base}/notebooks/999999/events").status_code == 404
+    with httpx.stream("GET", f"{api_base}/notebooks/{notebook_id}/events", timeout=10) as response:
+        assert response.status_code == 200
+        lines = response.iter_lines()
+        assert next(lines) == "retry: 3000"
+        assert next(lines) == ""
+        assert next(lines).startswith("id: ")
+        assert next(lines) == "event: snapshot"
@@ -0,0 +1,15 @@
+"""
+测试 HTML 转纯文本：<pre> 中的块级标签不能吞掉已收集的文本，也不能打乱其中的空白。
+"""
+from backend.html_text import html_to_text, iter_html_lines
+import io
+
+def test_block_tags_inside_pre():
+    assert html_to_text("<pre>line1\n  <div>indented</div>\nline3</pre>") == "line1\n  indented\nline3"
+    html = "<p>before</p><pre>a\n<p>b</p>\n<li>c</li><br>d\n<pre>  e</pre>\nf</pre><p>after</p>"
+    assert html_to_text(html) == "before\n\na\nb\nc\nd\n  e\nf\n\nafter"
+
+def test_pre_split_across_chunks():
+    html = "<pre>line1\n  <div>indented</div>\nline3</pre><ul><li>item</li></ul>"
+    lines = list(iter_html_lines(io.StringIO(html), chunk_size=7))
+    assert lines[:5] == ["line1", "  indented", "line3", "", "- item"]
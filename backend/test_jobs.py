@@ -0,0 +1,60 @@
+"""
+测试提取进程池被回收时的任务处理：排队中的提取被另一个任务的回收取消后，
+提取会重新提交；文档处理因此被取消时，任务立即回到队列，不算一次失败尝试。
+"""
+import asyncio
+import concurrent.futures
+from datetime import timedelta
+import pytest
+from backend.extraction import ExtractionEngine, ExtractionInterrupted
+from backend.jobs import WORKER_ID, JobWorker, enqueue_document, utcnow
+from backend.models import ProcessingJob
+
+class RecyclingExecutor:
+    """Cancels the first ``cancelled`` submissions, as a recycle does to work still waiting for a worker"""
+
+    def __init__(self, cancelled: int):
+        self.cancelled = cancelled
+        self.submitted = 0
+
+    def submit(self, fn, *args):
+        self.submitted += 1
+        future = concurrent.futures.Future()
+        if self.submitted <= self.cancelled:
+            future.cancel()
+        else:
+            future.set_result(fn(*args))
+        return future
+
+def engine_with(executor) -> ExtractionEngine:
+    engine = ExtractionEngine(max_workers=1)
+    engine._get_executor = lambda: executor
+    return engine
+
+def test_cancelled_submission_is_resubmitted():
+    executor = RecyclingExecutor(cancelled=1)
+    assert asyncio.run(engine_with(executor).run(sum, [1, 2])) == 3
+    assert executor.submitted == 2
+
+def test_repeated_recycles_interrupt_the_extraction():
+    with pytest.raises(ExtractionInterrupted):
+        asyncio.run(engine_with(RecyclingExecutor(cancelled=2)).run(sum, [1, 2]))
+
+def test_interrupted_job_is_requeued(db, new_notebook, add_document, monkeypatch):
+    document_id = add_document(new_notebook(), "任务测试文档", status="processing")
+    job = enqueue_document(db, document_id)
+    db.flush()
+    job.status, job.attempts, job.lease_owner = "running", 1, WORKER_ID
+    job.lease_expires_at = utcnow() + timedelta(minutes=5)
+    db.commit()
+
+    async def cancelled_processing(document_id):
+        # What a cancelled pool future looks like from the job's side
+        raise asyncio.CancelledError
+
+    monkeypatch.setattr("backend.jobs.process_document", cancelled_processing)
+    asyncio.run(JobWorker()._execute(job.id, document_id))
+
+    db.expire_all()
+    job = db.get(ProcessingJob, job.id)
+    assert (job.status, job.attempts, job.lease_owner, job.last_error) == ("queued", 0, None, None)
@@ -0,0 +1,179 @@
+"""
+测试 LLM 调用层的截止时间、重试和对冲请求，以及客户端池的空闲回收；针对本地假 LLM 服务（fake_llm.py）运行。
+"""
+from contextlib import contextmanager
+import asyncio
+import time
+import openai
+from backend.config import settings
+from backend.fake_llm import Behaviour, FakeLLMServer, BAD_REQUEST, ERROR, OK, STALL
+from backend.llm import LLMClientRegistry
+from backend.llm_calls import DeadlineExceeded, FirstTokenTimeout, invoke_chat, stream_chat
+from langchain_core.messages import HumanMessage
+
+MESSAGES = [HumanMessage(content="hello")]
+
+_server = None
+_base_url = None
+
+def fake_server() -> FakeLLMServer:
+    global _server, _base_url
+    if _server is None:
+        _server = FakeLLMServer()
+        _base_url = _server.start()
+    _server.reset(Behaviour(ttft=0.05, tokens_per_second=0, tokens=5))
+    return _server
+
+@contextmanager
+def configured(**overrides):
+    """Override settings for one test"""
+    defaults = {
+        "LLM_TIMEOUT": 2, "LLM_TOTAL_TIMEOUT": 10.0, "LLM_MAX_RETRIES": 2,
+        "LLM_RETRY_BASE_DELAY": 0.05, "LLM_RETRY_MAX_DELAY": 0.1,
+        "LLM_HEDGE": False, "LLM_HEDGE_AFTER": None
+    }
+    defaults.update(overrides)
+    saved = {key: getattr(settings, key) for key in defaults}
+    for key, value in defaults.items():
+        setattr(settings, key, value)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            setattr(settings, key, value)
+
+async def _collect(call):
+    """Run call(llm) with a client of its own; returns (result, seconds)"""
+    registry = LLMClientRegistry()
+    registry.start()
+    try:
+        with registry.lease("test-key", "fake-model", 0.0, 100, _base_url) as llm:
+            start = time.monotonic()
+            result = await call(llm)
+            return result, time.monotonic() - start
+    finally:
+        await registry.aclose()
+
+async def _stream_text(llm):
+    parts = []
+    async for chunk in stream_chat(llm, MESSAGES, "fake-model"):
+        parts.append(chunk.content)
+    return "".join(parts)
+
+def run(call):
+    return asyncio.run(_collect(call))
+
+def wait_idle(server: FakeLLMServer, timeout: float = 2.0) -> bool:
+    """Whether every upstream stream was closed within timeout"""
+    deadline = time.monotonic() + timeout
+    while server.active and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return server.active == 0
+
+def test_streams_answer():
+    server = fake_server()
+    with configured():
+        text, _ = run(_stream_text)
+    assert text == "tok0 tok1 tok2 tok3 tok4 "
+    assert server.requests == 1
+
+def test_retries_transient_errors():
+    server = fake_server()
+    server.script.extend([ERROR, ERROR, OK])
+    with configured():
+        text, _ = run(_stream_text)
+    assert text.startswith("tok0")
+    assert server.requests == 3
+
+def test_gives_up_after_max_retries():
+    server = fake_server()
+    server.script.extend([ERROR, ERROR, ERROR, OK])
+    with configured(LLM_MAX_RETRIES=2):
+        try:
+            run(_stream_text)
+            assert False, "expected the last error to be raised"
+        except openai.APIStatusError as e:
+            assert e.status_code == 503
+    assert server.requests == 3
+
+def test_does_not_retry_bad_requests():
+    server = fake_server()
+    server.script.append(BAD_REQUEST)
+    with configured():
+        try:
+            run(_stream_text)
+            assert False, "expected BadRequestError"
+        except openai.BadRequestError:
+            pass
+    assert server.requests == 1
+
+def test_first_token_deadline_retries_stalled_request():
+    server = fake_server()
+    server.script.extend([STALL, OK])
+    with configured(LLM_TIMEOUT=0.5):
+        text, elapsed = run(_stream_text)
+    assert text.startswith("tok0")
+    assert server.requests == 2
+    assert 0.5 <= elapsed < 1.5, elapsed
+    assert wait_idle(server), "the stalled request was not aborted"
+
+def test_first_token_deadline_without_retries():
+    server = fake_server()
+    server.script.append(STALL)
+    with configured(LLM_TIMEOUT=0.3, LLM_MAX_RETRIES=0):
+        try:
+            run(_stream_text)
+            assert False, "expected FirstTokenTimeout"
+        except FirstTokenTimeout:
+            pass
+    assert wait_idle(server)
+
+def test_total_deadline_aborts_slow_answer():
+    server = fake_server()
+    server.behaviour = Behaviour(ttft=0.05, tokens_per_second=10, tokens=100)
+    with configured(LLM_TOTAL_TIMEOUT=0.5):
+        start = time.monotonic()
+        try:
+            run(_stream_text)
+            assert False, "expected DeadlineExceeded"
+        except DeadlineExceeded:
+            pass
+        assert time.monotonic() - start < 1.5
+    assert wait_idle(server), "the upstream stream was not closed"
+
+def test_hedge_wins_over_stalled_request():
+    server = fake_server()
+    server.script.extend([STALL, OK])
+    with configured(LLM_TIMEOUT=5, LLM_HEDGE=True, LLM_HEDGE_AFTER=0.2, LLM_MAX_RETRIES=0):
+        text, elapsed = run(_stream_text)
+    assert text.startswith("tok0")
+    assert server.requests == 2
+    assert elapsed < 1.0, elapsed  # answered by the hedge, well before the first-token deadline
+    assert wait_idle(server), "the losing request was not aborted"
+
+def test_invoke_collects_text():
+    fake_server()
+    with configured():
+        text, _ = run(lambda llm: invoke_chat(llm, MESSAGES, "fake-model"))
+    assert text == "tok0 tok1 tok2 tok3 tok4 "
+
+def test_idle_clients_close_without_traffic():
+    fake_server()
+
+    async def scenario():
+        registry = LLMClientRegistry(idle_ttl=0.2)
+        registry.start()
+        try:
+            with registry.lease("test-key", "fake-model", 0.0, 100, _base_url):
+                client = next(iter(registry._clients.values()))
+                await asyncio.sleep(0.5)
+                assert registry._clients, "a leased client must stay open"
+            # No further lease() calls; the periodic sweep has to close it
+            await asyncio.sleep(0.5)
+            assert not registry._clients
+            assert client.http_client.is_closed and client.http_async_client.is_closed
+        finally:
+            await registry.aclose()
+        assert registry._sweeper is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,38 @@
+"""
+测试维护任务的租约锁：多个服务进程同时启动时，只有一个能拿到锁并运行启动维护（回填、迁移等），
+其余的跳过；持有者崩溃后，租约过期即可被接管。
+"""
+from datetime import timedelta
+from backend.jobs import WORKER_ID, acquire_lock, release_lock, run_exclusive, utcnow
+from backend.models import MaintenanceLock
+
+def test_one_holder_at_a_time(db):
+    assert acquire_lock(db, "test-lock", worker_id="a")
+    assert not acquire_lock(db, "test-lock", worker_id="b")
+    assert acquire_lock(db, "test-lock", worker_id="a")  # extending our own lease
+    release_lock(db, "test-lock", worker_id="b")  # not ours: no effect
+    assert not acquire_lock(db, "test-lock", worker_id="b")
+    release_lock(db, "test-lock", worker_id="a")
+    assert acquire_lock(db, "test-lock", worker_id="b")
+    release_lock(db, "test-lock", worker_id="b")
+
+def test_lapsed_lease_is_taken_over(db):
+    assert acquire_lock(db, "crashed", worker_id="a")
+    db.query(MaintenanceLock).filter(MaintenanceLock.name == "crashed").update(
+        {MaintenanceLock.expires_at: utcnow() - timedelta(seconds=1)}
+    )
+    db.commit()
+    assert acquire_lock(db, "crashed", worker_id="b")
+
+def test_run_exclusive_skips_while_held(db):
+    ran = []
+    assert acquire_lock(db, "maintenance", worker_id="other")
+    assert not run_exclusive(db, "maintenance", [lambda db: ran.append(1)])
+    assert ran == []
+    release_lock(db, "maintenance", worker_id="other")
+
+    assert run_exclusive(db, "maintenance", [lambda db: ran.append(1), lambda db: ran.append(2)])
+    assert ran == [1, 2]
+    # Released afterwards
+    assert acquire_lock(db, "maintenance", worker_id="other")
+    assert not acquire_lock(db, "maintenance", worker_id=WORKER_ID)
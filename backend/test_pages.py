@@ -0,0 +1,61 @@
+"""
+测试文档分页文本的存储：文档处理完成后，页面只保留在文档正文中的偏移量，
+分页接口、章节读取与旧数据迁移都从压缩存储的正文中切出每页文本。
+"""
+from backend.chunking import page_starts_for
+from backend.ingestion import DocumentIngest, checkpointed_pages, load_sections, release_page_text
+from backend.models import Document, DocumentPage
+from backend.routers.documents import get_document_pages
+
+SECTIONS = ["第一页 向量检索", "", "第三页 分页存储\n第二行"]
+
+def page_rows(db, document_id: int):
+    db.expire_all()
+    return db.query(DocumentPage).filter(DocumentPage.document_id == document_id).order_by(DocumentPage.page_number).all()
+
+def ingested(db, document_id: int):
+    """Write a document's pages and text as processing does"""
+    document = db.get(Document, document_id)
+    ingest = DocumentIngest(db, document)
+    pages = []
+    for number, (text, start) in enumerate(zip(SECTIONS, page_starts_for(SECTIONS)), start=1):
+        pages.append((number, text, start))
+        ingest.text.write(text if number == 1 else "\n" + text)
+    ingest.section_count = len(SECTIONS)
+    ingest._write_batch([], pages)
+    # Until the text is stored, the pages are the checkpoint a retry resumes from
+    assert [page.content for page in page_rows(db, document_id)] == SECTIONS
+    ingest._store_text()
+    db.commit()
+    return document
+
+def test_completed_pages_are_slices_of_the_document_text(db, new_notebook, add_document):
+    document_id = add_document(new_notebook(), "", status="processing")
+    document = ingested(db, document_id)
+
+    assert all(page.content == "" for page in page_rows(db, document_id))
+    assert load_sections(db, document_id) == SECTIONS
+    response = get_document_pages(document_id, start=2, count=5, db=db)
+    assert response.total_pages == 3
+    assert [(page.page_number, page.content) for page in response.pages] == [(2, SECTIONS[1]), (3, SECTIONS[2])]
+
+    # Reprocessing extracts the pages again rather than resuming from empty ones
+    assert checkpointed_pages(db, document) == {}
+    assert page_rows(db, document_id) == []
+
+def test_release_page_text_keeps_pages_that_do_not_match(db, new_notebook, add_document):
+    notebook_id = new_notebook()
+    matching = add_document(notebook_id, "\n".join(SECTIONS))
+    stale = add_document(notebook_id, "重新提取后的正文")
+    for document_id in (matching, stale):
+        db.add_all([
+            DocumentPage(document_id=document_id, page_number=number, content=text,
+                         start_offset=start, char_count=len(text))
+            for number, (text, start) in enumerate(zip(SECTIONS, page_starts_for(SECTIONS)), start=1)
+        ])
+    db.commit()
+
+    assert release_page_text(db) == 1
+    assert [page.content for page in page_rows(db, matching)] == ["", "", ""]
+    assert [page.content for page in page_rows(db, stale)] == SECTIONS
+    assert load_sections(db, matching) == SECTIONS
@@ -0,0 +1,39 @@
+"""
+测试按 token 预算裁剪文档：没有分块的文档按估算的大小参与分配并被截断，而不是整篇塞进提示词；
+换模型后，分块的旧 token 数先顶用，请求里不写数据库，由任务进程在空闲时重新计数。
+"""
+from backend.models import DocumentChunk
+from backend.retrieval import fit_documents
+from backend.tokens import ESTIMATOR, configured_model, get_tokenizer, recount_pending, recount_requested
+
+class OtherTokenizer:
+    """Stands in for the tokenizer of a previously configured model"""
+    name = "other"
+
+    def count_many(self, texts):
+        return [len(text) for text in texts]
+
+def encodings(db, document_id: int) -> set:
+    rows = db.query(DocumentChunk.token_encoding).filter(DocumentChunk.document_id == document_id)
+    return {encoding for (encoding,) in rows}
+
+def test_document_without_chunks_is_cut_to_its_share(db, new_notebook, add_document):
+    text = "没有分块的长文档。" * 2000
+    document_id = add_document(new_notebook(), text)
+    budget = ESTIMATOR.count(text) // 4
+    fitted, truncated = fit_documents(db, [document_id], budget)[document_id]
+    assert truncated
+    assert 0 < ESTIMATOR.count(fitted) <= budget
+
+def test_stale_counts_are_recounted_outside_the_request(db, new_notebook, add_document):
+    text = "换了模型之后的文档。" * 100
+    document_id = add_document(new_notebook(), text, pieces=[(0, 500), (500, 1000)], tokenizer=OtherTokenizer())
+    fitted, truncated = fit_documents(db, [document_id], 10000, ESTIMATOR)[document_id]
+    assert (fitted, truncated) == (text, False)
+    assert not db.dirty and not db.new
+    assert encodings(db, document_id) == {"other"}
+
+    assert recount_pending()
+    assert recount_requested(db) == 2
+    assert not recount_pending()
+    assert encodings(db, document_id) == {get_tokenizer(configured_model(db)).name}
@@ -0,0 +1,29 @@
+"""
+测试全文检索的笔记本范围：检索只在所问笔记本的分块中打分，其他笔记本的相同内容不会出现；
+未处理完成的文档在 LIMIT 之前就被排除，调用方仍能拿到完整的 top-k。
+"""
+from backend.models import DocumentChunk
+from backend.search import fts_available, search_chunks
+
+def chunked(add_document, db, notebook_id: int, texts, status: str = "completed"):
+    """Add a document with one chunk per text; returns the chunk ids"""
+    pieces, start = [], 0
+    for text in texts:
+        pieces.append((start, start + len(text)))
+        start += len(text) + 1
+    document_id = add_document(notebook_id, "\n".join(texts), status=status, pieces=pieces)
+    return [chunk_id for (chunk_id,) in db.query(DocumentChunk.id).filter(DocumentChunk.document_id == document_id)]
+
+def test_search_is_scoped_to_completed_documents_of_the_notebook(db, new_notebook, add_document):
+    assert fts_available()
+    first, second = new_notebook("first"), new_notebook("second")
+    texts = [f"向量检索 第{i}段" for i in range(5)]
+    # A processing document whose chunks would otherwise fill the top-k
+    chunked(add_document, db, first, ["向量检索 向量检索 向量检索"] * 5, status="processing")
+    completed = chunked(add_document, db, first, texts)
+    other = chunked(add_document, db, second, texts)
+
+    hits = search_chunks(db, first, "向量检索", limit=5)
+    assert sorted(chunk_id for chunk_id, _ in hits) == sorted(completed)
+    assert all(score > 0 for _, score in hits)
+    assert sorted(chunk_id for chunk_id, _ in search_chunks(db, second, "向量检索", limit=5)) == sorted(other)
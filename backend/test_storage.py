@@ -0,0 +1,68 @@
+"""
+测试内容寻址存储的引用计数：删除最后一个引用某文件的文档，与再次上传相同内容同时发生时，
+新文档引用的文件和 blob 记录都必须保留下来。
+"""
+import hashlib
+import io
+import os
+import threading
+import time
+import uuid
+from backend.models import Blob, Document
+from backend.storage import adopt_blob, blob_path, release_blobs, stage_file
+
+def staged(content: bytes):
+    return stage_file(io.BytesIO(content))
+
+def add_blob_document(db, notebook_id: int, blob):
+    document = Document(
+        notebook_id=notebook_id, filename="a.txt", file_type="text/plain",
+        file_url=blob.path, file_size=blob.size, content_hash=blob.sha256
+    )
+    db.add(document)
+    return document
+
+def unreferenced_blob(db, notebook_id: int, content: bytes) -> str:
+    """Store content, then delete its only document, leaving a ref_count=0 blob"""
+    blob = adopt_blob(db, *staged(content))
+    document = add_blob_document(db, notebook_id, blob)
+    db.commit()
+    db.delete(document)
+    db.commit()
+    return blob.sha256
+
+def blob_state(db, sha256: str):
+    db.expire_all()
+    row = db.query(Blob).filter(Blob.sha256 == sha256).first()
+    return (row.ref_count if row else None), os.path.exists(blob_path(sha256))
+
+def test_release_waits_for_adoption(db, sessions, new_notebook):
+    notebook_id = new_notebook()
+    content = uuid.uuid4().bytes * 100
+    sha256 = unreferenced_blob(db, notebook_id, content)
+
+    # The re-upload adopts the unreferenced blob, then a release runs before its document is committed
+    uploader = sessions()
+    blob = adopt_blob(uploader, *staged(content))
+    releaser_session = sessions()
+    releaser = threading.Thread(target=lambda: release_blobs(releaser_session, [sha256]))
+    releaser.start()
+    time.sleep(0.3)
+    add_blob_document(uploader, notebook_id, blob)
+    uploader.commit()
+    uploader.close()
+    releaser.join()
+
+    assert blob_state(db, sha256) == (1, True)
+
+def test_adoption_after_release_recreates_blob(db, new_notebook):
+    notebook_id = new_notebook()
+    content = uuid.uuid4().bytes * 100
+    sha256 = unreferenced_blob(db, notebook_id, content)
+    assert release_blobs(db, [sha256]) == 1
+    assert blob_state(db, sha256) == (None, False)
+    blob = adopt_blob(db, *staged(content))
+    add_blob_document(db, notebook_id, blob)
+    db.commit()
+    assert blob_state(db, sha256) == (1, True)
+    assert hashlib.sha256(content).hexdigest() == sha256
@@ -0,0 +1,107 @@
+"""
+测试客户端断开后流式接口释放资源的速度
+
+启动本地的假 LLM 服务（fake_llm.py，缓慢地逐个输出 token）和应用本身，
+对 /chat/ 与 /content/stream 各发起一次流式请求，收到几个 token 后断开，
+然后测量以下资源被释放所用的时间：
+  - 上游：假服务看到请求被中止
+  - LLM 客户端租约归还
+  - 数据库连接归还连接池
+  - 已生成的部分结果被保存（chat 为 interrupted 状态的回答，内容生成为一条笔记）
+"""
+import time
+import httpx
+import pytest
+from backend.database import SessionLocal, engine
+from backend.fake_llm import Behaviour, FakeLLMServer
+from backend.llm import llm_clients
+from backend.models import Message, Note
+
+# Release deadline for every resource, in seconds
+MAX_RELEASE_SECONDS = 1.0
+# 20 s of output, far longer than the test waits
+UPSTREAM = Behaviour(ttft=0.05, tokens_per_second=20, tokens=400)
+
+def wait_until(condition, timeout: float) -> float:
+    """Seconds until condition() held, or None if it did not within timeout"""
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if condition():
+            return time.monotonic() - start
+        time.sleep(0.005)
+    return None
+
+@pytest.fixture
+def environment(api_base, new_notebook, add_document):
+    """(slow fake upstream, notebook with one document), with the app configured to use the upstream"""
+    upstream = FakeLLMServer(UPSTREAM)
+    upstream_url = upstream.start()
+    config = {
+        "llm.api_key": "test-key",
+        "llm.model_id": "fake-model",
+        "llm.base_url": upstream_url,
+        "llm.max_tokens": "1000"
+    }
+    for key, value in config.items():
+        httpx.post(f"{api_base}/config/", params={"key": key, "value": value, "category": "llm"}).raise_for_status()
+    notebook_id = new_notebook("disconnect test")
+    add_document(notebook_id, "断开连接测试文档。" * 50)
+    return upstream, notebook_id
+
+def interrupted_messages() -> int:
+    # Short-lived sessions: the test checks that no connection stays checked out
+    db = SessionLocal()
+    try:
+        return db.query(Message).filter(Message.role == "assistant", Message.status == "interrupted").count()
+    finally:
+        db.close()
+
+def interrupted_notes() -> int:
+    db = SessionLocal()
+    try:
+        return db.query(Note).filter(Note.title.like("%（生成中断）")).count()
+    finally:
+        db.close()
+
+def disconnect_after(url: str, payload: dict, events: int = 3):
+    """Open a stream, read a few content events, then drop the connection"""
+    with httpx.Client(timeout=30) as client:
+        with client.stream("POST", url, json=payload) as response:
+            received = 0
+            for line in response.iter_lines():
+                if line.startswith("data:") and '"content"' in line:
+                    received += 1
+                    if received >= events:
+                        break
+    assert received >= events, f"only {received} events before the stream ended"
+
+def measure(name: str, url: str, payload: dict, upstream: FakeLLMServer, saved) -> dict:
+    """Disconnect, then time each release; ``saved()`` counts stored partial results"""
+    saved_before = saved()
+    disconnect_after(url, payload)
+    timeout = MAX_RELEASE_SECONDS * 5
+    timings = {
+        "upstream": wait_until(lambda: upstream.active == 0, timeout),
+        "llm_lease": wait_until(lambda: not any(c.leases for c in list(llm_clients._clients.values())), timeout),
+        "db_connection": wait_until(lambda: engine.pool.checkedout() == 0, timeout),
+        "partial_result": wait_until(lambda: saved() > saved_before, timeout)
+    }
+
+    print(f"\n{name}: 断开后释放耗时")
+    for resource, seconds in timings.items():
+        print(f"  {resource:<16}{'未释放' if seconds is None else f'{seconds * 1000:.0f} ms'}")
+    return timings
+
+def check(timings: dict):
+    for resource, seconds in timings.items():
+        assert seconds is not None, f"{resource} was not released"
+        assert seconds <= MAX_RELEASE_SECONDS, f"{resource} took {seconds:.2f}s to be released"
+
+def test_chat_disconnect_releases_resources(api_base, environment):
+    upstream, notebook_id = environment
+    check(measure("chat", f"{api_base}/chat/", {"notebook_id": notebook_id, "message": "测试"}, upstream, interrupted_messages))
+
+def test_content_stream_disconnect_releases_resources(api_base, environment):
+    upstream, notebook_id = environment
+    payload = {"notebook_id": notebook_id, "content_type": "report"}
+    check(measure("content/stream", f"{api_base}/content/stream", payload, upstream, interrupted_notes))
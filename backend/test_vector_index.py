@@ -0,0 +1,94 @@
+"""
+测试稠密向量索引的分段存储
+
+每次添加文档只写入它自己的向量段，相邻的段按大小合并；替换和删除文档后检索结果正确；
+读取方拿到的清单指向已被合并删除的段时，会重新读取清单而不是报错。
+"""
+import os
+import threading
+from backend.vector_index import VectorIndex
+
+TEXTS = {
+    1: ["苹果 香蕉 水果", "苹果 种植 技术"],
+    2: ["数据库 索引 查询"],
+    3: ["机器 学习 模型 训练"],
+    4: ["量子 计算 比特"],
+}
+
+def build(index: VectorIndex, notebook_id: int):
+    for document_id, texts in TEXTS.items():
+        chunk_ids = [document_id * 100 + i for i in range(len(texts))]
+        index.add_document(notebook_id, document_id, chunk_ids, texts)
+
+def vector_files(index: VectorIndex, notebook_id: int) -> set:
+    prefix = f"notebook_{notebook_id}."
+    return {name for name in os.listdir(index.directory) if name.startswith(prefix) and name.endswith(".npy")}
+
+def test_segments_stay_few_and_searchable(tmp_path):
+    index = VectorIndex(str(tmp_path))
+    for document_id in range(1, 65):
+        index.add_document(1, document_id, [document_id], [f"文档 {document_id} 内容"])
+    manifest = index._read_manifest(1)
+    assert len(manifest["segments"]) <= 7 and manifest["count"] == 64
+    # Only the files the manifest lists are left on disk
+    assert len(vector_files(index, 1)) == 2 * len(manifest["segments"])
+    assert len(index.load(1)) == 64
+
+def test_replace_and_remove_documents(tmp_path):
+    index = VectorIndex(str(tmp_path))
+    build(index, 1)
+    assert index.search(1, "数据库 查询", limit=1)[0][0] == 200
+
+    index.add_document(1, 2, [201], ["天文 望远镜"])
+    assert 200 not in [chunk_id for chunk_id, _ in index.search(1, "数据库 查询", limit=10)]
+    assert index.search(1, "天文 望远镜", limit=1)[0][0] == 201
+
+    index.remove_document(1, 1)
+    hits = [chunk_id for chunk_id, _ in index.search(1, "苹果", limit=10)]
+    assert 100 not in hits and 101 not in hits
+    assert len(index.load(1)) == 3
+
+def test_reader_rereads_manifest_when_segments_were_merged_away(tmp_path):
+    writer, reader = VectorIndex(str(tmp_path)), VectorIndex(str(tmp_path))
+    build(writer, 1)
+    stale = writer._read_manifest(1)
+
+    # A reader that read the manifest just before the writer merged its segments away
+    writer.add_document(1, 5, [500], ["新 文档"])
+    read_manifest = reader._read_manifest
+    reads = []
+    def racing_read(notebook_id):
+        reads.append(notebook_id)
+        return stale if len(reads) == 1 else read_manifest(notebook_id)
+    reader._read_manifest = racing_read
+    assert {entry["name"] for entry in stale["segments"]} - {
+        name.split(".")[1] for name in vector_files(writer, 1)
+    }
+    vectors = reader.load(1)
+    assert len(reads) == 2 and len(vectors) == 6
+
+def test_drop_waits_for_a_write_in_progress(tmp_path):
+    # Two instances share the directory like two processes: only the file lock orders them
+    writer, dropper = VectorIndex(str(tmp_path)), VectorIndex(str(tmp_path))
+    build(writer, 1)
+    saving, resume = threading.Event(), threading.Event()
+    save_segment = writer._save_segment
+    def slow_save(*args):
+        saving.set()
+        resume.wait(5)
+        return save_segment(*args)
+    writer._save_segment = slow_save
+
+    adding = threading.Thread(target=writer.add_document, args=(1, 5, [500], ["新 文档"]))
+    adding.start()
+    assert saving.wait(5)
+    dropping = threading.Thread(target=dropper.drop_notebook, args=(1,))
+    dropping.start()
+    dropping.join(0.3)
+    assert dropping.is_alive()
+    resume.set()
+    adding.join(5)
+    dropping.join(5)
+
+    assert dropper.load(1) is None
+    assert os.listdir(tmp_path) == ["notebook_1.lock"]
@@ -0,0 +1,142 @@
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Optional, Set
+from backend.config import settings
+from backend.config_service import config_service
+from backend.models import DocumentChunk
+from backend.chunking import estimate_tokens
+import threading
+import logging
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Tokens a chat message adds around its content
+MESSAGE_OVERHEAD = 4
+
+class EstimateTokenizer:
+    """Local estimate for models without a known tokenizer"""
+
+    name = "estimate"
+
+    def count(self, text: str) -> int:
+        return estimate_tokens(text)
+
+    def count_many(self, texts: List[str]) -> List[int]:
+        return [estimate_tokens(text) for text in texts]
+
+class TiktokenTokenizer:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.name = f"tiktoken:{encoding.name}"
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode_ordinary(text))
+
+    def count_many(self, texts: List[str]) -> List[int]:
+        return [len(tokens) for tokens in self.encoding.encode_ordinary_batch(texts)]
+
+ESTIMATOR = EstimateTokenizer()
+
+_tokenizers: Dict[str, object] = {}
+
+def _load_tokenizer(model: Optional[str]):
+    if settings.TOKENIZER == "estimate" or not TIKTOKEN_AVAILABLE:
+        return ESTIMATOR
+    try:
+        if settings.TOKENIZER != "auto":
+            return TiktokenTokenizer(tiktoken.get_encoding(settings.TOKENIZER))
+        if not model:
+            return ESTIMATOR
+        try:
+            return TiktokenTokenizer(tiktoken.encoding_for_model(model))
+        except KeyError:
+            return ESTIMATOR  # not a model tiktoken knows
+    except Exception as e:
+        # tiktoken downloads its encodings on first use, which fails offline
+        logger.warning(f"Could not load a tokenizer for {model or settings.TOKENIZER}, using the estimate: {e}")
+        return ESTIMATOR
+
+def get_tokenizer(model: Optional[str] = None):
+    """Tokenizer for the given model per TOKENIZER; loaded once per model"""
+    key = f"{settings.TOKENIZER}:{model or ''}"
+    if key not in _tokenizers:
+        _tokenizers[key] = _load_tokenizer(model)
+    return _tokenizers[key]
+
+def configured_model(db: Session) -> str:
+    return config_service.get(db).llm_settings.model
+
+def chunk_token_count(tokenizer, token_count: int, token_encoding: Optional[str], content: str) -> int:
+    """A chunk's cached token count when it was measured by this tokenizer, else a fresh count"""
+    if (token_encoding or ESTIMATOR.name) == tokenizer.name:
+        return token_count
+    return tokenizer.count(content)
+
+def refresh_token_counts(db: Session, document_ids: Iterable[int], tokenizer, batch_size: int = 500) -> int:
+    """Recount the chunks of these documents that were measured by another tokenizer.
+
+    Only needed after the model (and so the tokenizer) changes; the new counts
+    are cached on the chunks. Commits.
+    """
+    document_ids = list(document_ids)
+    if not document_ids:
+        return 0
+    recounted = 0
+    last_id = 0
+    while True:
+        rows = db.query(DocumentChunk.id, DocumentChunk.content).filter(
+            DocumentChunk.document_id.in_(document_ids),
+            func.coalesce(DocumentChunk.token_encoding, ESTIMATOR.name) != tokenizer.name,
+            DocumentChunk.id > last_id
+        ).order_by(DocumentChunk.id).limit(batch_size).all()
+        if not rows:
+            break
+        counts = tokenizer.count_many([content for _, content in rows])
+        db.bulk_update_mappings(DocumentChunk, [
+            {"id": chunk_id, "token_count": count, "token_encoding": tokenizer.name}
+            for (chunk_id, _), count in zip(rows, counts)
+        ])
+        db.commit()
+        recounted += len(rows)
+        last_id = rows[-1][0]
+    if recounted:
+        logger.info(f"Recounted tokens of {recounted} chunks with {tokenizer.name}")
+    return recounted
+
+_recount_requests: Set[int] = set()
+_recount_lock = threading.Lock()
+
+def request_recount(document_ids: Iterable[int]):
+    """Ask the job worker to recount these documents' chunks with the configured model's tokenizer.
+
+    Prompts are built from the stale counts in the meantime, so no request
+    has to retokenise a notebook after the model changes.
+    """
+    with _recount_lock:
+        _recount_requests.update(document_ids)
+
+def recount_pending() -> bool:
+    return bool(_recount_requests)
+
+def recount_requested(db: Session) -> int:
+    """Recount what request_recount asked for. Blocking; the job worker runs it when idle"""
+    with _recount_lock:
+        document_ids = list(_recount_requests)
+        _recount_requests.clear()
+    return refresh_token_counts(db, document_ids, get_tokenizer(configured_model(db)))
+
+def prompt_budget(tokenizer, fixed_texts: Iterable[str], output_tokens: int, context_window: int = None,
+                  cap: int = None) -> int:
+    """Tokens left for document text once the fixed prompt parts and the answer are accounted for"""
+    context_window = context_window or settings.LLM_CONTEXT_WINDOW
+    used = sum(tokenizer.count(text) + MESSAGE_OVERHEAD for text in fixed_texts)
+    budget = context_window - output_tokens - used - settings.PROMPT_TOKEN_MARGIN
+    if cap is not None:
+        budget = min(budget, cap)
+    return max(budget, 0)
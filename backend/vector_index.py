@@ -0,0 +1,333 @@
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from backend.config import settings
+from backend.search import segment
+import hashlib
+import json
+import math
+import os
+import threading
+import uuid
+import numpy as np
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers in one process are still serialised
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+VECTOR_DIR = settings.VECTOR_INDEX_DIR or os.path.join(os.path.dirname(__file__), "vectors")
+os.makedirs(VECTOR_DIR, exist_ok=True)
+
+class HashingEmbedder:
+    """Offline embedding: hashed CJK bigrams and words with sublinear TF.
+
+    Needs no model download or network, so it works everywhere as a
+    stand-in for a learned embedding model.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = None):
+        self.dim = dim or settings.EMBEDDING_DIM
+
+    def _bucket(self, token: str) -> Tuple[int, float]:
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        # The sign bit keeps colliding tokens from always adding up
+        return value % self.dim, 1.0 if (value >> 63) else -1.0
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts: Dict[str, int] = {}
+            for token in segment(text):
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                bucket, sign = self._bucket(token)
+                matrix[row, bucket] += sign * (1.0 + math.log(count))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+EMBEDDERS: Dict[str, Callable[[], object]] = {
+    "hashing": HashingEmbedder
+}
+
+def register_embedder(name: str, factory: Callable[[], object]):
+    """Make an embedding backend selectable through EMBEDDING_BACKEND.
+
+    The factory returns an object with a ``name``, a ``dim`` and an
+    ``embed(texts) -> float32 array`` method returning L2-normalised rows.
+    """
+    EMBEDDERS[name] = factory
+
+_embedder = None
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        _embedder = EMBEDDERS[settings.EMBEDDING_BACKEND]()
+    return _embedder
+
+class Segment:
+    """An immutable pair of memory-mapped files: (n, 2) int64 ``ids`` rows of
+    (chunk_id, document_id) matching the rows of the (n, dim) float32 ``matrix``"""
+
+    def __init__(self, name: str, ids: np.ndarray, matrix: np.ndarray):
+        self.name = name
+        self.ids = ids
+        self.matrix = matrix
+
+class NotebookVectors:
+    """One notebook's vectors as of a manifest generation.
+
+    ``segments`` pairs each segment with a mask of its live rows, or None
+    when none of its documents were removed since it was written.
+    """
+
+    def __init__(self, generation: int, segments: List[Tuple[Segment, Optional[np.ndarray]]]):
+        self.generation = generation
+        self.segments = segments
+
+    def __len__(self):
+        return sum(len(seg.ids) if live is None else int(live.sum()) for seg, live in self.segments)
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self.segments[0][0].matrix.shape[1] if self.segments else None
+
+class VectorIndex:
+    """Per-notebook dense vector store answering top-k queries with matrix-vector products.
+
+    A notebook's vectors live in immutable segment files listed by a small
+    manifest. Adding a document writes a segment holding just its vectors;
+    removing one drops its segment or masks its rows. Neighbouring segments
+    are merged once the older one is no bigger than the newer, so there are
+    O(log n) segments and each vector is rewritten O(log n) times. Every
+    change atomically swaps in a new manifest, so readers in any process
+    always see a complete, consistent set of segments.
+    """
+
+    def __init__(self, directory: str = VECTOR_DIR):
+        self.directory = directory
+        self._cache: Dict[int, NotebookVectors] = {}
+        self._segments: Dict[Tuple[int, str], Segment] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, notebook_id: int, name: str) -> str:
+        return os.path.join(self.directory, f"notebook_{notebook_id}.{name}")
+
+    def _read_manifest(self, notebook_id: int) -> Optional[dict]:
+        try:
+            with open(self._path(notebook_id, "json"), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if "segments" not in manifest:
+            # Written before segments: the whole matrix is one segment named after its generation
+            name = str(manifest["generation"])
+            ids = np.load(self._path(notebook_id, f"{name}.ids.npy"), mmap_mode="r")
+            manifest["segments"] = [{
+                "name": name,
+                "count": len(ids),
+                "documents": sorted({int(document_id) for document_id in ids[:, 1]}),
+                "deleted": []
+            }]
+            manifest["next_segment"] = 1
+        return manifest
+
+    def _segment(self, notebook_id: int, name: str) -> Segment:
+        seg = self._segments.get((notebook_id, name))
+        if seg is None:
+            seg = Segment(
+                name,
+                np.load(self._path(notebook_id, f"{name}.ids.npy"), mmap_mode="r"),
+                np.load(self._path(notebook_id, f"{name}.vectors.npy"), mmap_mode="r")
+            )
+            self._segments[(notebook_id, name)] = seg
+        return seg
+
+    def _open(self, notebook_id: int, manifest: dict) -> NotebookVectors:
+        segments = []
+        for entry in manifest["segments"]:
+            seg = self._segment(notebook_id, entry["name"])
+            live = ~np.isin(seg.ids[:, 1], entry["deleted"]) if entry["deleted"] else None
+            segments.append((seg, live))
+        names = {entry["name"] for entry in manifest["segments"]}
+        for key in [key for key in list(self._segments) if key[0] == notebook_id and key[1] not in names]:
+            self._segments.pop(key, None)
+        return NotebookVectors(manifest["generation"], segments)
+
+    def load(self, notebook_id: int) -> Optional[NotebookVectors]:
+        for _ in range(5):
+            try:
+                manifest = self._read_manifest(notebook_id)
+                if not manifest:
+                    return None
+                cached = self._cache.get(notebook_id)
+                if cached and cached.generation == manifest["generation"]:
+                    return cached
+                vectors = self._open(notebook_id, manifest)
+            except FileNotFoundError:
+                # A writer merged away a segment after we read the manifest: read the new one
+                continue
+            self._cache[notebook_id] = vectors
+            return vectors
+        logger.warning(f"Vector index of notebook {notebook_id} kept changing while loading it")
+        return None
+
+    def _save_segment(self, notebook_id: int, manifest: dict, ids: np.ndarray, matrix: np.ndarray) -> dict:
+        # Unique even after a notebook starts over, so no process keeps mapping a same-named old file
+        name = f"s{manifest['next_segment']}-{uuid.uuid4().hex[:8]}"
+        manifest["next_segment"] += 1
+        np.save(self._path(notebook_id, f"{name}.ids.npy"), np.ascontiguousarray(ids))
+        np.save(self._path(notebook_id, f"{name}.vectors.npy"), np.ascontiguousarray(matrix))
+        return {
+            "name": name,
+            "count": len(ids),
+            "documents": sorted({int(document_id) for document_id in ids[:, 1]}),
+            "deleted": []
+        }
+
+    def _merge(self, notebook_id: int, manifest: dict, entries: List[dict]) -> dict:
+        ids, matrix = [], []
+        for entry in entries:
+            seg = self._segment(notebook_id, entry["name"])
+            live = ~np.isin(seg.ids[:, 1], entry["deleted"]) if entry["deleted"] else slice(None)
+            ids.append(seg.ids[live])
+            matrix.append(seg.matrix[live])
+        return self._save_segment(notebook_id, manifest, np.concatenate(ids), np.concatenate(matrix))
+
+    @contextmanager
+    def _locked(self, notebook_id: int):
+        """Exclusive access to a notebook's files, across threads and processes"""
+        with self._lock, open(self._path(notebook_id, "lock"), "w") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _write(
+        self,
+        notebook_id: int,
+        document_id: int,
+        new_ids: Optional[np.ndarray] = None,
+        new_matrix: Optional[np.ndarray] = None
+    ):
+        """Remove a document's vectors, add ``new_ids``/``new_matrix`` in their
+        place if given, and publish the result as a new generation"""
+        with self._locked(notebook_id):
+            embedder = get_embedder()
+            manifest = self._read_manifest(notebook_id)
+            # Every segment this write comes across; those left unlisted are deleted at the end
+            seen = {entry["name"] for entry in manifest["segments"]} if manifest else set()
+            if manifest is None or self._dim(notebook_id, manifest) != embedder.dim:
+                # New, or built by an embedder of another size: start over
+                manifest = {"generation": manifest["generation"] if manifest else 0, "next_segment": 1, "segments": []}
+
+            segments = []
+            for entry in manifest["segments"]:
+                if document_id not in entry["documents"] or document_id in entry["deleted"]:
+                    segments.append(entry)
+                elif len(entry["documents"]) - len(entry["deleted"]) > 1:
+                    segments.append(dict(entry, deleted=entry["deleted"] + [document_id]))
+                # else: the segment held only this document's vectors
+            if new_ids is not None and len(new_ids):
+                segments.append(self._save_segment(notebook_id, manifest, new_ids, new_matrix))
+                seen.add(segments[-1]["name"])
+            while len(segments) >= 2 and segments[-2]["count"] <= segments[-1]["count"]:
+                segments[-2:] = [self._merge(notebook_id, manifest, segments[-2:])]
+                seen.add(segments[-1]["name"])
+
+            manifest.update(
+                generation=manifest["generation"] + 1,
+                segments=segments,
+                count=sum(entry["count"] for entry in segments),
+                dim=embedder.dim,
+                embedder=embedder.name
+            )
+            manifest_tmp = self._path(notebook_id, "json.tmp")
+            with open(manifest_tmp, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(manifest_tmp, self._path(notebook_id, "json"))
+
+            # Readers that mapped a dropped segment keep working off their open
+            # mapping; one that has not opened it yet re-reads the manifest
+            for name in seen - {entry["name"] for entry in segments}:
+                self._segments.pop((notebook_id, name), None)
+                for suffix in ("ids.npy", "vectors.npy"):
+                    try:
+                        os.remove(self._path(notebook_id, f"{name}.{suffix}"))
+                    except OSError:
+                        pass
+
+    def _dim(self, notebook_id: int, manifest: dict) -> int:
+        if "dim" in manifest:
+            return manifest["dim"]
+        if not manifest["segments"]:
+            return get_embedder().dim
+        return self._segment(notebook_id, manifest["segments"][0]["name"]).matrix.shape[1]
+
+    def add_document(
+        self,
+        notebook_id: int,
+        document_id: int,
+        chunk_ids: Sequence[int],
+        texts: Sequence[str],
+        vectors: Optional[np.ndarray] = None
+    ):
+        """Store a document's chunk vectors, replacing any it had before.
+
+        ``vectors`` may be passed when the texts were embedded beforehand.
+        """
+        if vectors is None and texts:
+            vectors = get_embedder().embed(texts)
+        new_ids = np.array([[chunk_id, document_id] for chunk_id in chunk_ids], dtype=np.int64).reshape(-1, 2)
+        self._write(notebook_id, document_id, new_ids, vectors if len(chunk_ids) else None)
+
+    def remove_document(self, notebook_id: int, document_id: int):
+        if not os.path.exists(self._path(notebook_id, "json")):
+            return
+        self._write(notebook_id, document_id)
+
+    def drop_notebook(self, notebook_id: int):
+        # Under the writers' lock, so a write in progress cannot leave a
+        # manifest behind that points at segments deleted here
+        with self._locked(notebook_id):
+            self._cache.pop(notebook_id, None)
+            for key in [key for key in list(self._segments) if key[0] == notebook_id]:
+                self._segments.pop(key, None)
+            prefix = f"notebook_{notebook_id}."
+            # The lock file stays: removing it while held would let the next
+            # writer lock a new file while a waiting one still holds the old
+            lock_name = os.path.basename(self._path(notebook_id, "lock"))
+            for name in os.listdir(self.directory):
+                if name.startswith(prefix) and name != lock_name:
+                    os.remove(os.path.join(self.directory, name))
+
+    def search(self, notebook_id: int, query: str, limit: int = 20) -> List[Tuple[int, float]]:
+        """Return (chunk_id, cosine similarity) for the nearest chunks, best first"""
+        vectors = self.load(notebook_id)
+        if vectors is None or not vectors.segments:
+            return []
+        embedder = get_embedder()
+        if vectors.dim != embedder.dim:
+            return []
+
+        query_vector = embedder.embed([query])[0]
+        hits: List[Tuple[int, float]] = []
+        for seg, live in vectors.segments:
+            scores = seg.matrix @ query_vector
+            if live is not None:
+                scores[~live] = 0.0
+            k = min(limit, len(scores))
+            if not k:
+                continue
+            top = np.argpartition(-scores, k - 1)[:k]
+            hits.extend((int(seg.ids[i, 0]), float(scores[i])) for i in top if scores[i] > 0)
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        return hits[:limit]
+
+vector_index = VectorIndex()
@@ -15,11 +15,30 @@ export interface Document {
   file_type: string
   file_url: string
   file_size: number
-  content?: string
   status: string
   created_at: string
 }
 
+export interface DocumentPages {
+  document_id: number
+  total_pages: number
+  start: number
+  pages: { page_number: number; start_offset?: number; char_count?: number; content: string }[]
+}
+
+export interface BatchUploadResult {
+  notebook_id: number
+  queued: number
+  rejected: number
+  files: { filename: string; status: string; document_id?: number; error?: string }[]
+}
+
+export interface DocumentProgress {
+  total: number
+  counts: Record<string, number>
+  documents: { id: number; filename: string; status: string; error?: string }[]
+}
+
 export interface Conversation {
   id: number
   notebook_id: number
@@ -66,8 +85,22 @@ export const documentsApi = {
     })
   },
   
+  uploadBatch: (notebookId: number, files: File[]) => {
+    const formData = new FormData()
+    files.forEach(file => formData.append('files', file))
+    return api.post<BatchUploadResult>(`/documents/upload-batch/${notebookId}`, formData, {
+      headers: { 'Content-Type': 'multipart/form-data' }
+    })
+  },
+  
+  getProgress: (notebookId: number, ids?: number[]) =>
+    api.get<DocumentProgress>(`/documents/progress/${notebookId}`, { params: ids ? { ids: ids.join(',') } : {} }),
+  
   delete: (id: number) => api.delete(`/documents/${id}`),
   
+  getPages: (id: number, start = 1, count = 10) =>
+    api.get<DocumentPages>(`/documents/${id}/pages`, { params: { start, count } }),
+  
   getPreviewUrl: (id: number) => `/api/v1/documents/preview/${id}`
 }
 
@@ -9,11 +9,32 @@ export const useNotebookStore = defineStore('notebook', () => {
   const conversations = ref<Conversation[]>([])
   const currentConversation = ref<Conversation | null>(null)
   const messages = ref<Message[]>([])
+  let documentEvents: EventSource | null = null
+
+  // Keep document statuses current from the server's event stream instead of polling
+  const watchDocuments = (notebookId: number) => {
+    documentEvents?.close()
+    documentEvents = new EventSource(`/api/v1/notebooks/${notebookId}/events`)
+    documentEvents.addEventListener('status', async (e) => {
+      const data = JSON.parse((e as MessageEvent).data)
+      const doc = documents.value.find(d => d.id === data.document_id)
+      if (doc) {
+        doc.status = data.status
+      } else {
+        documents.value = await notebooksApi.getDocuments(notebookId)
+      }
+    })
+    documentEvents.addEventListener('deleted', (e) => {
+      const data = JSON.parse((e as MessageEvent).data)
+      documents.value = documents.value.filter(d => d.id !== data.document_id)
+    })
+  }
 
   const loadNotebook = async (id: number) => {
     currentNotebook.value = await notebooksApi.get(id)
     documents.value = await notebooksApi.getDocuments(id)
     conversations.value = await chatApi.getConversations(id)
+    watchDocuments(id)
   }
 
   const loadMessages = async (conversationId: number) => {
@@ -50,6 +71,8 @@ export const useNotebookStore = defineStore('notebook', () => {
   }
 
   const reset = () => {
+    documentEvents?.close()
+    documentEvents = null
     currentNotebook.value = null
     documents.value = []
     conversations.value = []